@@ -0,0 +1,273 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# An in-memory stand-in for the googleapiclient Sheets v4 service returned by
+# get_google_sheets_service(). It understands the calls the scripts in this repo make
+# (spreadsheets.get / batchUpdate and values.get / update / batchUpdate / append), keeps
+# the written cells so results can be checked, rejects writes past a tab's grid the way
+# the API does (appendDimension grows it, values.append grows it as needed), records every
+# call, and can simulate per-call latency, a per-minute quota that answers 429 with Retry-After, and random
+# transient errors.
+
+DEFAULT_GRID = {'rowCount': 1000, 'columnCount': 26}  # What addSheet gives a tab without gridProperties
+RANGE_PATTERN = re.compile(r"^(?:'?(?P<sheet>[^'!]+)'?!)?(?P<col>[A-Z]+)?(?P<row>\d+)?(?::[A-Z]*\d*)?$")
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+class FakeRequest:
+    def __init__(self, service, method, handler, kwargs):
+        self.service = service
+        self.method = method
+        self.handler = handler
+        self.kwargs = kwargs
+
+    def execute(self):
+        return self.service.call(self.method, self.handler, self.kwargs)
+
+class FakeValues:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, **kwargs):
+        return FakeRequest(self.service, 'values.get', self.service.values_get, kwargs)
+
+    def update(self, **kwargs):
+        return FakeRequest(self.service, 'values.update', self.service.values_update, kwargs)
+
+    def batchUpdate(self, **kwargs):
+        return FakeRequest(self.service, 'values.batchUpdate', self.service.values_batch_update, kwargs)
+
+    def append(self, **kwargs):
+        return FakeRequest(self.service, 'values.append', self.service.values_append, kwargs)
+
+class FakeSpreadsheets:
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, **kwargs):
+        return FakeRequest(self.service, 'spreadsheets.get', self.service.spreadsheets_get, kwargs)
+
+    def batchUpdate(self, **kwargs):
+        return FakeRequest(self.service, 'spreadsheets.batchUpdate', self.service.spreadsheets_batch_update, kwargs)
+
+    def values(self):
+        return FakeValues(self.service)
+
+class FakeSheetsService:
+    """Drop-in replacement for the Sheets service object, safe to share between threads.
+
+    latency: seconds added to every call, plus up to latency_jitter more at random.
+    quota_per_minute: calls allowed in any 60 second window before answering 429.
+    retry_after: Retry-After sent with simulated 429s; by default the seconds until the window frees a call.
+    error_rate: share of calls that fail with a transient 503 (or 429 if error_status says so).
+    serialize: JSON-encode each request body on the calling thread, as googleapiclient does.
+    """
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, quota_per_minute=None, retry_after=None,
+                 error_rate=0.0, error_status=503, serialize=True, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.quota_per_minute = quota_per_minute
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.serialize = serialize
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent_calls = deque()
+        self.calls = []
+        self.sheets = {}  # spreadsheet_id -> {title: {'sheetId': int, 'properties': dict, 'cells': {row: [values]}}}
+        self.next_sheet_id = 1
+        self.wait_hint = 0
+
+    def spreadsheets(self):
+        return FakeSpreadsheets(self)
+
+    # Call bookkeeping
+
+    def call(self, method, handler, kwargs):
+        started = time.monotonic()
+        request_bytes = 0
+        if self.serialize and 'body' in kwargs:
+            request_bytes = len(json.dumps(kwargs['body']))
+        serialize_seconds = time.monotonic() - started
+        delay = self.latency + self.random.uniform(0, self.latency_jitter)
+        if delay:
+            time.sleep(delay)
+        with self.lock:
+            status = self.simulated_error_status(time.monotonic())
+            if status is None:
+                try:
+                    result = handler(**kwargs)
+                except HttpError as error:
+                    status = error.resp.status
+                    self.record(method, kwargs, started, status, request_bytes, serialize_seconds)
+                    raise
+            self.record(method, kwargs, started, status or 200, request_bytes, serialize_seconds)
+        if status is not None:
+            raise self.http_error(status, 'Quota exceeded for quota metric' if status == 429 else 'The service is currently unavailable.')
+        return result
+
+    def simulated_error_status(self, now):
+        if self.quota_per_minute:
+            while self.recent_calls and now - self.recent_calls[0] >= 60:
+                self.recent_calls.popleft()
+            if len(self.recent_calls) >= self.quota_per_minute:
+                self.wait_hint = 60 - (now - self.recent_calls[0])
+                return 429
+            self.recent_calls.append(now)
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self.error_status
+        return None
+
+    def record(self, method, kwargs, started, status, request_bytes=0, serialize_seconds=0.0):
+        body = kwargs.get('body') or {}
+        rows = len(body.get('values', [])) + sum(len(data.get('values', [])) for data in body.get('data', []))
+        self.calls.append({
+            'method': method,
+            'range': kwargs.get('range'),
+            'rows': rows,
+            'status': status,
+            'request_bytes': request_bytes,
+            'serialize_seconds': serialize_seconds,
+            'started': started,
+            'duration': time.monotonic() - started
+        })
+
+    def http_error(self, status, message):
+        headers = {'status': status}
+        if status == 429:
+            headers['retry-after'] = str(self.retry_after if self.retry_after is not None else max(1, round(self.wait_hint)))
+        content = json.dumps({'error': {'code': status, 'message': message}}).encode('utf-8')
+        return HttpError(httplib2.Response(headers), content, uri='https://sheets.googleapis.com/v4/fake')
+
+    def stats(self):
+        with self.lock:
+            statuses = Counter(call['status'] for call in self.calls)
+            methods = Counter(call['method'] for call in self.calls)
+            rows = sum(call['rows'] for call in self.calls if call['status'] == 200)
+            request_bytes = sum(call['request_bytes'] for call in self.calls)
+            serialize_seconds = sum(call['serialize_seconds'] for call in self.calls)
+            if self.calls:
+                span = max(call['started'] + call['duration'] for call in self.calls) - min(call['started'] for call in self.calls)
+            else:
+                span = 0.0
+        return {
+            'calls': sum(methods.values()),
+            'calls_by_method': dict(methods),
+            'calls_by_status': {str(status): count for status, count in statuses.items()},
+            'rows_written': rows,
+            'request_bytes': request_bytes,
+            'serialize_seconds': serialize_seconds,
+            'api_seconds': span,
+            'rows_per_second': rows / span if span else 0.0
+        }
+
+    # Spreadsheet state
+
+    def spreadsheet(self, spreadsheet_id):
+        return self.sheets.setdefault(spreadsheet_id, {})
+
+    def locate(self, spreadsheet_id, range_name):
+        match = RANGE_PATTERN.match(range_name)
+        if not match:
+            raise self.http_error(400, f'Unable to parse range: {range_name}')
+        title = match.group('sheet')
+        sheet = self.spreadsheet(spreadsheet_id).get(title)
+        if sheet is None:
+            raise self.http_error(400, f'Unable to parse range: {range_name}')
+        row = int(match.group('row') or 1) - 1
+        column = column_index(match.group('col') or 'A')
+        return sheet, row, column
+
+    def write_values(self, spreadsheet_id, range_name, values, grow=False):
+        sheet, row, column = self.locate(spreadsheet_id, range_name)
+        grid = sheet['properties']['gridProperties']
+        rows_needed = row + len(values)
+        columns_needed = column + max((len(row_values) for row_values in values), default=0)
+        if grow:
+            grid['rowCount'] = max(grid['rowCount'], rows_needed)
+        if rows_needed > grid['rowCount'] or columns_needed > grid['columnCount']:
+            raise self.http_error(400, f"Range ({range_name}) exceeds grid limits. Max rows: {grid['rowCount']}, "
+                                       f"max columns: {grid['columnCount']}")
+        for offset, row_values in enumerate(values):
+            cells = sheet['cells'].setdefault(row + offset, [])
+            if len(cells) < column + len(row_values):
+                cells.extend([''] * (column + len(row_values) - len(cells)))
+            cells[column:column + len(row_values)] = list(row_values)
+        return sheet, row
+
+    def sheet_by_id(self, spreadsheet_id, sheet_id):
+        for sheet in self.spreadsheet(spreadsheet_id).values():
+            if sheet['sheetId'] == sheet_id:
+                return sheet
+        raise self.http_error(400, f'No grid with id: {sheet_id}')
+
+    def sheet_values(self, spreadsheet_id, title):
+        """Return the rows written to a tab, in row order, for assertions in tests and benchmarks."""
+        cells = self.spreadsheet(spreadsheet_id)[title]['cells']
+        return [cells.get(row, []) for row in range(max(cells) + 1)] if cells else []
+
+    # API handlers, called with the lock held
+
+    def spreadsheets_get(self, spreadsheetId, **kwargs):
+        return {'sheets': [{'properties': dict(sheet['properties'])}
+                           for sheet in self.spreadsheet(spreadsheetId).values()]}
+
+    def spreadsheets_batch_update(self, spreadsheetId, body):
+        replies = []
+        for request in body.get('requests', []):
+            if 'addSheet' in request:
+                properties = dict(request['addSheet'].get('properties', {}))
+                title = properties.get('title')
+                if title in self.spreadsheet(spreadsheetId):
+                    raise self.http_error(400, f'Invalid requests[0].addSheet: A sheet with the name "{title}" already exists. Please enter another name.')
+                properties['sheetId'] = self.next_sheet_id
+                properties['gridProperties'] = {**DEFAULT_GRID, **properties.get('gridProperties', {})}
+                self.next_sheet_id += 1
+                self.spreadsheet(spreadsheetId)[title] = {'sheetId': properties['sheetId'], 'properties': properties, 'cells': {}}
+                replies.append({'addSheet': {'properties': properties}})
+            elif 'appendDimension' in request:
+                append = request['appendDimension']
+                grid = self.sheet_by_id(spreadsheetId, append['sheetId'])['properties']['gridProperties']
+                grid['rowCount' if append['dimension'] == 'ROWS' else 'columnCount'] += append['length']
+                replies.append({})
+            else:
+                replies.append({})
+        return {'spreadsheetId': spreadsheetId, 'replies': replies}
+
+    def values_get(self, spreadsheetId, range, **kwargs):
+        sheet, row, column = self.locate(spreadsheetId, range)
+        rows = [sheet['cells'][r][column:] for r in sorted(sheet['cells']) if r >= row]
+        return {'range': range, 'values': rows}
+
+    def values_update(self, spreadsheetId, range, body, valueInputOption=None, **kwargs):
+        values = body.get('values', [])
+        self.write_values(spreadsheetId, range, values)
+        return {'updatedRange': range, 'updatedRows': len(values)}
+
+    def values_batch_update(self, spreadsheetId, body):
+        updated_rows = 0
+        for data in body.get('data', []):
+            self.write_values(spreadsheetId, data['range'], data.get('values', []))
+            updated_rows += len(data.get('values', []))
+        return {'totalUpdatedRows': updated_rows}
+
+    def values_append(self, spreadsheetId, range, body, valueInputOption=None, **kwargs):
+        sheet, _, column = self.locate(spreadsheetId, range)
+        next_row = max(sheet['cells']) + 1 if sheet['cells'] else 0
+        title = range.split('!')[0]
+        values = body.get('values', [])
+        self.write_values(spreadsheetId, f"{title}!A{next_row + 1}", [[''] * column + list(row) for row in values], grow=True)
+        return {'updates': {'updatedRange': f"{title}!A{next_row + 1}", 'updatedRows': len(values)}}
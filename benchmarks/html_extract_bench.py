@@ -0,0 +1,103 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+import zlib
+
+# Pages per second for the HTML extraction engines used by the scrapers:
+# extract_vehicle_counts (icp_violators_to_sheet.py, SMS CarrierRegistration pages) and
+# extract_snapshot_fields (revocations_to_sheet.py, SAFER snapshot pages).
+#
+#   python3 html_extract_bench.py --cache ../census_and_safety/scraping_cache.sqlite ../revocations/scraping_cache.sqlite
+#   python3 html_extract_bench.py --pages 2000
+#
+# Cached pages are used when a scrape cache is given; otherwise synthetic pages shaped like
+# the real ones (large, table-heavy) are generated. Each engine's results are checked
+# against BeautifulSoup's, which is what the scripts used before.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'census_and_safety'))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'revocations'))
+import icp_violators_to_sheet
+import revocations_to_sheet
+
+ENGINES = ['bs4', 'lxml']
+FILLER_ROWS = 150  # Real pages carry a lot of navigation and unrelated tables
+
+def filler(rng):
+    rows = ''.join(f'<tr><td class="c{i % 7}"><a href="/x/{rng.randint(1, 10**6)}">Item {i}</a></td>'
+                   f'<td>{rng.random():.4f}</td></tr>' for i in range(FILLER_ROWS))
+    return f'<div class="nav"><ul>{"".join(f"<li><a href=/p{i}>Link {i}</a></li>" for i in range(40))}</ul></div><table>{rows}</table>'
+
+def synthetic_registration_page(rng):
+    vehicle_rows = ''.join(
+        f'<tr><th class="vehType">{vehicle_type}</th><td>{rng.randint(0, 60)}</td><td>{rng.randint(0, 5)}</td></tr>'
+        for vehicle_type in icp_violators_to_sheet.VEHICLE_TYPES)
+    return (f'<html><head><title>SMS</title><script>var x = {rng.random()};</script></head><body>{filler(rng)}'
+            f'<table id="vehicles"><tr><th>Vehicle Type</th><th>Owned</th><th>Leased</th></tr>{vehicle_rows}</table>'
+            f'{filler(rng)}</body></html>')
+
+def synthetic_snapshot_page(rng):
+    fields = {
+        'Legal Name:': f"CARRIER {rng.randint(1, 10**6)} LLC",
+        'DBA Name:': '',
+        'Phone:': f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}",
+        'Physical Address:': f"{rng.randint(1, 9999)} MAIN ST<br>\nAUSTIN, TX  {rng.randint(70000, 79999)}"
+    }
+    rows = ''.join(f'<tr><th class="querylabelbkg"><a href="/help">{label}</a></th><td class="queryfield">{value}</td></tr>'
+                   for label, value in fields.items())
+    return f'<html><body>{filler(rng)}<table>{rows}<tr><th>Entity Type:</th><td>CARRIER</td></tr></table>{filler(rng)}</body></html>'
+
+def cached_pages(cache_files):
+    pages = {'registration': [], 'snapshot': []}
+    for cache_file in cache_files:
+        db = sqlite3.connect(cache_file)
+        for url, body in db.execute("SELECT p.url, b.body FROM pages p JOIN bodies b USING (content_hash)"):
+            page = zlib.decompress(body).decode('utf-8')
+            if (url and 'CarrierRegistration' in url) or 'vehType' in page:
+                pages['registration'].append(page)
+            elif (url and 'queryCarrierSnapshot' in url) or 'Legal Name:' in page:
+                pages['snapshot'].append(page)
+        db.close()
+    return pages
+
+def measure(extract, pages, engine):
+    start = time.perf_counter()
+    results = [extract(page, engine) for page in pages]
+    return results, len(pages) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare HTML extraction engines on scraped pages.')
+    parser.add_argument('--cache', nargs='*', default=[], help='scraping_cache.sqlite files to read pages from')
+    parser.add_argument('--pages', type=int, default=500, help='Synthetic pages per kind when no cache is given')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.cache:
+        pages = cached_pages(args.cache)
+    else:
+        rng = random.Random(args.seed)
+        pages = {'registration': [synthetic_registration_page(rng) for _ in range(args.pages)],
+                 'snapshot': [synthetic_snapshot_page(rng) for _ in range(args.pages)]}
+
+    extractors = {
+        'registration': icp_violators_to_sheet.extract_vehicle_counts,
+        'snapshot': revocations_to_sheet.extract_snapshot_fields
+    }
+    for kind, extract in extractors.items():
+        if not pages[kind]:
+            print(f"{kind}: no pages")
+            continue
+        size = sum(len(page) for page in pages[kind]) / len(pages[kind])
+        print(f"{kind}: {len(pages[kind])} pages, {size / 1024:.1f} KB average")
+        baseline, baseline_rate = measure(extract, pages[kind], 'bs4')
+        print(f"  {'bs4':<6} {baseline_rate:9.1f} pages/s")
+        for engine in ENGINES[1:]:
+            results, rate = measure(extract, pages[kind], engine)
+            mismatches = sum(1 for a, b in zip(baseline, results) if a != b)
+            print(f"  {engine:<6} {rate:9.1f} pages/s  ({rate / baseline_rate:.1f}x, {mismatches} results differ from bs4)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import argparse
+import csv
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# End-to-end benchmark for the six *_to_sheet.py pipelines on synthetic data.
+#
+#   python3 pipeline_bench.py --rows 100000 --output bench_100k.json
+#   python3 pipeline_bench.py --rows 1000000 --data-dir /data/synthetic_1m --runs 2 --compare bench_1m_prev.json
+#
+# Each pipeline runs unmodified against FakeSheetsService (see run_offline.py). Time is
+# attributed to stages by wrapping the scripts' own helper functions, so the numbers follow
+# the code as it changes; only the outermost wrapped call on a thread is counted.
+#   parse      a plain csv pass over the primary input, plus the loaders it depends on
+#   filter     row predicates and lookup lists
+#   join       census / safety lookups
+#   aggregate  per-carrier consolidation helpers
+#   scrape     SAFER / SMS lookups (offline stand-ins unless --scrape)
+#   serialize  JSON encoding of Sheets request bodies, measured by the fake service
+#   upload     tab creation and writes, summed over upload threads
+# Work done inline in process_csv loops is in wall_seconds but not in any stage.
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_sheets import FakeSheetsService
+from run_offline import PIPELINES, load_module, parse_overrides, run_pipeline
+from synthetic_data import generate_dataset
+
+STAGE_FUNCTIONS = {
+    'parse': ['detect_encoding', 'read_safety_data', 'ensure_census_cache', 'ensure_census_index', 'parse_date', 'format_date',
+              'read_column_descriptions'],
+    'filter': ['read_cities', 'read_exclude_columns', 'read_excluded_dot_numbers', 'plan_candidates', 'filter_mask', 'census_filter_mask',
+               'should_include_company', 'extract_city_state', 'normalize_city_name'],
+    'join': ['merge_safety_data', 'lookup_safety_row', 'read_census_data', 'lookup_census_rows',
+             'read_census_companies'],
+    'aggregate': ['aggregate_inspection_block', 'merge_partials', 'split_string', 'safe_int', 'process_text'],
+    'scrape': ['collect_vehicle_counts', 'extract_company_data'],
+    'upload': ['create_new_sheet', 'upload_tab', 'write_to_sheet_batch', 'format_sheet']
+}
+PRIMARY_INPUT = {
+    'direct': 'CENSUS_FILE',
+    'icp': 'CENSUS_FILE',
+    'inspections': 'INSPECTIONS_FILE',
+    'crashes': 'CRASHES_FILE',
+    'revocations': 'REVOCATIONS_FILE',
+    'boc3': 'BOC3_FILE'
+}
+# Keep the client-side rate limiter out of the way unless a run asks for real quotas.
+DEFAULT_OVERRIDES = {'SHEETS_QUOTA_PER_USER': 10**9, 'SHEETS_QUOTA_PER_PROJECT': 10**9}
+MANIFEST_FILE = 'synthetic_manifest.json'
+
+class StageTimer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.seconds = {}
+        self.calls = {}
+        self.originals = []
+
+    def wrap(self, module, stage, name):
+        original = getattr(module, name)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            depth = getattr(self.local, 'depth', 0)
+            self.local.depth = depth + 1
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.local.depth = depth
+                if depth == 0:
+                    self.add(stage, name, time.perf_counter() - start)
+
+        self.originals.append((module, name, original))
+        setattr(module, name, timed)
+
+    def add(self, stage, name, seconds, calls=1):
+        with self.lock:
+            key = (stage, name)
+            self.seconds[key] = self.seconds.get(key, 0.0) + seconds
+            self.calls[key] = self.calls.get(key, 0) + calls
+
+    def instrument(self, module):
+        for stage, names in STAGE_FUNCTIONS.items():
+            for name in names:
+                if callable(getattr(module, name, None)):
+                    self.wrap(module, stage, name)
+
+    def restore(self):
+        for module, name, original in reversed(self.originals):
+            setattr(module, name, original)
+        self.originals = []
+
+    def stages(self):
+        stages = {}
+        for (stage, name), seconds in sorted(self.seconds.items()):
+            entry = stages.setdefault(stage, {'seconds': 0.0, 'calls': 0, 'functions': {}})
+            entry['seconds'] += seconds
+            entry['calls'] += self.calls[(stage, name)]
+            entry['functions'][name] = seconds
+        return stages
+
+def scan_input(path):
+    # The floor for any parse step: one csv pass over the file with nothing else done per row.
+    rows = 0
+    with open(path, 'r', newline='', encoding='utf-8', errors='replace') as csvfile:
+        for _ in csv.reader(csvfile):
+            rows += 1
+    return rows - 1
+
+def run_stage_benchmark(name, data_dir, overrides, fake_options, scrape=False):
+    directory = PIPELINES[name][0]
+    work_dir = os.path.join(data_dir, directory)
+    module = load_module(name, work_dir)
+    input_path = os.path.join(work_dir, getattr(module, PRIMARY_INPUT[name]))
+
+    timer = StageTimer()
+    start = time.perf_counter()
+    input_rows = scan_input(input_path)
+    timer.add('parse', 'csv_scan', time.perf_counter() - start)
+
+    service = FakeSheetsService(**fake_options)
+    try:
+        summary = run_pipeline(name, service, work_dir=work_dir, overrides=overrides, scrape=scrape,
+                               setup=timer.instrument)
+    finally:
+        timer.restore()
+
+    stages = timer.stages()
+    stages['serialize'] = {'seconds': summary['serialize_seconds'], 'calls': summary['calls'],
+                           'bytes': summary['request_bytes']}
+    return {
+        'input_rows': input_rows,
+        'wall_seconds': summary['wall_seconds'],
+        'rows_per_second': input_rows / summary['wall_seconds'] if summary['wall_seconds'] else 0.0,
+        'stages': stages,
+        'sheets': {key: summary[key] for key in ('calls', 'calls_by_method', 'calls_by_status', 'rows_written')},
+        'tabs': len(summary['tabs'])
+    }
+
+def prepare_data(data_dir, rows, seed):
+    manifest_path = os.path.join(data_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['rows'] == rows and manifest['seed'] == seed:
+            print(f"Reusing synthetic data in {data_dir}")
+            return manifest
+    start = time.perf_counter()
+    files = generate_dataset(data_dir, rows, seed)
+    manifest = {'rows': rows, 'seed': seed, 'files': files, 'seconds': time.perf_counter() - start}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_comparison(results, previous):
+    print("\nChange against previous results (wall seconds):")
+    for name, current in results['pipelines'].items():
+        before = previous.get('pipelines', {}).get(name)
+        if not before:
+            continue
+        for run_index, run in enumerate(current['runs']):
+            if run_index >= len(before['runs']):
+                break
+            old_wall = before['runs'][run_index]['wall_seconds']
+            change = (run['wall_seconds'] - old_wall) / old_wall * 100 if old_wall else 0.0
+            print(f"  {name:<12} run {run_index + 1}: {old_wall:8.2f} -> {run['wall_seconds']:8.2f}  ({change:+.1f}%)")
+            for stage, entry in run['stages'].items():
+                old_stage = before['runs'][run_index]['stages'].get(stage)
+                if old_stage and old_stage['seconds']:
+                    stage_change = (entry['seconds'] - old_stage['seconds']) / old_stage['seconds'] * 100
+                    print(f"      {stage:<10} {old_stage['seconds']:8.2f} -> {entry['seconds']:8.2f}  ({stage_change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on synthetic FMCSA data.')
+    parser.add_argument('--rows', type=int, default=100000, help='Census carriers to generate (10k to 10M)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help='Where to generate (or reuse) the synthetic data; a temp dir by default')
+    parser.add_argument('--pipelines', default=','.join(PIPELINES), help='Comma separated pipelines to run')
+    parser.add_argument('--runs', type=int, default=1, help='Runs per pipeline; the first builds any census caches')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every fake Sheets call')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='Override a module constant')
+    parser.add_argument('--scrape', action='store_true', help='Keep the real SAFER / SMS scrapers')
+    parser.add_argument('--output', help='JSON results file (default: bench_<rows>_<timestamp>.json)')
+    parser.add_argument('--compare', help='Previous JSON results to print changes against')
+    args = parser.parse_args()
+
+    overrides = dict(DEFAULT_OVERRIDES)
+    overrides.update(parse_overrides(args.set))
+    fake_options = {'latency': args.latency, 'seed': args.seed}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = os.path.abspath(args.data_dir or tmp_dir)
+        manifest = prepare_data(data_dir, args.rows, args.seed)
+
+        results = {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'rows': args.rows,
+            'seed': args.seed,
+            'overrides': overrides,
+            'fake_sheets': fake_options,
+            'data': manifest,
+            'pipelines': {}
+        }
+        for name in args.pipelines.split(','):
+            runs = []
+            for run_index in range(args.runs):
+                print(f"\n=== {name} (run {run_index + 1} of {args.runs}) ===")
+                runs.append(run_stage_benchmark(name, data_dir, overrides, fake_options, args.scrape))
+            results['pipelines'][name] = {'runs': runs}
+
+    output = args.output or f"bench_{args.rows}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+    for name, pipeline in results['pipelines'].items():
+        for run in pipeline['runs']:
+            stages = '  '.join(f"{stage} {entry['seconds']:.2f}s" for stage, entry in run['stages'].items())
+            print(f"  {name:<12} {run['wall_seconds']:8.2f}s  {run['rows_per_second']:10.0f} rows/s  {stages}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+
+# Runs one of the *_to_sheet.py pipelines end to end against FakeSheetsService instead of a
+# real spreadsheet, with the SAFER / SMS scrapers replaced by deterministic stand-ins, and
+# prints (or writes) a JSON summary of the Sheets calls it made.
+#
+#   python3 run_offline.py direct --work-dir /data/census_and_safety
+#   python3 run_offline.py crashes --set CRASHES_FILE=raw_data/2024Jun_Crash.txt --quota 60 --latency 0.05
+#   python3 run_offline.py boc3 --error-rate 0.02 --output boc3_offline.json
+#
+# The pipeline runs from --work-dir (the script's own directory by default), so the relative
+# paths in its constants resolve the same way they do in production. Any module constant can
+# be overridden with --set NAME=VALUE; values are parsed as JSON when possible.
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from fake_sheets import FakeSheetsService
+from fmcsa_common import sheets_quota
+
+FAKE_SPREADSHEET_ID = 'offline-benchmark'
+
+def run_direct(module, service):
+    module.process_csv(module.CENSUS_FILE, module.SAFETY_FILE_AB, module.SAFETY_FILE_C, service,
+                       FAKE_SPREADSHEET_ID, service_factory=lambda: service)
+
+def run_icp(module, service):
+    module.process_csv(module.CENSUS_FILE, module.SAFETY_FILE_AB, module.SAFETY_FILE_C, service,
+                       FAKE_SPREADSHEET_ID, service_factory=lambda: service)
+
+def run_inspections(module, service):
+    module.process_csv(module.INSPECTIONS_FILE, module.CENSUS_FILE, service, FAKE_SPREADSHEET_ID)
+
+def run_crashes(module, service):
+    module.process_csv(module.CRASHES_FILE, module.CENSUS_FILE, service, FAKE_SPREADSHEET_ID,
+                       service_factory=lambda: service)
+
+def run_revocations(module, service):
+    module.process_csv(module.REVOCATIONS_FILE, service, FAKE_SPREADSHEET_ID)
+
+def run_boc3(module, service):
+    module.process_boc3_csv(module.BOC3_FILE, service, FAKE_SPREADSHEET_ID, service_factory=lambda: service)
+
+PIPELINES = {
+    'direct': ('census_and_safety', 'direct_to_sheet', run_direct),
+    'icp': ('census_and_safety', 'icp_violators_to_sheet', run_icp),
+    'inspections': ('inspections_and_violations', 'inspections_to_sheet', run_inspections),
+    'crashes': ('inspections_and_violations', 'crashes_to_sheet', run_crashes),
+    'revocations': ('revocations', 'revocations_to_sheet', run_revocations),
+    'boc3': ('boc3_filers', 'boc3_to_sheet', run_boc3)
+}
+
+def stable_number(value, low, high):
+    digest = hashlib.sha1(str(value).encode('utf-8')).digest()
+    return low + int.from_bytes(digest[:4], 'big') % (high - low + 1)
+
+def fake_vehicle_counts(usdot_number, driver=None):
+    return {
+        'Straight Trucks': stable_number(f"st{usdot_number}", 0, 20),
+        'Truck Tractors': stable_number(f"tt{usdot_number}", 0, 40),
+        'Trailers': stable_number(f"tr{usdot_number}", 0, 60),
+        'Hazmat Cargo Tank Trailers': 0,
+        'Hazmat Cargo Tank Trucks': 0
+    }
+
+def fake_company_data(usdot, max_retries=3):
+    return {
+        'Legal Name': f"OFFLINE CARRIER {usdot}",
+        'DBA Name': '',
+        'Phone': f"(512) 555-{stable_number(usdot, 0, 9999):04d}",
+        'Physical Address': f"{stable_number(usdot, 1, 9999)} MAIN ST\nAUSTIN, TX 78701"
+    }
+
+def offline_scrapers(module):
+    """Swap network scrapers for deterministic stand-ins so runs are repeatable and need no browser."""
+    if hasattr(module, 'collect_vehicle_counts'):
+        module.collect_vehicle_counts = fake_vehicle_counts
+    if hasattr(module, 'extract_company_data'):
+        module.extract_company_data = fake_company_data
+        module.SCRAPE_REQUESTS_PER_MINUTE = 10**9
+
+def parse_overrides(pairs):
+    overrides = {}
+    for pair in pairs:
+        name, _, value = pair.partition('=')
+        try:
+            overrides[name] = json.loads(value)
+        except ValueError:
+            overrides[name] = value
+    return overrides
+
+def load_module(name, work_dir=None):
+    """Import a pipeline's script module; import-time side effects (cache dirs) land in work_dir."""
+    directory, module_name, _ = PIPELINES[name]
+    script_dir = os.path.abspath(os.path.join(REPO_DIR, directory))
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+    previous_dir = os.getcwd()
+    os.chdir(work_dir or script_dir)
+    try:
+        return importlib.import_module(module_name)
+    finally:
+        os.chdir(previous_dir)
+
+def apply_overrides(module, overrides):
+    for constant, value in (overrides or {}).items():
+        if isinstance(getattr(module, constant, None), tuple) and isinstance(value, list):
+            value = tuple(value)
+        setattr(module, constant, value)
+    if hasattr(module, '_rate_limiter'):
+        # The limiter's starting rate was computed at import; restart it from the overridden quotas.
+        sheets_quota.reset_rate_limiter(module._rate_limiter, min(module.SHEETS_QUOTA_PER_USER, module.SHEETS_QUOTA_PER_PROJECT),
+                                        module.SHEETS_BURST)
+
+def run_pipeline(name, service, work_dir=None, overrides=None, scrape=False, setup=None):
+    """Run one pipeline against service and return a summary of the run and its Sheets calls.
+
+    setup, if given, is called with the module after overrides are applied and before the run.
+    """
+    directory, _, runner = PIPELINES[name]
+    work_dir = work_dir or os.path.abspath(os.path.join(REPO_DIR, directory))
+    module = load_module(name, work_dir)
+    apply_overrides(module, overrides)
+    if not scrape:
+        offline_scrapers(module)
+    if setup:
+        setup(module)
+
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        start = time.perf_counter()
+        runner(module, service)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.chdir(previous_dir)
+
+    summary = {'pipeline': name, 'wall_seconds': elapsed}
+    summary.update(service.stats())
+    summary['tabs'] = {title: len(service.sheet_values(FAKE_SPREADSHEET_ID, title))
+                       for title in service.sheets.get(FAKE_SPREADSHEET_ID, {})}
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a *_to_sheet.py pipeline against an in-memory Sheets stand-in.')
+    parser.add_argument('pipeline', choices=sorted(PIPELINES))
+    parser.add_argument('--work-dir', help="Directory to run from (defaults to the script's own directory)")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='Override a module constant')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every Sheets call')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='Extra random latency per call, up to this many seconds')
+    parser.add_argument('--quota', type=int, help='Calls allowed per rolling minute before answering 429')
+    parser.add_argument('--retry-after', type=int, help='Fixed Retry-After for simulated 429s (default: until the quota frees up)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of calls failing with a transient 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scrape', action='store_true', help='Keep the real SAFER / SMS scrapers')
+    parser.add_argument('--output', help='Write the JSON summary here instead of stdout')
+    args = parser.parse_args()
+
+    service = FakeSheetsService(latency=args.latency, latency_jitter=args.latency_jitter, quota_per_minute=args.quota,
+                                retry_after=args.retry_after, error_rate=args.error_rate, seed=args.seed)
+    summary = run_pipeline(args.pipeline, service, work_dir=args.work_dir and os.path.abspath(args.work_dir),
+                           overrides=parse_overrides(args.set), scrape=args.scrape)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import csv
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Compares the memory held by the old dict-of-dicts SMS safety data against the compact
+# column store used by census_and_safety/direct_to_sheet.py and icp_violators_to_sheet.py.
+#
+#   python3 safety_store_memory.py --ab raw_data/SMS_AB_PassProperty_2024Nov.txt --c raw_data/SMS_C_PassProperty_2024Nov.txt
+#   python3 safety_store_memory.py --carriers 500000
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'census_and_safety'))
+import direct_to_sheet
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_data import AB_HEADERS, C_HEADERS, write_safety_file
+
+def read_safety_dicts(filename):
+    # The previous representation: one dict per carrier, keyed by DOT_NUMBER.
+    safety_data = {}
+    encoding = direct_to_sheet.detect_encoding(filename)
+    with open(filename, 'r', encoding=encoding, errors='replace') as csvfile:
+        for row in csv.DictReader(csvfile):
+            dot_number = row.pop('DOT_NUMBER')
+            safety_data[dot_number] = row
+    return safety_data
+
+def merge_safety_dicts(safety_data_ab, safety_data_c):
+    return {dot_number: {**safety_data_ab.get(dot_number, {}), **safety_data_c.get(dot_number, {})}
+            for dot_number in set(safety_data_ab) | set(safety_data_c)}
+
+def measure(label, load):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22} retained {current / 2**20:9.1f} MB   peak {peak / 2**20:9.1f} MB   {elapsed:7.2f} s")
+    return result, current
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare memory used by SMS safety data representations.')
+    parser.add_argument('--ab', help='SMS_AB file (synthetic data is generated when omitted)')
+    parser.add_argument('--c', help='SMS_C file (synthetic data is generated when omitted)')
+    parser.add_argument('--carriers', type=int, default=200000, help='Number of synthetic carriers')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ab_file, c_file = args.ab, args.c
+        if not (ab_file and c_file):
+            print(f"Generating synthetic SMS files for {args.carriers} carriers...")
+            ab_file = os.path.join(tmp_dir, 'SMS_AB.txt')
+            c_file = os.path.join(tmp_dir, 'SMS_C.txt')
+            write_safety_file(ab_file, AB_HEADERS, range(1, args.carriers + 1))
+            write_safety_file(c_file, C_HEADERS, range(1, args.carriers + 1, 4))
+
+        dicts, dicts_bytes = measure('dict-of-dicts', lambda: merge_safety_dicts(
+            read_safety_dicts(ab_file), read_safety_dicts(c_file)))
+        probe = random.sample(sorted(dicts), min(1000, len(dicts)))
+        del dicts
+
+        store, store_bytes = measure('column store', lambda: direct_to_sheet.merge_safety_data(
+            direct_to_sheet.read_safety_data(ab_file), direct_to_sheet.read_safety_data(c_file)))
+
+        start = time.perf_counter()
+        for dot_number in probe:
+            direct_to_sheet.lookup_safety_row(store, dot_number)
+        per_lookup = (time.perf_counter() - start) / max(len(probe), 1)
+
+    print(f"Memory reduction: {dicts_bytes / max(store_bytes, 1):.1f}x")
+    print(f"Column store lookup: {per_lookup * 1e6:.1f} us per carrier")
+
+if __name__ == "__main__":
+    main()
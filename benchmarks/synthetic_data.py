@@ -0,0 +1,335 @@
+import argparse
+import csv
+import glob
+import os
+import random
+import shutil
+import sys
+import time
+
+# Writes synthetic FMCSA inputs for every pipeline in the repo: census, SMS AB/C safety,
+# inspections, crashes, revocations and BOC3 filers, with the same headers and quoting as
+# the real downloads, plus the READMEs, cities.txt, exclude_columns.txt and excluded DOT
+# list the scripts read. Files are laid out like the repo (census_and_safety/raw_data/...,
+# inspections_and_violations/raw_data/..., ...) under the file names in each script's
+# constants, so a pipeline can be run from <out>/<script dir> unmodified.
+#
+#   python3 synthetic_data.py --rows 1000000 --out /data/fmcsa_synthetic
+#
+# --rows is the number of census carriers; the other files scale from it (see SCALE).
+# Output is deterministic for a given --rows and --seed.
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SCALE = {
+    'safety_ab': 0.4,  # Share of census carriers with an SMS AB record
+    'safety_c': 0.1,
+    'inspections': 1.0,  # Inspection rows per census carrier
+    'crashes': 0.05,
+    'revocations': 0.01,
+    'boc3': 0.5
+}
+MULTILINE_STREET_RATE = 0.001  # Real census files carry a few quoted newlines in PHY_STREET
+OUT_OF_CENSUS_RATE = 0.02  # Share of inspection / crash / revocation DOT numbers missing from the census
+BLANK_COMPANY_RATE = 0.05  # BOC3 rows without COMPANY_NAME, which boc3_to_sheet.py ignores
+
+with open(os.path.join(REPO_DIR, 'census_and_safety', 'header_row.txt')) as f:
+    CENSUS_HEADERS = next(csv.reader(f))
+with open(os.path.join(REPO_DIR, 'boc3_filers', 'boc3_fields.txt')) as f:
+    BOC3_HEADERS = next(csv.reader(f))
+REVOCATION_HEADERS = ['DOCKET_NUMBER', 'DOT_NUMBER', 'OPERATING_AUTHORITY_REGISTRATION_TYPE', 'SERVE_DATE',
+                      'REVOCATION_TYPE', 'EFFECTIVE_DATE']
+AB_HEADERS = [
+    'DOT_NUMBER', 'INSP_TOTAL', 'DRIVER_INSP_TOTAL', 'DRIVER_OOS_INSP_TOTAL', 'VEHICLE_INSP_TOTAL',
+    'VEHICLE_OOS_INSP_TOTAL', 'UNSAFE_DRIV_INSP_W_VIOL', 'UNSAFE_DRIV_MEASURE', 'UNSAFE_DRIV_PCT',
+    'UNSAFE_DRIV_RD_ALERT', 'UNSAFE_DRIV_AC', 'UNSAFE_DRIV_BASIC_ALERT', 'HOS_DRIV_INSP_W_VIOL',
+    'HOS_DRIV_MEASURE', 'HOS_DRIV_PCT', 'DRIV_FIT_INSP_W_VIOL', 'DRIV_FIT_MEASURE', 'DRIV_FIT_PCT',
+    'CONTR_SUBST_INSP_W_VIOL', 'CONTR_SUBST_MEASURE', 'CONTR_SUBST_PCT', 'VEH_MAINT_INSP_W_VIOL',
+    'VEH_MAINT_MEASURE', 'VEH_MAINT_PCT', 'VEH_MAINT_BASIC_ALERT'
+]
+C_HEADERS = ['DOT_NUMBER', 'CRASH_TOTAL', 'FATAL_CRASH_TOTAL', 'INJURY_CRASH_TOTAL', 'TOW_CRASH_TOTAL',
+             'CRASH_MEASURE', 'CRASH_PCT', 'CRASH_BASIC_ALERT']
+INSPECTION_HEADERS = [
+    'UNIQUE_ID', 'REPORT_NUMBER', 'REPORT_STATE', 'DOT_NUMBER', 'INSP_DATE', 'INSP_LEVEL_ID', 'COUNTY_CODE_STATE',
+    'TIME_WEIGHT', 'DRIVER_OOS_TOTAL', 'VEHICLE_OOS_TOTAL', 'TOTAL_HAZMAT_SENT', 'OOS_TOTAL', 'HAZMAT_OOS_TOTAL',
+    'HAZMAT_PLACARD_REQ', 'UNIT_TYPE_DESC', 'UNIT_MAKE', 'UNIT_LICENSE', 'UNIT_LICENSE_STATE', 'VIN',
+    'UNIT_DECAL_NUMBER', 'UNIT_TYPE_DESC2', 'UNIT_MAKE2', 'UNIT_LICENSE2', 'UNIT_LICENSE_STATE2', 'VIN2',
+    'UNIT_DECAL_NUMBER2', 'UNSAFE_INSP', 'FATIGUED_INSP', 'DR_FITNESS_INSP', 'SUBT_ALCOHOL_INSP', 'VH_MAINT_INSP',
+    'HM_INSP', 'BASIC_VIOL', 'UNSAFE_VIOL', 'FATIGUED_VIOL', 'DR_FITNESS_VIOL', 'SUBT_ALCOHOL_VIOL', 'VH_MAINT_VIOL',
+    'HM_VIOL'
+]
+CRASH_HEADERS = [
+    'REPORT_NUMBER', 'REPORT_SEQ_NO', 'DOT_NUMBER', 'REPORT_DATE', 'REPORT_STATE', 'FATALITIES', 'INJURIES',
+    'TOW_AWAY', 'HAZMAT_RELEASED', 'TRAFFICWAY_DESC', 'ACCESS_CONTROL_DESC', 'ROAD_SURFACE_CONDITION_DESC',
+    'WEATHER_CONDITION_DESC', 'LIGHT_CONDITION_DESC', 'VEHICLE_ID_NUMBER', 'VEHICLE_LICENSE_NUMBER',
+    'VEHICLE_LICENSE_STATE', 'SEVERITY_WEIGHT', 'TIME_WEIGHT', 'CITATION_ISSUED_DESC', 'SEQ_NUM', 'NOT_PREVENTABLE'
+]
+
+NAME_WORDS = ['EAGLE', 'LONE STAR', 'ACME', 'BLUE', 'RIVER', 'SUMMIT', 'RED', 'DELTA', 'PIONEER', 'FALCON',
+              'GULF', 'PRAIRIE', 'IRON', 'GOLDEN', 'PEAK', 'NORTHSTAR', 'MESA', 'CANYON', 'LIBERTY', 'TRINITY']
+NAME_SUFFIXES = ['TRUCKING LLC', 'TRANSPORT INC', 'LOGISTICS', 'FREIGHT LINES', 'EXPRESS LLC', 'HAULING CO',
+                 'CARRIERS INC', 'ENTERPRISES']
+STREET_NAMES = ['MAIN ST', 'OAK AVE', 'INDUSTRIAL BLVD', 'HWY 290', 'ELM ST', 'COMMERCE DR', 'FM 1960', 'PARK RD']
+STATES = ['TX', 'CA', 'AZ', 'NY', 'NJ', 'WA', 'OR', 'FL', 'IL', 'OH', 'GA', 'OK', 'LA', 'NM', 'CO']
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+UNIT_TYPES = ['TRUCK TRACTOR', 'SEMI-TRAILER', 'STRAIGHT TRUCK', 'VAN', 'PICKUP']
+UNIT_MAKES = ['FRHT', 'KW', 'PTRB', 'INTL', 'VOLV', 'MACK', 'UTIL', 'WABASH', 'GREAT DANE']
+
+def read_city_pool():
+    cities = []
+    for path in sorted(glob.glob(os.path.join(REPO_DIR, 'census_and_safety', 'cities', '*.txt'))):
+        with open(path) as f:
+            for line in f:
+                if ',' in line:
+                    city, state = line.strip().rsplit(',', 1)
+                    cities.append((city.strip().upper(), state.strip()))
+    return cities
+
+def sms_date(rng, years=(2022, 2024)):
+    return f"{rng.randint(1, 28):02d}-{rng.choice(MONTHS)}-{rng.randint(*years) % 100:02d}"
+
+def slash_date(rng, years=(2023, 2024)):
+    return f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(*years)}"
+
+def company_name(rng):
+    return f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {rng.choice(NAME_SUFFIXES)}"
+
+def census_dot_numbers(rows, rng):
+    # Real DOT numbers are sparse; leave gaps so joins see misses.
+    dot_numbers = []
+    dot_number = 1000
+    for _ in range(rows):
+        dot_number += rng.randint(1, 4)
+        dot_numbers.append(dot_number)
+    return dot_numbers
+
+def sample_dot_numbers(rng, dot_numbers, count, skew=1.2):
+    # Zipf-like skew: a few carriers account for many inspections / crashes.
+    highest = dot_numbers[-1]
+    for _ in range(count):
+        if rng.random() < OUT_OF_CENSUS_RATE:
+            yield highest + rng.randint(1, 1000000)
+        else:
+            yield dot_numbers[min(int(rng.paretovariate(skew)) - 1, len(dot_numbers) - 1) if rng.random() < 0.2
+                              else rng.randrange(len(dot_numbers))]
+
+def write_census_file(path, dot_numbers, rng, city_pool):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
+        writer.writerow(CENSUS_HEADERS)
+        for dot_number in dot_numbers:
+            city, state = rng.choice(city_pool)
+            street = f"{rng.randint(1, 99999)} {rng.choice(STREET_NAMES)}"
+            if rng.random() < MULTILINE_STREET_RATE:
+                street += f"\nSUITE {rng.randint(1, 500)}"
+            power_units = int(rng.expovariate(0.08)) + 1
+            values = {
+                'DOT_NUMBER': str(dot_number),
+                'LEGAL_NAME': company_name(rng),
+                'DBA_NAME': company_name(rng) if rng.random() < 0.2 else '',
+                'CARRIER_OPERATION': rng.choice('ABC'),
+                'HM_FLAG': 'Y' if rng.random() < 0.05 else 'N',
+                'PC_FLAG': 'Y' if rng.random() < 0.03 else 'N',
+                'PHY_STREET': street,
+                'PHY_CITY': city,
+                'PHY_STATE': state,
+                'PHY_ZIP': f"{rng.randint(10000, 99999)}",
+                'PHY_COUNTRY': 'US',
+                'MAILING_STREET': street,
+                'MAILING_CITY': city,
+                'MAILING_STATE': state,
+                'MAILING_ZIP': f"{rng.randint(10000, 99999)}",
+                'MAILING_COUNTRY': 'US',
+                'TELEPHONE': f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}",
+                'FAX': '',
+                'EMAIL_ADDRESS': f"dispatch{dot_number}@example.com" if rng.random() < 0.6 else '',
+                'MCS150_DATE': sms_date(rng),
+                'MCS150_MILEAGE': str(power_units * rng.randint(20000, 120000)),
+                'MCS150_MILEAGE_YEAR': str(rng.randint(2019, 2023)),
+                'ADD_DATE': sms_date(rng, (1990, 2024)),
+                'OIC_STATE': state,
+                'NBR_POWER_UNIT': str(power_units),
+                'DRIVER_TOTAL': str(max(1, power_units + rng.randint(-2, 5))),
+                'RECENT_MILEAGE': str(power_units * rng.randint(20000, 120000)),
+                'RECENT_MILEAGE_YEAR': str(rng.randint(2019, 2023)),
+                'VMT_SOURCE_ID': str(rng.randint(1, 3)),
+                'AUTHORIZED_FOR_HIRE': 'Y' if rng.random() < 0.7 else 'N'
+            }
+            writer.writerow([values[header] if header in values else ('Y' if rng.random() < 0.02 else 'N')
+                             for header in CENSUS_HEADERS])
+
+def write_safety_file(path, headers, dot_numbers, rng=random):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(headers)
+        for dot_number in dot_numbers:
+            row = [str(dot_number)]
+            for header in headers[1:]:
+                if header.endswith(('_ALERT', '_AC')):
+                    row.append(rng.choice(['Y', 'N']))
+                elif header.endswith(('_MEASURE', '_PCT')):
+                    row.append(f"{rng.random() * 100:.2f}" if rng.random() < 0.3 else '')
+                else:
+                    row.append(str(int(rng.expovariate(0.2))))
+            writer.writerow(row)
+
+def write_inspections_file(path, dot_numbers, count, rng):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(INSPECTION_HEADERS)
+        for unique_id, dot_number in enumerate(sample_dot_numbers(rng, dot_numbers, count), start=1):
+            state = 'TX' if rng.random() < 0.3 else rng.choice(STATES)
+            violations = [str(int(rng.expovariate(1.5))) for _ in range(7)]
+            oos = str(rng.randint(0, 2) if rng.random() < 0.2 else 0)
+            writer.writerow([
+                str(unique_id), f"{state}{rng.randint(10000000, 99999999)}", state, str(dot_number),
+                sms_date(rng) if rng.random() < 0.999 else '', str(rng.randint(1, 3)), str(rng.randint(1, 300)),
+                str(rng.randint(1, 3)), oos, oos, '0', oos, '0', 'N',
+                rng.choice(UNIT_TYPES), rng.choice(UNIT_MAKES), f"{rng.randint(1000000, 9999999)}", state,
+                f"1FUJ{rng.randint(10**12, 10**13 - 1)}", '',
+                rng.choice(UNIT_TYPES) if rng.random() < 0.6 else '', rng.choice(UNIT_MAKES), '', state, '', '',
+                *[rng.choice('YN') for _ in range(6)],
+                *violations
+            ])
+
+def write_crashes_file(path, dot_numbers, count, rng):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(CRASH_HEADERS)
+        for seq, dot_number in enumerate(sample_dot_numbers(rng, dot_numbers, count), start=1):
+            state = rng.choice(STATES)
+            fatalities = 1 if rng.random() < 0.03 else 0
+            writer.writerow([
+                f"{state}{rng.randint(1000000000, 9999999999)}", '1',
+                str(dot_number) if rng.random() < 0.99 else '', sms_date(rng), state, str(fatalities),
+                str(rng.randint(0, 3)), 'Y' if rng.random() < 0.7 else 'N', 'N',
+                rng.choice(['Two-Way, Not Divided', 'Two-Way, Divided, Unprotected Median', 'One-Way Trafficway']),
+                rng.choice(['No Control', 'Full Control', 'Partial Control']),
+                rng.choice(['Dry', 'Wet', 'Snow', 'Ice']), rng.choice(['No Adverse Conditions', 'Rain', 'Fog']),
+                rng.choice(['Daylight', 'Dark - Lighted', 'Dark - Not Lighted']),
+                f"1XKW{rng.randint(10**12, 10**13 - 1)}", f"{rng.randint(1000000, 9999999)}", state,
+                str(rng.choice([1, 2, 3])), str(rng.randint(1, 3)), rng.choice(['Yes', 'No', 'Unknown']),
+                str(seq), 'N'
+            ])
+
+def write_revocations_file(path, dot_numbers, count, rng):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
+        writer.writerow(REVOCATION_HEADERS)
+        for dot_number in sample_dot_numbers(rng, dot_numbers, count):
+            serve_month = rng.randint(1, 11)
+            writer.writerow([
+                f"MC{rng.randint(100000, 1599999)}", f"{dot_number:08d}",
+                rng.choice(['COMMON', 'CONTRACT', 'BROKER']), f"{serve_month:02d}/{rng.randint(1, 28):02d}/2024",
+                rng.choice(['INVOLUNTARY REVOCATION', 'INSURANCE REVOCATION', 'VOLUNTARY REVOCATION']),
+                f"{serve_month + 1:02d}/{rng.randint(1, 28):02d}/2024"
+            ])
+
+def write_boc3_file(path, dot_numbers, count, rng, city_pool):
+    # Process agents file for many carriers each, so company names repeat heavily.
+    agents = [company_name(rng).replace('TRUCKING', 'PROCESS AGENTS') for _ in range(max(10, count // 200))]
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
+        writer.writerow(BOC3_HEADERS)
+        for dot_number in sample_dot_numbers(rng, dot_numbers, count):
+            city, state = rng.choice(city_pool)
+            name = rng.choice(agents) if rng.random() >= BLANK_COMPANY_RATE else ''
+            writer.writerow([
+                f"MC{rng.randint(100000, 1599999)}", str(dot_number), name, 'ATTN: PROCESS AGENT' if name else '',
+                f"{rng.randint(1, 99999)} {rng.choice(STREET_NAMES)}", city, state, 'US', f"{rng.randint(10000, 99999)}"
+            ])
+
+def write_readme(path, headers):
+    with open(path, 'w') as f:
+        for header in headers:
+            f.write(f"{header} - Synthetic {header.replace('_', ' ').lower()}\n")
+
+def write_lines(path, lines):
+    with open(path, 'w') as f:
+        f.writelines(f"{line}\n" for line in lines)
+
+def place(out_dir, directory, relative_path):
+    path = os.path.normpath(os.path.join(out_dir, directory, relative_path))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def script_constants():
+    # File names come from the scripts themselves so the layout follows each monthly release.
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from run_offline import load_module
+    return {name: load_module(name) for name in ('direct', 'icp', 'inspections', 'crashes', 'revocations', 'boc3')}
+
+def generate_dataset(out_dir, rows, seed=0):
+    """Write a full synthetic input tree under out_dir and return per-file row counts, sizes and timings."""
+    rng = random.Random(seed)
+    modules = script_constants()
+    direct, icp = modules['direct'], modules['icp']
+    inspections, crashes = modules['inspections'], modules['crashes']
+    revocations, boc3 = modules['revocations'], modules['boc3']
+    city_pool = read_city_pool()
+    dot_numbers = census_dot_numbers(rows, rng)
+    files = {}
+
+    def timed(kind, path, count, write, *args):
+        start = time.perf_counter()
+        write(path, *args)
+        files[kind] = {'path': os.path.relpath(path, out_dir), 'rows': count, 'bytes': os.path.getsize(path),
+                       'seconds': time.perf_counter() - start}
+        print(f"Wrote {count} rows to {path} in {files[kind]['seconds']:.1f}s")
+
+    census_file = place(out_dir, 'census_and_safety', direct.CENSUS_FILE)
+    timed('census', census_file, rows, write_census_file, dot_numbers, rng, city_pool)
+    for directory, module in (('census_and_safety', icp), ('inspections_and_violations', inspections),
+                              ('inspections_and_violations', crashes), ('revocations', revocations)):
+        other_census = place(out_dir, directory, module.CENSUS_FILE)
+        if not os.path.exists(other_census):
+            shutil.copyfile(census_file, other_census)
+
+    ab_count = int(rows * SCALE['safety_ab'])
+    c_count = int(rows * SCALE['safety_c'])
+    timed('safety_ab', place(out_dir, 'census_and_safety', direct.SAFETY_FILE_AB), ab_count, write_safety_file,
+          AB_HEADERS, sorted(rng.sample(dot_numbers, ab_count)), rng)
+    timed('safety_c', place(out_dir, 'census_and_safety', direct.SAFETY_FILE_C), c_count, write_safety_file,
+          C_HEADERS, sorted(rng.sample(dot_numbers, c_count)), rng)
+    for module in (direct, icp):
+        for readme, headers in ((module.README_FILE, CENSUS_HEADERS), (module.SAFETY_README_FILE, AB_HEADERS + C_HEADERS)):
+            write_readme(place(out_dir, 'census_and_safety', readme), headers)
+        shutil.copyfile(os.path.join(REPO_DIR, 'census_and_safety', 'exclude_columns.txt'),
+                        place(out_dir, 'census_and_safety', module.EXCLUDE_FILE))
+        shutil.copyfile(os.path.join(REPO_DIR, 'census_and_safety', 'cities', 'texas_cities.txt'),
+                        place(out_dir, 'census_and_safety', module.CITIES_FILE))
+    write_lines(place(out_dir, 'census_and_safety', icp.EXCLUDED_DOT_NUMBERS_FILE),
+                rng.sample(dot_numbers, min(len(dot_numbers), 500)))
+
+    count = int(rows * SCALE['inspections'])
+    timed('inspections', place(out_dir, 'inspections_and_violations', inspections.INSPECTIONS_FILE), count,
+          write_inspections_file, dot_numbers, count, rng)
+    write_readme(place(out_dir, 'inspections_and_violations', inspections.README_FILE), INSPECTION_HEADERS)
+
+    count = max(100, int(rows * SCALE['crashes']))
+    timed('crashes', place(out_dir, 'inspections_and_violations', crashes.CRASHES_FILE), count,
+          write_crashes_file, dot_numbers, count, rng)
+    write_readme(place(out_dir, 'inspections_and_violations', crashes.README_FILE), CRASH_HEADERS)
+
+    count = max(100, int(rows * SCALE['revocations']))
+    timed('revocations', place(out_dir, 'revocations', revocations.REVOCATIONS_FILE), count,
+          write_revocations_file, dot_numbers, count, rng)
+    write_readme(place(out_dir, 'revocations', revocations.README_FILE), REVOCATION_HEADERS)
+    shutil.copyfile(os.path.join(REPO_DIR, 'census_and_safety', 'cities', 'texas_cities.txt'),
+                    place(out_dir, 'revocations', revocations.CITIES_FILE))
+
+    count = max(100, int(rows * SCALE['boc3']))
+    timed('boc3', place(out_dir, 'boc3_filers', boc3.BOC3_FILE), count, write_boc3_file, dot_numbers, count, rng,
+          city_pool)
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic FMCSA input files for every pipeline.')
+    parser.add_argument('--rows', type=int, default=100000, help='Census carriers to generate (other files scale from this)')
+    parser.add_argument('--out', required=True, help='Directory to write the repo-shaped data tree into')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_dataset(args.out, args.rows, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 import csv
+import itertools
 import os
+import sys
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fmcsa_common import row_sort, sheets_quota
+
 # Google Sheets API setup
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 CLIENT_SECRET_FILE = './client_secret.json'
@@ -19,6 +26,19 @@ ROWS_PER_SHEET = 50000
 MAX_COLUMN_WIDTH = 250
 BATCH_SIZE = 1000
 MAX_RETRIES = 5
+UPLOAD_WORKERS = 4  # Tabs written concurrently, each with its own Sheets service; all of them share the one Sheets quota
+SHEETS_QUOTA_PER_USER = 60  # Requests per minute per user (Sheets API default quota)
+SHEETS_QUOTA_PER_PROJECT = 300  # Requests per minute per project
+SHEETS_BURST = 10  # Calls allowed back to back before pacing starts
+RATE_LIMIT_FLOOR = 0.1  # Repeated 429s never slow us below this share of the quota
+RATE_LIMIT_RECOVERY_SECONDS = 120  # Time to climb back from the floor to the full quota
+RATE_LIMIT_DEFAULT_PAUSE = 15  # Seconds to pause when a 429 has no usable Retry-After
+SORT_MEMORY_BYTES = 512 * 2**20  # Rows held in memory before a sorted run is spilled to disk
+SORT_SPILL_BATCH_ROWS = 1000  # Rows per marshalled batch; the merge holds one batch per run
+SORT_SPILL_DIR = None  # Where sorted runs are spilled; None means the system temp dir
+
+_rate_limiter = sheets_quota.new_rate_limiter(min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST)
+_worker_state = threading.local()
 
 def get_google_sheets_service():
     creds = None
@@ -48,16 +68,26 @@ def create_new_sheet(service, spreadsheet_id, sheet_name, num_rows, num_columns)
             }
         }]
     }
-    try:
-        response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-        return response['replies'][0]['addSheet']['properties']['sheetId']
-    except HttpError as error:
-        if 'already exists' in str(error):
-            sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-            for sheet in sheet_metadata.get('sheets', ''):
-                if sheet['properties']['title'] == sheet_name:
-                    return sheet['properties']['sheetId']
-        else:
+    for attempt in range(MAX_RETRIES):
+        try:
+            wait_for_quota()
+            response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+            return response['replies'][0]['addSheet']['properties']['sheetId']
+        except HttpError as error:
+            if error.resp.status == 429 and attempt < MAX_RETRIES - 1:
+                note_rate_limited(error)
+                continue
+            if error.resp.status >= 500 and attempt < MAX_RETRIES - 1:
+                time.sleep(2 ** attempt)
+                continue
+            if 'already exists' in str(error):
+                # If sheet already exists, get its ID
+                wait_for_quota()
+                sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+                for sheet in sheet_metadata.get('sheets', ''):
+                    if sheet['properties']['title'] == sheet_name:
+                        return sheet['properties']['sheetId']
+                return None
             raise
 
 def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
@@ -69,6 +99,7 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
         }
         for attempt in range(MAX_RETRIES):
             try:
+                wait_for_quota()
                 service.spreadsheets().values().update(
                     spreadsheetId=spreadsheet_id, range=range_name,
                     valueInputOption='RAW', body=body).execute()
@@ -76,12 +107,14 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
             except HttpError as error:
                 if attempt == MAX_RETRIES - 1:
                     raise
-                time.sleep(2 ** attempt)  # Exponential backoff
+                if error.resp.status == 429:
+                    note_rate_limited(error)  # The shared limiter waits out Retry-After
+                else:
+                    time.sleep(2 ** attempt)  # Exponential backoff
             except TimeoutError:
                 if attempt == MAX_RETRIES - 1:
                     raise
                 time.sleep(5)  # Wait 5 seconds before retrying on timeout
-        time.sleep(1)  # Short delay between batches
 
 def format_sheet(service, spreadsheet_id, sheet_id, num_columns):
     requests = [
@@ -142,82 +175,124 @@ def format_sheet(service, spreadsheet_id, sheet_id, num_columns):
     }
     for attempt in range(MAX_RETRIES):
         try:
+            wait_for_quota()
             service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
             break
         except HttpError as error:
             if attempt == MAX_RETRIES - 1:
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+            if error.resp.status == 429:
+                note_rate_limited(error)  # The shared limiter waits out Retry-After
+            else:
+                time.sleep(2 ** attempt)  # Exponential backoff
         except TimeoutError:
             if attempt == MAX_RETRIES - 1:
                 raise
             time.sleep(5)  # Wait 5 seconds before retrying on timeout
 
-def process_boc3_csv(boc3_file, service, spreadsheet_id):
+def wait_for_quota():
+    """Block until one more Sheets API call fits the quotas; see sheets_quota.wait_for_quota."""
+    sheets_quota.wait_for_quota(_rate_limiter, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST,
+                                RATE_LIMIT_RECOVERY_SECONDS)
+
+def note_rate_limited(error):
+    sheets_quota.note_rate_limited(_rate_limiter, error, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT),
+                                   RATE_LIMIT_FLOOR, RATE_LIMIT_DEFAULT_PAUSE)
+
+def get_worker_service(service_factory):
+    # googleapiclient service objects are not thread-safe, so each upload worker builds its own.
+    if getattr(_worker_state, 'service', None) is None:
+        _worker_state.service = service_factory()
+    return _worker_state.service
+
+def upload_tab(service_factory, spreadsheet_id, sheet_name, sheet_id, values, *format_args):
+    service = get_worker_service(service_factory)
+    write_to_sheet_batch(service, spreadsheet_id, sheet_name, values)
+    format_sheet(service, spreadsheet_id, sheet_id, *format_args)
+    print(f"Created and populated sheet: {sheet_name}")
+
+def submit_upload(uploader, pending_uploads, *upload_args):
+    # Bound the number of filled tabs held in memory while the workers catch up.
+    while len(pending_uploads) >= UPLOAD_WORKERS * 2:
+        pending_uploads.pop(0).result()
+    pending_uploads.append(uploader.submit(upload_tab, *upload_args))
+
+def finish_uploads(pending_uploads):
+    for upload in pending_uploads:
+        upload.result()
+
+def external_sort(rows, key):
+    """row_sort.external_sort, within this script's SORT_MEMORY_BYTES."""
+    return row_sort.external_sort(rows, key, SORT_MEMORY_BYTES, SORT_SPILL_BATCH_ROWS, SORT_SPILL_DIR)
+
+def pack_filer_tabs(sorted_rows, company_name_index, max_rows):
+    """Yield tabs of at most max_rows rows from COMPANY_NAME-sorted rows, keeping each filer on one tab.
+
+    Next-fit packing: a filer's rows go on the current tab if they fit, otherwise the tab is
+    closed and the filer starts the next one. A filer with more than max_rows rows can't fit on
+    any tab, so only those are split.
+    """
+    tab = []
+    for company_name, group in itertools.groupby(sorted_rows, key=lambda x: x[company_name_index]):
+        group = list(group)
+        if tab and len(tab) + len(group) > max_rows:
+            yield tab
+            tab = []
+        if len(group) > max_rows:
+            print(f"Filer {company_name!r} has {len(group)} rows, more than fit on one tab; splitting it.")
+            while len(group) > max_rows:
+                yield group[:max_rows]
+                group = group[max_rows:]
+        tab.extend(group)
+    if tab:
+        yield tab
+
+def process_boc3_csv(boc3_file, service, spreadsheet_id, service_factory=get_google_sheets_service):
     sheet_counter = 1
-    row_counter = 0
-    error_count = 0
     processed_count = 0
     ignored_count = 0
+    uploader = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+    pending_uploads = []
+    try:
+        with open(boc3_file, 'r', newline='', encoding='utf-8') as csvfile:
+            reader = csv.reader(csvfile)
+            headers = next(reader)
+            company_name_index = headers.index('COMPANY_NAME')
+            num_columns = len(headers)
 
-    with open(boc3_file, 'r', newline='', encoding='utf-8') as csvfile:
-        reader = csv.reader(csvfile)
-        headers = next(reader)
-        company_name_index = headers.index('COMPANY_NAME')
-        num_columns = len(headers)
-
-        print("Reading and sorting data...")
-        all_data = sorted(
-            (row for row in reader if row[company_name_index].strip()),
-            key=lambda x: x[company_name_index]
-        )
-        total_rows = len(all_data)
-        print(f"Total rows after filtering: {total_rows}")
-
-        current_sheet_data = [headers]
+            def filer_rows():
+                # Rows without a company name are counted here instead of in a second pass over the file.
+                nonlocal ignored_count
+                for row in reader:
+                    if row[company_name_index].strip():
+                        yield row
+                    else:
+                        ignored_count += 1
 
-        for line_num, row in enumerate(all_data, start=1):
-            try:
-                if line_num % 1000 == 0:
-                    print(f"Processed {line_num} out of {total_rows} rows ({(line_num/total_rows)*100:.2f}%)")
-
-                current_sheet_data.append(row)
-                row_counter += 1
-                processed_count += 1
-
-                if row_counter == ROWS_PER_SHEET:
-                    sheet_name = f'BOC3_Data_{sheet_counter}'
-                    sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, ROWS_PER_SHEET + 1, num_columns)
-                    write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data)
-                    format_sheet(service, spreadsheet_id, sheet_id, num_columns)
-                    print(f"Created and populated sheet: {sheet_name}")
-                    sheet_counter += 1
-                    row_counter = 0
-                    current_sheet_data = [headers]
-                    time.sleep(2)  # Add a delay between sheets
-
-            except Exception as e:
-                error_count += 1
-                print(f"Error processing line {line_num}: {str(e)}")
-                if error_count % 100 == 0:
-                    print(f"Encountered {error_count} errors. Last error: {str(e)}")
-                continue
+            print("Reading and sorting data...")
+            total_rows, sorted_rows = external_sort(filer_rows(), key=lambda x: x[company_name_index])
+            print(f"Total rows after filtering: {total_rows}")
 
-    # Write any remaining data
-    if len(current_sheet_data) > 1:
-        sheet_name = f'BOC3_Data_{sheet_counter}'
-        sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, len(current_sheet_data), num_columns)
-        write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data)
-        format_sheet(service, spreadsheet_id, sheet_id, num_columns)
-        print(f"Created and populated sheet: {sheet_name}")
+            # Each tab is queued for upload as soon as it's packed, while the next one is filled.
+            for tab_rows in pack_filer_tabs(sorted_rows, company_name_index, ROWS_PER_SHEET):
+                sheet_name = f'BOC3_Data_{sheet_counter}'
+                sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, len(tab_rows) + 1, num_columns)
+                submit_upload(uploader, pending_uploads, service_factory, spreadsheet_id, sheet_name, sheet_id,
+                              [headers] + tab_rows, num_columns)
+                print(f"Queued sheet for upload: {sheet_name}")
+                sheet_counter += 1
+                processed_count += len(tab_rows)
+                print(f"Processed {processed_count} out of {total_rows} rows ({(processed_count/total_rows)*100:.2f}%)")
 
-    ignored_count = sum(1 for row in csv.reader(open(boc3_file, 'r', newline='', encoding='utf-8')) if not row[company_name_index].strip()) - 1  # Subtract 1 to account for header
+        finish_uploads(pending_uploads)
+    finally:
+        # Also reached on an error: uploads that haven't started are dropped and the workers wind down.
+        uploader.shutdown(cancel_futures=True)
 
-    print(f"Processing complete. {sheet_counter} sheet(s) created in the Google Spreadsheet.")
+    print(f"Processing complete. {sheet_counter - 1} sheet(s) created in the Google Spreadsheet.")
     print(f"Total rows in input file: {total_rows + ignored_count}")
     print(f"Rows ignored (empty company name): {ignored_count}")
     print(f"Total rows processed: {processed_count}")
-    print(f"Total errors encountered: {error_count}")
 
 if __name__ == "__main__":
     service = get_google_sheets_service()
@@ -1,13 +1,32 @@
 import csv
+import io
 import os
 import time
-import chardet
+from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+from array import array
+import hashlib
+import json
+import re
+import sqlite3
+import struct
+import sys
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.compute as pc
+from contextlib import contextmanager
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fmcsa_common import csv_blocks, census_cache, sheets_quota
+from fmcsa_common.csv_blocks import detect_encoding, read_csv_header
+
 # Google Sheets API setup
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 CLIENT_SECRET_FILE = './client_secret.json'
@@ -26,11 +45,33 @@ EXCLUDE_FILE = 'exclude_columns.txt'
 CITIES_FILE = 'cities.txt'
 BATCH_SIZE = 1000
 MAX_RETRIES = 5
-
-def detect_encoding(file_path):
-    with open(file_path, 'rb') as file:
-        raw_data = file.read(10000)  # Read first 10000 bytes
-    return chardet.detect(raw_data)['encoding']
+UPLOAD_WORKERS = 4  # Tabs written concurrently, each with its own Sheets service; all of them share the one Sheets quota
+SHEETS_QUOTA_PER_USER = 60  # Requests per minute per user (Sheets API default quota)
+SHEETS_QUOTA_PER_PROJECT = 300  # Requests per minute per project
+SHEETS_BURST = 10  # Calls allowed back to back before pacing starts
+RATE_LIMIT_FLOOR = 0.1  # Repeated 429s never slow us below this share of the quota
+RATE_LIMIT_RECOVERY_SECONDS = 120  # Time to climb back from the floor to the full quota
+RATE_LIMIT_DEFAULT_PAUSE = 15  # Seconds to pause when a 429 has no usable Retry-After
+USE_CENSUS_CACHE = True
+DELTA_MODE = False  # Upload only carriers added, changed or removed since the previous release
+DELTA_STATE_DIR = 'delta_state'  # Per-release row hashes, next to the census file; only saved with DELTA_MODE or UPSERT_MODE on
+DELTA_PREVIOUS_RELEASE = None  # Release to compare against, e.g. 'FMCSA_CENSUS1_2024Oct'; None picks the latest one before this
+ROW_HASH_MAGIC = b'ROWHASH1'
+UPSERT_MODE = False  # Rewrite only changed rows in the tabs of earlier runs and add new carriers at the end
+SHEET_ROW_MAP_DIR = 'sheet_row_maps'  # (DOT_NUMBER, occurrence) -> (tab, row, hash) per spreadsheet, kept by UPSERT_MODE
+ROW_MAP_VERSION = 3  # Bumped whenever the row map's tables change; older maps are started over
+CENSUS_CACHE_DIR = 'census_cache'
+CENSUS_CACHE_CHUNK_ROWS = 250000
+PARSE_WORKERS = os.cpu_count() or 1  # Processes parsing blocks of the large text files
+PARSE_BLOCK_BYTES = 64 * 2**20  # Bytes per parse block; each one ends on a record boundary
+
+_rate_limiter = sheets_quota.new_rate_limiter(min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST)
+_worker_state = threading.local()
+
+def parse_blocks(path, encoding, block_task, *task_args, **options):
+    """csv_blocks.parse_blocks, with this script's PARSE_WORKERS and PARSE_BLOCK_BYTES."""
+    return csv_blocks.parse_blocks(path, encoding, block_task, *task_args, workers=PARSE_WORKERS,
+                                   block_bytes=PARSE_BLOCK_BYTES, **options)
 
 def get_google_sheets_service():
     creds = None
@@ -60,17 +101,26 @@ def create_new_sheet(service, spreadsheet_id, sheet_name, num_rows, num_columns)
             }
         }]
     }
-    try:
-        response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-        return response['replies'][0]['addSheet']['properties']['sheetId']
-    except HttpError as error:
-        if 'already exists' in str(error):
-            # If sheet already exists, get its ID
-            sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-            for sheet in sheet_metadata.get('sheets', ''):
-                if sheet['properties']['title'] == sheet_name:
-                    return sheet['properties']['sheetId']
-        else:
+    for attempt in range(MAX_RETRIES):
+        try:
+            wait_for_quota()
+            response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+            return response['replies'][0]['addSheet']['properties']['sheetId']
+        except HttpError as error:
+            if error.resp.status == 429 and attempt < MAX_RETRIES - 1:
+                note_rate_limited(error)
+                continue
+            if error.resp.status >= 500 and attempt < MAX_RETRIES - 1:
+                time.sleep(2 ** attempt)
+                continue
+            if 'already exists' in str(error):
+                # If sheet already exists, get its ID
+                wait_for_quota()
+                sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+                for sheet in sheet_metadata.get('sheets', ''):
+                    if sheet['properties']['title'] == sheet_name:
+                        return sheet['properties']['sheetId']
+                return None
             raise
 
 def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
@@ -82,6 +132,7 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
         }
         for attempt in range(MAX_RETRIES):
             try:
+                wait_for_quota()
                 service.spreadsheets().values().update(
                     spreadsheetId=spreadsheet_id, range=range_name,
                     valueInputOption='RAW', body=body).execute()
@@ -89,12 +140,14 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
             except HttpError as error:
                 if attempt == MAX_RETRIES - 1:
                     raise
-                time.sleep(2 ** attempt)  # Exponential backoff
+                if error.resp.status == 429:
+                    note_rate_limited(error)  # The shared limiter waits out Retry-After
+                else:
+                    time.sleep(2 ** attempt)  # Exponential backoff
             except TimeoutError:
                 if attempt == MAX_RETRIES - 1:
                     raise
                 time.sleep(5)  # Wait 5 seconds before retrying on timeout
-        time.sleep(1)  # Short delay between batches
 
 def format_sheet(service, spreadsheet_id, sheet_id, num_columns):
     requests = [
@@ -155,12 +208,16 @@ def format_sheet(service, spreadsheet_id, sheet_id, num_columns):
     }
     for attempt in range(MAX_RETRIES):
         try:
+            wait_for_quota()
             service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
             break
         except HttpError as error:
             if attempt == MAX_RETRIES - 1:
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+            if error.resp.status == 429:
+                note_rate_limited(error)  # The shared limiter waits out Retry-After
+            else:
+                time.sleep(2 ** attempt)  # Exponential backoff
         except TimeoutError:
             if attempt == MAX_RETRIES - 1:
                 raise
@@ -269,35 +326,424 @@ def format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descript
     }
     for attempt in range(MAX_RETRIES):
         try:
+            wait_for_quota()
             service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
             break
         except HttpError as error:
             if attempt == MAX_RETRIES - 1:
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+            if error.resp.status == 429:
+                note_rate_limited(error)  # The shared limiter waits out Retry-After
+            else:
+                time.sleep(2 ** attempt)  # Exponential backoff
         except TimeoutError:
             if attempt == MAX_RETRIES - 1:
                 raise
             time.sleep(5)  # Wait 5 seconds before retrying on timeout
 
+def encode_safety_block(text, dot_number_index, value_indices):
+    """Dictionary-encode one block of an SMS file into (dot_numbers, codes per column, values per column)."""
+    dot_numbers = array('q')
+    codes = [array('I') for _ in value_indices]
+    dictionaries = [{} for _ in value_indices]
+    for row in csv.reader(io.StringIO(text, newline=None)):
+        try:
+            dot_numbers.append(int(row[dot_number_index]))
+        except (ValueError, IndexError):
+            continue
+        for column_codes, dictionary, i in zip(codes, dictionaries, value_indices):
+            value = row[i] if i < len(row) else ''
+            column_codes.append(dictionary.setdefault(value, len(dictionary)))
+    return dot_numbers, codes, [list(dictionary) for dictionary in dictionaries]
+
 def read_safety_data(filename):
-    safety_data = {}
+    """Read an SMS safety file into a compact column store.
+
+    Carriers are kept as a sorted array of integer DOT numbers and every other column is
+    dictionary-encoded (the distinct values plus one small integer code per carrier), so
+    memory grows with distinct values rather than with one Python dict per carrier. Blocks
+    of the file are encoded in parallel and their dictionaries merged in file order.
+    """
     encoding = detect_encoding(filename)
-    with open(filename, 'r', encoding=encoding, errors='replace') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            dot_number = row['DOT_NUMBER']
-            del row['DOT_NUMBER']  # Remove DOT_NUMBER from the data we're storing
-            safety_data[dot_number] = row
-    return safety_data
+    headers = read_csv_header(filename, encoding)
+    dot_number_index = headers.index('DOT_NUMBER')
+    value_indices = [i for i in range(len(headers)) if i != dot_number_index]
+    dot_numbers = array('q')
+    codes = [array('I') for _ in value_indices]
+    dictionaries = [{} for _ in value_indices]
+    for _, (block_dot_numbers, block_codes, block_values) in parse_blocks(filename, encoding, encode_safety_block,
+                                                                          dot_number_index, value_indices):
+        dot_numbers.extend(block_dot_numbers)
+        for column_codes, dictionary, local_codes, local_values in zip(codes, dictionaries, block_codes, block_values):
+            remap = [dictionary.setdefault(value, len(dictionary)) for value in local_values]
+            column_codes.extend(array('I', map(remap.__getitem__, local_codes)))
+
+    order = sorted(range(len(dot_numbers)), key=dot_numbers.__getitem__)
+    return {
+        'headers': [headers[i] for i in value_indices],
+        'dot_numbers': array('q', (dot_numbers[i] for i in order)),
+        'codes': [array('I', (column_codes[i] for i in order)) for column_codes in codes],
+        'values': [list(dictionary) for dictionary in dictionaries]
+    }
 
 def merge_safety_data(safety_data_ab, safety_data_c):
-    merged_data = {}
-    for dot_number in set(safety_data_ab.keys()) | set(safety_data_c.keys()):
-        merged_data[dot_number] = {**safety_data_ab.get(dot_number, {}), **safety_data_c.get(dot_number, {})}
-    return merged_data
+    # The AB and C stores stay separate; lookups combine them per carrier. As with a dict
+    # merge, a column present in both files takes the C value when the carrier is in C.
+    headers = list(safety_data_ab['headers'])
+    headers.extend(header for header in safety_data_c['headers'] if header not in headers)
+    positions = {header: i for i, header in enumerate(headers)}
+    return {
+        'headers': headers,
+        'parts': [(store, [positions[header] for header in store['headers']])
+                  for store in (safety_data_ab, safety_data_c)]
+    }
+
+def lookup_safety_row(safety_data, dot_number):
+    row = [''] * len(safety_data['headers'])
+    try:
+        key = int(dot_number)
+    except ValueError:
+        return row
+    for store, positions in safety_data['parts']:
+        dot_numbers = store['dot_numbers']
+        # The sort keeps file order, so this is the carrier's last row: the one a dict of rows kept.
+        i = bisect.bisect_right(dot_numbers, key) - 1
+        if i >= 0 and dot_numbers[i] == key:
+            for position, column_codes, values in zip(positions, store['codes'], store['values']):
+                row[position] = values[column_codes[i]]
+    return row
+
+def census_cache_path(census_file, suffix='.parquet'):
+    return census_cache.census_cache_path(census_file, CENSUS_CACHE_DIR, suffix)
+
+def prune_census_cache(census_file):
+    census_cache.prune_census_cache(census_file, CENSUS_CACHE_DIR)
+
+def ensure_census_cache(census_file):
+    return census_cache.ensure_census_cache(census_file, CENSUS_CACHE_DIR, CENSUS_CACHE_CHUNK_ROWS,
+                                            PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def load_census_columns(census_file, columns=None):
+    """Load only the requested census columns from the columnar cache, building it on first use."""
+    return census_cache.load_census_columns(census_file, columns, CENSUS_CACHE_DIR, CENSUS_CACHE_CHUNK_ROWS,
+                                            PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def census_filter_mask(batch, city_states):
+    """Rows of a census batch in one of the chosen cities (and its state) that have an email address.
+
+    city_states holds 'city\tstate' keys, lowercased, built from read_cities.
+    """
+    city = pc.utf8_lower(pc.utf8_trim_whitespace(batch.column('PHY_CITY')))
+    state = pc.utf8_lower(pc.utf8_trim_whitespace(batch.column('PHY_STATE')))
+    # Caches written from pandas hold large_string columns; match the separator and lookup set to them.
+    keys = pc.binary_join_element_wise(city, state, pa.scalar('\t', type=city.type))
+    in_cities = pc.is_in(keys, value_set=city_states.cast(keys.type))
+    has_email = pc.not_equal(pc.utf8_trim_whitespace(batch.column('EMAIL_ADDRESS')), '')
+    return pc.and_(in_cities, has_email)
+
+def match_census_batch(batch, city_states):
+    """Return (rows in batch, indices of the matching rows, the matching rows) for one census batch."""
+    keep = census_filter_mask(batch, city_states)
+    indices = pc.indices_nonzero(pc.fill_null(keep, False))
+    return batch.num_rows, indices, batch.filter(keep)
+
+def census_block_matches(text, headers, columns, city_states):
+    return match_census_batch(census_cache.census_block_table(text, headers, columns), city_states)
+
+@contextmanager
+def open_census_matches(census_file, exclude_columns, city_states):
+    """Yield (headers, matches, describe_progress) for the census, from the columnar cache when enabled.
+
+    matches yields (rows read, line numbers, matching rows) per batch, the matching rows being a
+    pyarrow table or batch holding only the exported and filter columns. The filters run as
+    column operations, and on the raw file inside the PARSE_WORKERS processes that parse it.
+    """
+    # Only load the columns we export, plus the ones the filters need.
+    required_columns = {'DOT_NUMBER', 'PHY_CITY', 'PHY_STATE', 'EMAIL_ADDRESS'}
+
+    def with_line_numbers(batch_matches):
+        rows_read = 0
+        for num_rows, indices, survivors in batch_matches:
+            yield num_rows, pc.add(indices, rows_read + 2).to_pylist(), survivors
+            rows_read += num_rows
+
+    if USE_CENSUS_CACHE:
+        cache_path = ensure_census_cache(census_file)
+        census = pq.ParquetFile(cache_path)
+        headers = [header for header in census.schema_arrow.names
+                   if header not in exclude_columns or header in required_columns]
+        total_rows = census.metadata.num_rows
+        print(f"Reading {total_rows} census rows from columnar cache")
+
+        def describe_progress(rows_done):
+            return f"Processed {rows_done} out of {total_rows} rows ({(rows_done/total_rows)*100:.2f}%)"
+
+        batches = census.iter_batches(batch_size=CENSUS_CACHE_CHUNK_ROWS, columns=headers)
+        yield headers, with_line_numbers(match_census_batch(batch, city_states) for batch in batches), describe_progress
+        return
+
+    encoding = detect_encoding(census_file)
+    print(f"Detected encoding for census file: {encoding}")
+    all_headers = read_csv_header(census_file, encoding)
+    headers = [header for header in all_headers if header not in exclude_columns or header in required_columns]
+    total_bytes = os.path.getsize(census_file)
+    progress = {'bytes_read': 0}
+
+    def describe_progress(rows_done):
+        bytes_read = progress['bytes_read']
+        return f"Processed {rows_done} rows, {bytes_read} of {total_bytes} bytes ({(bytes_read/total_bytes)*100:.2f}%)"
+
+    def block_matches():
+        for end_offset, block in parse_blocks(census_file, encoding, census_block_matches, all_headers, headers, city_states):
+            progress['bytes_read'] = end_offset
+            yield block
+
+    yield headers, with_line_numbers(block_matches()), describe_progress
+
+def census_release(census_file):
+    return os.path.splitext(os.path.basename(census_file))[0]
+
+def row_hash_path(census_file, release=None):
+    state_dir = os.path.join(os.path.dirname(census_file), DELTA_STATE_DIR)
+    return os.path.join(state_dir, f"{release or census_release(census_file)}.rowhash")
+
+def row_hash(row):
+    content = '\x1f'.join('' if value is None else str(value) for value in row)
+    return int.from_bytes(hashlib.blake2b(content.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+def save_row_hashes(path, row_hashes):
+    """Write {dot_number: hash} as sorted DOT numbers and their hashes, two int64 arrays after a small header."""
+    dot_numbers = sorted(row_hashes)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as state_file:
+        state_file.write(ROW_HASH_MAGIC)
+        state_file.write(struct.pack('<q', len(dot_numbers)))
+        array('q', dot_numbers).tofile(state_file)
+        array('q', (row_hashes[dot_number] for dot_number in dot_numbers)).tofile(state_file)
+    os.replace(tmp_path, path)
+
+def load_row_hashes(path):
+    """Return (dot_numbers, hashes) arrays written by save_row_hashes; dot_numbers is sorted."""
+    with open(path, 'rb') as state_file:
+        if state_file.read(len(ROW_HASH_MAGIC)) != ROW_HASH_MAGIC:
+            raise ValueError(f"{path} is not a row hash file")
+        count = struct.unpack('<q', state_file.read(8))[0]
+        dot_numbers = array('q')
+        dot_numbers.fromfile(state_file, count)
+        hashes = array('q')
+        hashes.fromfile(state_file, count)
+    return dot_numbers, hashes
+
+def release_month(release):
+    """Return the month a release name like 'FMCSA_CENSUS1_2024Nov' ends with, or None."""
+    match = re.search(r'(\d{4})([A-Za-z]{3})$', release)
+    try:
+        return datetime.strptime(''.join(match.groups()), '%Y%b') if match else None
+    except ValueError:
+        return None
+
+def previous_row_hashes(census_file):
+    """Load the row hashes of DELTA_PREVIOUS_RELEASE, or of the latest release before this one.
+
+    Releases are ordered by the month in their names, so re-running an older month compares it
+    with the month before it rather than with a newer release. Without months to go by, more
+    than one candidate is an error unless DELTA_PREVIOUS_RELEASE says which to use.
+    """
+    if DELTA_PREVIOUS_RELEASE:
+        path = row_hash_path(census_file, DELTA_PREVIOUS_RELEASE)
+    else:
+        state_dir = os.path.dirname(row_hash_path(census_file))
+        release = census_release(census_file)
+        candidates = [os.path.splitext(name)[0] for name in os.listdir(state_dir)
+                      if name.endswith('.rowhash') and os.path.splitext(name)[0] != release] if os.path.isdir(state_dir) else []
+        if not candidates:
+            return None, None
+        month = release_month(release)
+        months = {candidate: release_month(candidate) for candidate in candidates}
+        if month is not None and None not in months.values():
+            earlier = [candidate for candidate in candidates if months[candidate] < month]
+            if not earlier:
+                return None, None
+            path = row_hash_path(census_file, max(earlier, key=months.get))
+        elif len(candidates) == 1:
+            path = row_hash_path(census_file, candidates[0])
+        else:
+            raise ValueError(f"Can't tell which of {sorted(candidates)} came before {release}; "
+                             f"set DELTA_PREVIOUS_RELEASE to the one to compare against")
+    if not os.path.exists(path):
+        return None, None
+    return os.path.splitext(os.path.basename(path))[0], load_row_hashes(path)
+
+def classify_row(previous, dot_number, current_hash):
+    """Return 'added', 'changed' or None (unchanged) for a row against the previous release's hashes."""
+    dot_numbers, hashes = previous
+    i = bisect.bisect_left(dot_numbers, dot_number)
+    if i == len(dot_numbers) or dot_numbers[i] != dot_number:
+        return 'added'
+    return None if hashes[i] == current_hash else 'changed'
+
+def open_row_map(spreadsheet_id):
+    """Open the SQLite map of where each carrier's row lives in a spreadsheet, creating it if needed.
+
+    A DOT number can appear more than once in the census, so rows are keyed by the DOT number
+    and its occurrence: 0 for its first row in the export, 1 for the next, and so on.
+    """
+    os.makedirs(SHEET_ROW_MAP_DIR, exist_ok=True)
+    db = sqlite3.connect(os.path.join(SHEET_ROW_MAP_DIR, f"{spreadsheet_id}.sqlite"))
+    if db.execute("PRAGMA user_version").fetchone()[0] != ROW_MAP_VERSION:
+        with db:
+            for table in ('meta', 'tabs', 'rows', 'free_rows'):
+                db.execute(f"DROP TABLE IF EXISTS {table}")
+            db.execute(f"PRAGMA user_version = {ROW_MAP_VERSION}")
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS tabs (title TEXT PRIMARY KEY, position INTEGER, sheet_id INTEGER, next_row INTEGER, grid_rows INTEGER)")
+    db.execute("CREATE TABLE IF NOT EXISTS rows (dot_number TEXT, occurrence INTEGER, tab TEXT, row INTEGER, hash INTEGER, "
+               "PRIMARY KEY (dot_number, occurrence))")
+    db.execute("CREATE TABLE IF NOT EXISTS free_rows (tab TEXT, row INTEGER, PRIMARY KEY (tab, row))")
+    return db
+
+def load_row_map(db, headers):
+    """Return {(dot_number, occurrence): (tab, row, hash)}, or None if the map is empty or was built for other columns."""
+    stored = db.execute("SELECT value FROM meta WHERE key = 'headers'").fetchone()
+    if stored is None or json.loads(stored[0]) != headers:
+        return None
+    if db.execute("SELECT COUNT(*) FROM tabs").fetchone()[0] == 0:
+        return None
+    return {(dot_number, occurrence): (tab, row, row_hash_value)
+            for dot_number, occurrence, tab, row, row_hash_value in db.execute("SELECT dot_number, occurrence, tab, row, hash FROM rows")}
+
+def save_row_map(db, headers, tabs):
+    """Replace the map with the tabs of a full write: (title, sheet_id, grid_rows, [(dot_number, occurrence, row, hash)])."""
+    with db:
+        for table in ('meta', 'tabs', 'rows', 'free_rows'):
+            db.execute(f"DELETE FROM {table}")
+        db.execute("INSERT INTO meta VALUES ('headers', ?)", (json.dumps(headers),))
+        for position, (title, sheet_id, grid_rows, entries) in enumerate(tabs, start=1):
+            next_row = max((row for _, _, row, _ in entries), default=1) + 1
+            db.execute("INSERT INTO tabs VALUES (?, ?, ?, ?, ?)", (title, position, sheet_id, next_row, grid_rows))
+            db.executemany("INSERT INTO rows VALUES (?, ?, ?, ?, ?)",
+                           ((dot_number, occurrence, title, row, row_hash_value)
+                            for dot_number, occurrence, row, row_hash_value in entries))
+
+def execute_with_retries(make_request):
+    """Execute make_request() under the shared quota limiter, retrying like write_to_sheet_batch."""
+    for attempt in range(MAX_RETRIES):
+        try:
+            wait_for_quota()
+            return make_request().execute()
+        except HttpError as error:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            if error.resp.status == 429:
+                note_rate_limited(error)  # The shared limiter waits out Retry-After
+            else:
+                time.sleep(2 ** attempt)  # Exponential backoff
+        except TimeoutError:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            time.sleep(5)  # Wait 5 seconds before retrying on timeout
 
-def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet_id):
+def allocate_rows(service, spreadsheet_id, db, count, headers, column_descriptions):
+    """Return count (tab, row) slots for new carriers: freed rows first, then the end of the last tab, then new tabs.
+
+    Tabs created and grids grown on the way are recorded at once, as they exist from then on.
+    The slots themselves stay free in the map until upsert_rows records what was written to them.
+    """
+    slots = [tuple(slot) for slot in db.execute("SELECT tab, row FROM free_rows ORDER BY tab, row LIMIT ?", (count,))]
+    num_columns = len(headers)
+    title, position, sheet_id, next_row, grid_rows = db.execute(
+        "SELECT title, position, sheet_id, next_row, grid_rows FROM tabs ORDER BY position DESC LIMIT 1").fetchone()
+    while len(slots) < count:
+        if next_row > ROWS_PER_SHEET + 1:
+            title = re.sub(r'\d+$', str(position + 1), title)
+            position += 1
+            sheet_id = create_new_sheet(service, spreadsheet_id, title, ROWS_PER_SHEET + 1, num_columns)
+            write_to_sheet_batch(service, spreadsheet_id, title, [headers])
+            format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, headers)
+            next_row, grid_rows = 2, ROWS_PER_SHEET + 1
+            with db:
+                db.execute("INSERT INTO tabs VALUES (?, ?, ?, ?, ?)", (title, position, sheet_id, next_row, grid_rows))
+            continue
+        take = min(count - len(slots), ROWS_PER_SHEET + 2 - next_row)
+        if next_row + take - 1 > grid_rows:
+            # Tabs are created just big enough for their rows; grow the grid before writing past it.
+            grow = next_row + take - 1 - grid_rows
+            execute_with_retries(lambda: service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={
+                'requests': [{'appendDimension': {'sheetId': sheet_id, 'dimension': 'ROWS', 'length': grow}}]}))
+            grid_rows += grow
+            with db:
+                db.execute("UPDATE tabs SET grid_rows = ? WHERE title = ?", (grid_rows, title))
+        slots.extend((title, row) for row in range(next_row, next_row + take))
+        next_row += take
+    return slots
+
+def upsert_rows(service, spreadsheet_id, db, updates, additions, removals, headers, column_descriptions):
+    """Write changed rows in place, put new carriers into free or new rows and blank out removed ones.
+
+    updates are (dot_number, occurrence, tab, row, hash, values), additions (dot_number,
+    occurrence, hash, values) and removals (dot_number, occurrence, tab, row). Every write is a
+    values.batchUpdate of up to BATCH_SIZE single-row ranges. The rows it wrote, and the free
+    rows or tab ends it used up, are committed together after each one, so an interrupted run
+    can resume without losing or doubling up rows.
+    """
+    slots = allocate_rows(service, spreadsheet_id, db, len(additions), headers, column_descriptions)
+    writes = list(updates)
+    writes.extend((dot_number, occurrence, tab, row, row_hash_value, values)
+                  for (dot_number, occurrence, row_hash_value, values), (tab, row) in zip(additions, slots))
+    blank = [''] * len(headers)
+    writes.extend((dot_number, occurrence, tab, row, None, blank) for dot_number, occurrence, tab, row in removals)
+
+    for i in range(0, len(writes), BATCH_SIZE):
+        batch = writes[i:i + BATCH_SIZE]
+        body = {'valueInputOption': 'RAW',
+                'data': [{'range': f"{tab}!A{row}", 'values': [values]} for _, _, tab, row, _, values in batch]}
+        execute_with_retries(lambda: service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body))
+        with db:
+            for dot_number, occurrence, tab, row, row_hash_value, _ in batch:
+                if row_hash_value is None:
+                    db.execute("DELETE FROM rows WHERE dot_number = ? AND occurrence = ?", (dot_number, occurrence))
+                    db.execute("INSERT OR IGNORE INTO free_rows VALUES (?, ?)", (tab, row))
+                else:
+                    db.execute("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?)",
+                               (dot_number, occurrence, tab, row, row_hash_value))
+                    db.execute("DELETE FROM free_rows WHERE tab = ? AND row = ?", (tab, row))
+                    db.execute("UPDATE tabs SET next_row = MAX(next_row, ?) WHERE title = ?", (row + 1, tab))
+        print(f"Upserted {min(i + BATCH_SIZE, len(writes))} of {len(writes)} rows")
+
+def wait_for_quota():
+    """Block until one more Sheets API call fits the quotas; see sheets_quota.wait_for_quota."""
+    sheets_quota.wait_for_quota(_rate_limiter, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST,
+                                RATE_LIMIT_RECOVERY_SECONDS)
+
+def note_rate_limited(error):
+    sheets_quota.note_rate_limited(_rate_limiter, error, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT),
+                                   RATE_LIMIT_FLOOR, RATE_LIMIT_DEFAULT_PAUSE)
+
+def get_worker_service(service_factory):
+    # googleapiclient service objects are not thread-safe, so each upload worker builds its own.
+    if getattr(_worker_state, 'service', None) is None:
+        _worker_state.service = service_factory()
+    return _worker_state.service
+
+def upload_tab(service_factory, spreadsheet_id, sheet_name, sheet_id, values, *format_args):
+    service = get_worker_service(service_factory)
+    write_to_sheet_batch(service, spreadsheet_id, sheet_name, values)
+    format_sheet(service, spreadsheet_id, sheet_id, *format_args)
+    print(f"Created and populated sheet: {sheet_name}")
+
+def submit_upload(uploader, pending_uploads, *upload_args):
+    # Bound the number of filled tabs held in memory while the workers catch up.
+    while len(pending_uploads) >= UPLOAD_WORKERS * 2:
+        pending_uploads.pop(0).result()
+    pending_uploads.append(uploader.submit(upload_tab, *upload_args))
+
+def finish_uploads(pending_uploads):
+    for upload in pending_uploads:
+        upload.result()
+
+def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet_id,
+                service_factory=get_google_sheets_service):
     exclude_columns = read_exclude_columns(EXCLUDE_FILE)
     cities = read_cities(CITIES_FILE)
     column_descriptions_census = read_column_descriptions(README_FILE)
@@ -324,96 +770,182 @@ def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet
     skipped_count = 0
     processed_count = 0
     included_count = 0
+    total_rows = 0
+
+    city_states = pa.array([f"{city}\t{state}" for city, state in cities.items()], type=pa.string())
+
+    # Delta and upsert runs record a hash of each exported row so the next release can be compared against it.
+    save_hashes = DELTA_MODE or UPSERT_MODE
+    release = census_release(census_file)
+    row_hashes = {}
+    change_counts = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+    previous = None
+    sheet_prefix = 'Merged_Data'
+    if DELTA_MODE and not UPSERT_MODE:
+        previous_release, previous = previous_row_hashes(census_file)
+        if previous is None:
+            print("Delta mode: no row hashes from a previous release, so every carrier counts as added.")
+            previous = (array('q'), array('q'))
+        else:
+            print(f"Delta mode: comparing against {previous_release} ({len(previous[0])} carriers)")
+        sheet_prefix = f"Delta_{release.rsplit('_', 1)[-1]}"
+
+    # In upsert mode an earlier run's row map turns this run into in-place updates; without one
+    # the tabs are written in full and the map records where each carrier landed.
+    row_map_db = open_row_map(spreadsheet_id) if UPSERT_MODE else None
+    row_map = None
+    updates = []
+    additions = []
+    occurrences = {}  # DOT_NUMBER -> rows seen so far, which tells duplicated DOT numbers apart in the row map
+    written_tabs = []
+    tab_rows = []
+
+    uploader = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+    pending_uploads = []
+    try:
+        with open_census_matches(census_file, exclude_columns, city_states) as (headers, matches, describe_progress):
+            census_headers = [header for header in headers if header not in exclude_columns]
+            filtered_headers = list(census_headers)
 
-    encoding = detect_encoding(census_file)
-    print(f"Detected encoding for census file: {encoding}")
-
-    with open(census_file, 'r', encoding=encoding, errors='replace') as csvfile:
-        reader = csv.reader(csvfile)
-        headers = next(reader)
-
-        include_indices = [i for i, header in enumerate(headers) if header not in exclude_columns]
-        filtered_headers = [headers[i] for i in include_indices]
-
-        # Add safety data headers
-        if safety_data:
-            safety_headers = list(next(iter(safety_data.values())).keys())
+            # Add safety data headers
+            safety_headers = safety_data['headers']
             filtered_headers.extend(safety_headers)
-
-        current_sheet_data.append(filtered_headers)
-        num_columns = len(filtered_headers)
-
-        dot_number_index = headers.index('DOT_NUMBER')
-        phy_city_index = headers.index('PHY_CITY')
-        phy_state_index = headers.index('PHY_STATE')
-        email_index = headers.index('EMAIL_ADDRESS')
-
-        total_rows = sum(1 for _ in reader)
-        csvfile.seek(0)
-        next(reader)  # Skip header again
-
-        for line_num, row in enumerate(reader, start=2):
-            try:
-                if line_num % 1000 == 0:
-                    print(f"Processed {line_num} out of {total_rows} rows ({(line_num/total_rows)*100:.2f}%)")
-
-                city = row[phy_city_index].strip().lower()
-                state = row[phy_state_index].strip().lower()
-
-                if city not in cities or cities[city] != state:
-                    skipped_count += 1
-                    continue
-
-                if not row[email_index].strip():
-                    skipped_count += 1
-                    continue
-
-                filtered_row = [row[i] for i in include_indices]
-
-                # Add safety data
-                dot_number = row[dot_number_index]
-                if dot_number in safety_data:
-                    filtered_row.extend(safety_data[dot_number].values())
+            if DELTA_MODE and not UPSERT_MODE:
+                filtered_headers.append('CHANGE')
+            if UPSERT_MODE:
+                row_map = load_row_map(row_map_db, filtered_headers)
+                if row_map is None:
+                    print("Upsert mode: no row map for these columns yet, writing every row.")
                 else:
-                    filtered_row.extend([''] * len(safety_headers))
-
-                current_sheet_data.append(filtered_row)
-                row_counter += 1
-                processed_count += 1
-                included_count += 1
-
-                if row_counter == ROWS_PER_SHEET:
-                    sheet_name = f'Merged_Data_{sheet_counter}'
-                    sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, ROWS_PER_SHEET + 1, num_columns)
-                    write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data)
-                    format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, filtered_headers)
-                    print(f"Created and populated sheet: {sheet_name}")
-                    sheet_counter += 1
-                    row_counter = 0
-                    current_sheet_data = [filtered_headers]
-                    time.sleep(2)  # Add a delay between sheets
-
-            except Exception as e:
-                error_count += 1
-                print(f"Error processing line {line_num}: {str(e)}")
-                if error_count % 100 == 0:
-                    print(f"Encountered {error_count} errors. Last error: {str(e)}")
-                continue
-
-    # Write any remaining data
-    if row_counter > 0:
-        sheet_name = f'Merged_Data_{sheet_counter}'
-        sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, row_counter + 1, num_columns)
-        write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data)
-        format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, filtered_headers)
-        print(f"Created and populated sheet: {sheet_name}")
-
-    print(f"Processing complete. {sheet_counter} sheet(s) created in the Google Spreadsheet.")
+                    print(f"Upsert mode: {len(row_map)} carriers already in the spreadsheet")
+
+            current_sheet_data.append(filtered_headers)
+            num_columns = len(filtered_headers)
+
+            for num_rows, line_numbers, survivors in matches:
+                # Only rows that passed the city / state and email filters reach Python.
+                total_rows += num_rows
+                skipped_count += num_rows - survivors.num_rows
+
+                rows = zip(line_numbers, survivors.column('DOT_NUMBER').to_pylist(),
+                           zip(*(survivors.column(header).to_pylist() for header in census_headers)))
+                for line_num, dot_number, row in rows:
+                    try:
+                        filtered_row = list(row)
+
+                        # Add safety data
+                        filtered_row.extend(lookup_safety_row(safety_data, dot_number))
+
+                        current_hash = row_hash(filtered_row)
+                        try:
+                            key = int(dot_number)
+                        except ValueError:
+                            key = None  # Can't be matched across releases, so never unchanged
+                        if key is not None and save_hashes:
+                            row_hashes[key] = current_hash
+                        if previous is not None:
+                            change = classify_row(previous, key, current_hash) if key is not None else 'added'
+                            if change is None:
+                                change_counts['unchanged'] += 1
+                                continue
+                            change_counts[change] += 1
+                            filtered_row.append(change)
+                        if UPSERT_MODE:
+                            # The row map goes by the DOT_NUMBER as written, so carriers whose number isn't
+                            # numeric are found again too.
+                            occurrence = occurrences.get(dot_number, 0)
+                            occurrences[dot_number] = occurrence + 1
+                        if row_map is not None:
+                            processed_count += 1
+                            included_count += 1
+                            entry = row_map.get((dot_number, occurrence))
+                            if entry is None:
+                                additions.append((dot_number, occurrence, current_hash, filtered_row))
+                            elif entry[2] != current_hash:
+                                updates.append((dot_number, occurrence, entry[0], entry[1], current_hash, filtered_row))
+                            continue
+
+                        current_sheet_data.append(filtered_row)
+                        if UPSERT_MODE:
+                            tab_rows.append((dot_number, occurrence, len(current_sheet_data), current_hash))
+                        row_counter += 1
+                        processed_count += 1
+                        included_count += 1
+
+                        if row_counter == ROWS_PER_SHEET:
+                            sheet_name = f'{sheet_prefix}_{sheet_counter}'
+                            sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, ROWS_PER_SHEET + 1, num_columns)
+                            submit_upload(uploader, pending_uploads, service_factory, spreadsheet_id, sheet_name, sheet_id,
+                                          current_sheet_data, num_columns, column_descriptions, filtered_headers)
+                            print(f"Queued sheet for upload: {sheet_name}")
+                            written_tabs.append((sheet_name, sheet_id, ROWS_PER_SHEET + 1, tab_rows))
+                            tab_rows = []
+                            sheet_counter += 1
+                            row_counter = 0
+                            current_sheet_data = [filtered_headers]
+
+                    except Exception as e:
+                        error_count += 1
+                        print(f"Error processing line {line_num}: {str(e)}")
+                        if error_count % 100 == 0:
+                            print(f"Encountered {error_count} errors. Last error: {str(e)}")
+                        continue
+
+                print(describe_progress(total_rows))
+
+        # Write any remaining data
+        if row_counter > 0:
+            sheet_name = f'{sheet_prefix}_{sheet_counter}'
+            sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, row_counter + 1, num_columns)
+            submit_upload(uploader, pending_uploads, service_factory, spreadsheet_id, sheet_name, sheet_id,
+                          current_sheet_data, num_columns, column_descriptions, filtered_headers)
+            written_tabs.append((sheet_name, sheet_id, row_counter + 1, tab_rows))
+
+        if row_map is not None:
+            removals = [(dot_number, occurrence, tab, row) for (dot_number, occurrence), (tab, row, _) in row_map.items()
+                        if occurrence >= occurrences.get(dot_number, 0)]
+            print(f"Upsert: {len(updates)} changed, {len(additions)} new, {len(removals)} removed, "
+                  f"{len(row_map) - len(updates) - len(removals)} unchanged")
+            upsert_rows(service, spreadsheet_id, row_map_db, updates, additions, removals, filtered_headers, column_descriptions)
+
+        if previous is not None:
+            # Carriers exported last time that no longer pass the filters or have left the census.
+            removed = [[str(dot_number), 'removed'] for dot_number in previous[0] if dot_number not in row_hashes]
+            change_counts['removed'] = len(removed)
+            if removed:
+                sheet_name = f"Removed_{release.rsplit('_', 1)[-1]}"
+                removed_headers = ['DOT_NUMBER', 'CHANGE']
+                sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, len(removed) + 1, len(removed_headers))
+                submit_upload(uploader, pending_uploads, service_factory, spreadsheet_id, sheet_name, sheet_id,
+                              [removed_headers] + removed, len(removed_headers), column_descriptions, removed_headers)
+        finish_uploads(pending_uploads)
+    finally:
+        # Also reached on an error: uploads that haven't started are dropped and the workers wind down.
+        uploader.shutdown(cancel_futures=True)
+    if UPSERT_MODE and row_map is None:
+        # Only record the tabs once their uploads have gone through.
+        save_row_map(row_map_db, filtered_headers, written_tabs)
+    if row_map_db is not None:
+        row_map_db.close()
+
+    if save_hashes:
+        save_row_hashes(row_hash_path(census_file), row_hashes)
+        print(f"Saved {len(row_hashes)} row hashes for {release}")
+
+    if row_map is not None:
+        print(f"Processing complete. Upserted into the Google Spreadsheet: {len(updates)} row(s) rewritten, "
+              f"{len(additions)} added, {len(removals)} blanked.")
+    else:
+        sheets_created = len(written_tabs) + (1 if change_counts['removed'] else 0)
+        print(f"Processing complete. {sheets_created} sheet(s) created in the Google Spreadsheet.")
     print(f"Total rows in input file: {total_rows}")
     print(f"Total rows processed: {processed_count}")
     print(f"Total rows included: {included_count}")
     print(f"Total rows skipped: {skipped_count}")
     print(f"Total errors encountered: {error_count}")
+    if previous is not None:
+        print(f"Delta: {change_counts['added']} added, {change_counts['changed']} changed, "
+              f"{change_counts['removed']} removed, {change_counts['unchanged']} unchanged")
 
 if __name__ == "__main__":
     service = get_google_sheets_service()
@@ -1,8 +1,15 @@
 import csv
+import io
 import os
 import time
-import chardet
-import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+from array import array
+import re
+import sys
+import operator
 import requests
 from pprint import pformat
 
@@ -25,8 +32,16 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from webdriver_manager.chrome import ChromeDriverManager
 from bs4 import BeautifulSoup
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:
+    lxml_html = None  # Falls back to BeautifulSoup's html.parser
 from urllib.parse import urlparse, unquote, quote_plus, urlencode
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fmcsa_common import csv_blocks, scrape_cache, sheets_quota
+from fmcsa_common.csv_blocks import detect_encoding, read_csv_header
+
 # This script will try to filter down to companies with 10-50 power units, not government entities, with > 5 OOS or violations. It will only include
 # companies with truck tractors or trailers.
 
@@ -34,15 +49,23 @@ from urllib.parse import urlparse, unquote, quote_plus, urlencode
 chrome_options = Options()
 chrome_options.add_argument("--headless")  # Run in headless mode
 
-# Set up WebDriver using webdriver_manager. We use scraping the FMCSA to get vehicle counts
-driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+# We use scraping the FMCSA to get vehicle counts. Each scrape worker thread starts its own
+# WebDriver (set up with webdriver_manager) only when a page needs a browser, so cached or
+# offline runs never launch Chrome.
 
 # Google Sheets API setup
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 CLIENT_SECRET_FILE = './client_secret.json'
 TOKEN_FILE = 'token.json'
 SPREADSHEET_ID = '1hdza5Q5G8xfiTtqGXjEMHgh-mcg_yjlt8-45XT6V89E';
-SCRAPING_CACHE_DIR='scraping_cache/'
+SCRAPING_CACHE_DIR='scraping_cache/'  # Old one-file-per-page cache, imported into SCRAPE_CACHE_FILE on first use
+SCRAPE_CACHE_FILE = 'scraping_cache.sqlite'
+SCRAPE_CACHE_MAX_BYTES = 512 * 2**20  # Least recently used pages are evicted beyond this
+SCRAPE_CACHE_DEFAULT_TTL = 30 * 86400  # Seconds; None keeps pages forever
+SCRAPE_CACHE_TTLS = [
+    (r'/SMS/Carrier/\d+/CarrierRegistration\.aspx', 30 * 86400),  # Fleet sizes change slowly
+    (r'safer\.fmcsa\.dot\.gov/query\.asp', 7 * 86400)
+]
 
 # File setup
 CENSUS_FILE = 'raw_data/FMCSA_CENSUS1_2024Nov.txt'
@@ -57,9 +80,67 @@ EXCLUDE_FILE = 'exclude_columns.txt'
 CITIES_FILE = 'cities.txt'
 BATCH_SIZE = 1000
 MAX_RETRIES = 5
-
-# Ensure the scraping cache directory exists
-os.makedirs(SCRAPING_CACHE_DIR, exist_ok=True)
+UPLOAD_WORKERS = 4  # Tabs written concurrently, each with its own Sheets service; all of them share the one Sheets quota
+SHEETS_QUOTA_PER_USER = 60  # Requests per minute per user (Sheets API default quota)
+SHEETS_QUOTA_PER_PROJECT = 300  # Requests per minute per project
+SHEETS_BURST = 10  # Calls allowed back to back before pacing starts
+RATE_LIMIT_FLOOR = 0.1  # Repeated 429s never slow us below this share of the quota
+RATE_LIMIT_RECOVERY_SECONDS = 120  # Time to climb back from the floor to the full quota
+RATE_LIMIT_DEFAULT_PAUSE = 15  # Seconds to pause when a 429 has no usable Retry-After
+PARSE_WORKERS = os.cpu_count() or 1  # Processes parsing blocks of the large text files
+PARSE_BLOCK_BYTES = 64 * 2**20  # Bytes per parse block; each one ends on a record boundary
+USE_HTTP_FETCH = True  # Try a plain GET for carrier registration pages before starting Chrome
+HTTP_FETCH_TIMEOUT = 20  # Seconds
+SCRAPE_REQUESTS_PER_MINUTE = 120  # Politeness budget for plain HTTP fetches
+VEHICLE_TABLE_MARKER = 'vehType'  # Present in pages that already carry the vehicle table
+# Case-insensitive phrases of server-rendered registration pages that have no vehicle table because
+# SMS has no record or no vehicles for the carrier; extend it as new ones turn up in the HTTP fallbacks.
+NO_VEHICLES_MARKERS = ['No records found', 'Record Not Found', 'No registration information', 'No vehicle information']
+SCRAPE_WORKERS = 4  # Candidates scraped concurrently, each worker with at most one browser
+BROWSER_RECYCLE_PAGES = 200  # Restart a worker's Chrome after this many pages to cap its memory
+HTML_ENGINE = 'lxml'  # 'lxml' (C parser, precompiled XPath) or 'bs4' (BeautifulSoup html.parser)
+VEHICLE_TYPES = ['Straight Trucks', 'Truck Tractors', 'Trailers', 'Hazmat Cargo Tank Trailers', 'Hazmat Cargo Tank Trucks']
+VEHICLE_COUNT_URL = 'https://ai.fmcsa.dot.gov/SMS/Carrier/{}/CarrierRegistration.aspx'
+CENSUS_CHUNK_ROWS = 200000  # Census rows per pandas chunk in the planning pass
+BROWSER_PAGE_SECONDS = 8  # Rough time for Chrome to load one registration page, for the scrape estimate
+MAX_SCRAPES = None  # Stop before scraping if the plan needs more uncached pages than this; None for no limit
+PLAN_ONLY = False  # Print the candidate count and scrape estimate, then stop
+# Segment definition: every clause must hold. A clause is (column, op, value), (column, 'between', low, high)
+# or ('any', [clauses]). Numeric comparisons need the column to hold an integer; rows where any numeric
+# column in the filter doesn't parse are left out.
+SEGMENT_FILTER = [
+    ('AUTHORIZED_FOR_HIRE', '!=', 'N'),
+    ('FEDERAL_GOVERNMENT', '!=', 'Y'),
+    ('STATE_GOVERNMENT', '!=', 'Y'),
+    ('LOCAL_GOVERNMENT', '!=', 'Y'),
+    ('NBR_POWER_UNIT', 'between', 10, 50),
+    ('any', [('VEHICLE_OOS_INSP_TOTAL', '>=', 5), ('VEH_MAINT_INSP_W_VIOL', '>=', 5)])  # Focus on oos truck counts, AND/OR maintenance violations
+]
+FILTER_OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+INTEGER_PATTERN = r'\s*[+-]?\d+\s*'
+
+_rate_limiter = sheets_quota.new_rate_limiter(min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST)
+_worker_state = threading.local()
+_scrape_state = {
+    'lock': threading.Lock(),
+    'next_slot': 0.0,
+    'sessions': threading.local()
+}
+if lxml_html is not None:
+    VEHICLE_TYPE_HEADERS = etree.XPath('//th[contains(concat(" ", normalize-space(@class), " "), " vehType ")]')
+
+_browser_state = {
+    'lock': threading.Lock(),
+    'local': threading.local(),
+    'drivers': set()
+}
+_fetch_stats = {
+    'lock': threading.Lock(),
+    'counts': {'cache': 0, 'http': 0, 'browser': 0},
+    'seconds': {'cache': 0.0, 'http': 0.0, 'browser': 0.0},
+    'http_fallbacks': 0
+}
+_scrape_cache = scrape_cache.new_scrape_cache()
 
 def read_excluded_dot_numbers(filename):
     excluded_dot_numbers = set()
@@ -71,58 +152,217 @@ def read_excluded_dot_numbers(filename):
 def pretty_print_dict(d):
     return pformat(d, indent=4)
 
+def classify_registration_page(page):
+    """Return 'vehicles' or 'no_vehicles' for a registration page that can be read as is, otherwise None.
+
+    None is a page without the vehicle table that isn't a known "no vehicles" reply either, such
+    as a script-rendered shell or a bot challenge; only Chrome can get the real page.
+    """
+    if VEHICLE_TABLE_MARKER in page:
+        return 'vehicles'
+    text = page.lower()
+    if any(marker.lower() in text for marker in NO_VEHICLES_MARKERS):
+        return 'no_vehicles'
+    return None
+
+def is_registration_page(page):
+    """True for a page classify_registration_page can read, the only kind worth caching."""
+    return classify_registration_page(page) is not None
+
+def open_scrape_cache():
+    return scrape_cache.open_scrape_cache(_scrape_cache, SCRAPE_CACHE_FILE)
+
 def get_cached_page(url):
-    """Retrieve a cached page if it exists, otherwise return None."""
-    filename = hashlib.md5(url.encode()).hexdigest() + '.html'
-    filepath = os.path.join(SCRAPING_CACHE_DIR, filename)
-    if os.path.exists(filepath):
+    return scrape_cache.get_cached_page(_scrape_cache, SCRAPE_CACHE_FILE, url, SCRAPE_CACHE_TTLS, SCRAPE_CACHE_DEFAULT_TTL)
+
+def cached_urls(urls):
+    return scrape_cache.cached_urls(_scrape_cache, SCRAPE_CACHE_FILE, urls, SCRAPE_CACHE_TTLS, SCRAPE_CACHE_DEFAULT_TTL)
+
+def cache_page(url, content, fetched_at=None):
+    """Store a registration page in the cache, unless is_registration_page turns it down."""
+    return scrape_cache.cache_page(_scrape_cache, SCRAPE_CACHE_FILE, url, content, SCRAPE_CACHE_MAX_BYTES,
+                                   is_registration_page, fetched_at)
+
+def scrape_cache_summary():
+    return scrape_cache.scrape_cache_summary(_scrape_cache)
+
+def import_legacy_scrape_cache():
+    """Move pages from the old scraping_cache/ directory into the packed cache, once."""
+    if not os.path.isdir(SCRAPING_CACHE_DIR):
+        return
+    with _scrape_cache['lock']:
+        db = open_scrape_cache()
+        if db.execute("SELECT 1 FROM pages LIMIT 1").fetchone():
+            return
+    imported = 0
+    for filename in os.listdir(SCRAPING_CACHE_DIR):
+        if not filename.endswith('.html'):
+            continue
+        filepath = os.path.join(SCRAPING_CACHE_DIR, filename)
         with open(filepath, 'r', encoding='utf-8') as file:
-            return file.read()
-    return None
+            content = file.read()
+        with _scrape_cache['lock']:
+            db.execute("BEGIN")
+            content_hash = scrape_cache.store_body(_scrape_cache, db, content)
+            # The old files were named by the URL's md5, which is also our key; the URL itself is unknown.
+            mtime = os.path.getmtime(filepath)
+            db.execute("INSERT OR IGNORE INTO pages VALUES (?, NULL, ?, ?, ?)", (filename[:-5], mtime, mtime, content_hash))
+            db.execute("COMMIT")
+        imported += 1
+    print(f"Imported {imported} pages from {SCRAPING_CACHE_DIR} into {SCRAPE_CACHE_FILE}; the old directory can be deleted.")
+
+def get_driver():
+    """Return this thread's WebDriver, starting it on first use and recycling it every BROWSER_RECYCLE_PAGES pages."""
+    local = _browser_state['local']
+    driver = getattr(local, 'driver', None)
+    if driver is not None and driver not in _browser_state['drivers']:
+        driver = None  # Closed by quit_drivers()
+    if driver is not None and local.pages >= BROWSER_RECYCLE_PAGES:
+        release_driver(driver)
+        driver = None
+    if driver is None:
+        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+        with _browser_state['lock']:
+            _browser_state['drivers'].add(driver)
+        local.driver = driver
+        local.pages = 0
+    local.pages += 1
+    return driver
+
+def release_driver(driver):
+    with _browser_state['lock']:
+        _browser_state['drivers'].discard(driver)
+    try:
+        driver.quit()
+    except Exception as e:
+        print(f"Error closing browser: {e}")
+
+def quit_drivers():
+    with _browser_state['lock']:
+        drivers = list(_browser_state['drivers'])
+    for driver in drivers:
+        release_driver(driver)
 
-def cache_page(url, content):
-    """Cache a page's content."""
-    filename = hashlib.md5(url.encode()).hexdigest() + '.html'
-    filepath = os.path.join(SCRAPING_CACHE_DIR, filename)
-    with open(filepath, 'w', encoding='utf-8') as file:
-        file.write(content)
+def scrape_in_order(candidates):
+    """Yield (candidate, future) for each (dot_number, ...) candidate, in input order.
+
+    Vehicle counts are collected by SCRAPE_WORKERS threads that run up to a few candidates
+    ahead of the consumer; future.result() gives the counts or raises the scrape error.
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as scraper:
+        for candidate in candidates:
+            pending.append((candidate, scraper.submit(collect_vehicle_counts, candidate[0])))
+            if len(pending) >= SCRAPE_WORKERS * 4:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+def wait_for_scrape_slot():
+    """Space plain HTTP fetches to SCRAPE_REQUESTS_PER_MINUTE, with a little jitter."""
+    interval = 60.0 / SCRAPE_REQUESTS_PER_MINUTE
+    with _scrape_state['lock']:
+        now = time.monotonic()
+        slot = max(now, _scrape_state['next_slot'])
+        _scrape_state['next_slot'] = slot + interval * random.uniform(0.75, 1.25)
+    if slot > now:
+        time.sleep(slot - now)
+
+def get_scrape_session():
+    # One keep-alive session per thread; requests.Session is not safe to share.
+    sessions = _scrape_state['sessions']
+    if not hasattr(sessions, 'session'):
+        sessions.session = requests.Session()
+        sessions.session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    return sessions.session
+
+def record_fetch(path, seconds):
+    with _fetch_stats['lock']:
+        _fetch_stats['counts'][path] += 1
+        _fetch_stats['seconds'][path] += seconds
+
+def fetch_registration_page(url, driver=None):
+    """Return the page source for url, trying a plain HTTP GET before falling back to Chrome.
+
+    The registration page is normally rendered server side; Chrome is only needed when
+    classify_registration_page can't read the response (script-rendered or challenge pages).
+    A carrier without vehicles gets a readable page with no vehicle table, and no Chrome.
+    """
+    if USE_HTTP_FETCH:
+        start = time.monotonic()
+        try:
+            wait_for_scrape_slot()
+            response = get_scrape_session().get(url, timeout=HTTP_FETCH_TIMEOUT)
+            response.raise_for_status()
+            if classify_registration_page(response.text) is not None:
+                record_fetch('http', time.monotonic() - start)
+                return response.text
+        except requests.RequestException as e:
+            print(f"HTTP fetch failed for {url}: {e}")
+        with _fetch_stats['lock']:
+            _fetch_stats['http_fallbacks'] += 1
+
+    start = time.monotonic()
+    driver = driver or get_driver()
+    driver.get(url)
+    WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
+    time.sleep(random.uniform(0.5, 1))
+    page_content = driver.page_source
+    record_fetch('browser', time.monotonic() - start)
+    return page_content
+
+def vehicle_count_fetch_summary():
+    counts, seconds = _fetch_stats['counts'], _fetch_stats['seconds']
+    parts = []
+    for path in ('cache', 'http', 'browser'):
+        average = seconds[path] / counts[path] if counts[path] else 0.0
+        parts.append(f"{counts[path]} from {path} ({average:.2f}s avg)")
+    return f"Vehicle count pages: {', '.join(parts)}; {_fetch_stats['http_fallbacks']} HTTP fetches fell back to Chrome"
+
+def vehicle_type_cells(page, engine=None):
+    """Return (header text, count text) for every th.vehType cell on a registration page, in one pass."""
+    if (engine or HTML_ENGINE) == 'lxml' and lxml_html is not None and page.strip():
+        cells = []
+        for th in VEHICLE_TYPE_HEADERS(lxml_html.fromstring(page)):
+            td = next(th.itersiblings('td'), None)
+            if td is not None:
+                cells.append((th.text_content(), td.text_content()))
+        return cells
+    soup = BeautifulSoup(page, 'html.parser')
+    return [(th.string, td.text) for th in soup.find_all('th', class_='vehType')
+            for td in [th.find_next_sibling('td')] if td is not None and th.string]
+
+def extract_vehicle_counts(page, engine=None):
+    vehicle_counts = {vtype: 0 for vtype in VEHICLE_TYPES}
+    for header, count_text in vehicle_type_cells(page, engine):
+        # Substring match as before: 'Trailers' also counts 'Hazmat Cargo Tank Trailers' rows.
+        for vehicle_type in VEHICLE_TYPES:
+            if vehicle_type in header:
+                try:
+                    vehicle_counts[vehicle_type] += int(count_text.strip())
+                except ValueError:
+                    print(f"Error parsing count for {vehicle_type}")
+    return vehicle_counts
 
 # Get the FMCSA data for truck tractor and trailer counts (not straight trucks e.g. box trucks).
 # This data is unfortunately not available in the QC Api, but can be scraped from SAFER pages.
-def collect_vehicle_counts(usdot_number: str, driver):
-    url = f"https://ai.fmcsa.dot.gov/SMS/Carrier/{usdot_number}/CarrierRegistration.aspx"
+def collect_vehicle_counts(usdot_number: str, driver=None):
+    url = VEHICLE_COUNT_URL.format(usdot_number)
 
     # Check if the page is cached
+    start = time.monotonic()
     cached_content = get_cached_page(url)
     if cached_content:
         # print("Fetching from scraping cache.")
-        soup = BeautifulSoup(cached_content, 'html.parser')
-    else:
-        driver.get(url)
-        WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
-        time.sleep(random.uniform(0.5, 1))
-        
-        # Cache the page content
-        page_content = driver.page_source
-        cache_page(url, page_content)
-        
-        soup = BeautifulSoup(page_content, 'html.parser')
-    
-    vehicle_types = ['Straight Trucks', 'Truck Tractors', 'Trailers','Hazmat Cargo Tank Trailers', 'Hazmat Cargo Tank Trucks']
-    vehicle_counts = {vtype: 0 for vtype in vehicle_types}
-
-    for vehicle_type in vehicle_types:
-        elements = soup.find_all('th', class_='vehType', string=lambda text: vehicle_type in text if text else False)
-        for element in elements:
-            sibling = element.find_next_sibling('td')
-            if sibling:
-                try:
-                    count = int(sibling.text.strip())
-                    vehicle_counts[vehicle_type] += count
-                except ValueError:
-                    print(f"Error parsing count for {vehicle_type}")
+        record_fetch('cache', time.monotonic() - start)
+        return extract_vehicle_counts(cached_content)
 
-    return vehicle_counts
+    page_content = fetch_registration_page(url, driver)
+    
+    # Cache the page content
+    cache_page(url, page_content)
+    
+    return extract_vehicle_counts(page_content)
 
 def should_include_company(vehicle_counts, min_threshold=5):
     """
@@ -138,35 +378,93 @@ def should_include_company(vehicle_counts, min_threshold=5):
     return vehicle_counts['Truck Tractors'] > min_threshold or vehicle_counts['Trailers'] > min_threshold
 
 
-def check_veh_maint(row,headers):
-    authorized_for_hire_index = headers.index('AUTHORIZED_FOR_HIRE')
-    nbr_power_unit_index = headers.index('NBR_POWER_UNIT')
-    veh_maint_insp_w_viol_index = headers.index('VEH_MAINT_INSP_W_VIOL')
-    veh_oos_insp_total_index = headers.index('VEHICLE_OOS_INSP_TOTAL')
-    federal_government_index = headers.index('FEDERAL_GOVERNMENT')
-    state_government_index = headers.index('STATE_GOVERNMENT')
-    local_government_index = headers.index('LOCAL_GOVERNMENT')
-
-    try:
-        nbr_power_unit = int(row[nbr_power_unit_index])
-        veh_maint_insp_w_viol = int(row[veh_maint_insp_w_viol_index])
-        veh_oos_insp_total = int(row[veh_oos_insp_total_index])
-    except ValueError:
-        return False  # Invalid numeric data
-
-    return all([
-        row[authorized_for_hire_index] != 'N',
-        row[federal_government_index] != 'Y',
-        row[state_government_index] != 'Y',
-        row[local_government_index] != 'Y',
-        10 <= nbr_power_unit <= 50,
-        (veh_oos_insp_total >= 5 or veh_maint_insp_w_viol >= 5) # Focus on oos truck counts, AND/OR maintenance violations
-    ])
-
-def detect_encoding(file_path):
-    with open(file_path, 'rb') as file:
-        raw_data = file.read(10000)  # Read first 10000 bytes
-    return chardet.detect(raw_data)['encoding']
+def filter_columns(clauses):
+    """Return (columns, numeric_columns) referenced by a SEGMENT_FILTER style clause list."""
+    columns, numeric_columns = [], []
+    for clause in clauses:
+        if clause[0] == 'any':
+            nested_columns, nested_numeric = filter_columns(clause[1])
+            columns.extend(nested_columns)
+            numeric_columns.extend(nested_numeric)
+            continue
+        column, op, values = clause[0], clause[1], clause[2:]
+        if op != 'between' and op not in FILTER_OPERATORS:
+            raise ValueError(f"Unknown filter operator {op!r} for column {column}")
+        columns.append(column)
+        if all(isinstance(value, (int, float)) for value in values):
+            numeric_columns.append(column)
+    return list(dict.fromkeys(columns)), list(dict.fromkeys(numeric_columns))
+
+def split_filter(clauses, columns):
+    """Split clauses into those that only use the given columns and the rest."""
+    available, remaining = [], []
+    for clause in clauses:
+        (available if set(filter_columns([clause])[0]) <= set(columns) else remaining).append(clause)
+    return available, remaining
+
+def compile_row_filter(clauses, headers):
+    """Compile clauses against headers once into a predicate over list rows, using column indices."""
+    _, numeric_columns = filter_columns(clauses)
+    numeric_indices = [headers.index(column) for column in numeric_columns]
+
+    def compile_clause(clause):
+        if clause[0] == 'any':
+            tests = [compile_clause(nested) for nested in clause[1]]
+            return lambda row, numbers: any(test(row, numbers) for test in tests)
+        column, op, values = clause[0], clause[1], clause[2:]
+        index = headers.index(column)
+        numeric = column in numeric_columns
+        if op == 'between':
+            low, high = values
+            if numeric:
+                return lambda row, numbers: low <= numbers[index] <= high
+            return lambda row, numbers: low <= row[index] <= high
+        compare, value = FILTER_OPERATORS[op], values[0]
+        if numeric:
+            return lambda row, numbers: compare(numbers[index], value)
+        return lambda row, numbers: compare(row[index], value)
+
+    tests = [compile_clause(clause) for clause in clauses]
+
+    def row_filter(row):
+        try:
+            numbers = {index: int(row[index]) for index in numeric_indices}
+        except ValueError:
+            return False  # Invalid numeric data
+        return all(test(row, numbers) for test in tests)
+    return row_filter
+
+def filter_mask(clauses, frame):
+    """Evaluate clauses over a DataFrame of string columns and return a boolean Series."""
+    _, numeric_columns = filter_columns(clauses)
+    mask = pd.Series(True, index=frame.index)
+    numbers = {}
+    for column in numeric_columns:
+        values = frame[column].astype(str)
+        valid = values.str.fullmatch(INTEGER_PATTERN)
+        mask &= valid
+        numbers[column] = pd.to_numeric(values.where(valid, '0').str.strip())
+
+    def clause_mask(clause):
+        if clause[0] == 'any':
+            result = pd.Series(False, index=frame.index)
+            for nested in clause[1]:
+                result |= clause_mask(nested)
+            return result
+        column, op, values = clause[0], clause[1], clause[2:]
+        series = numbers[column] if column in numbers else frame[column]
+        if op == 'between':
+            return series.between(values[0], values[1])
+        return FILTER_OPERATORS[op](series, values[0])
+
+    for clause in clauses:
+        mask &= clause_mask(clause)
+    return mask
+
+def parse_blocks(path, encoding, block_task, *task_args, **options):
+    """csv_blocks.parse_blocks, with this script's PARSE_WORKERS and PARSE_BLOCK_BYTES."""
+    return csv_blocks.parse_blocks(path, encoding, block_task, *task_args, workers=PARSE_WORKERS,
+                                   block_bytes=PARSE_BLOCK_BYTES, **options)
 
 def get_google_sheets_service():
     creds = None
@@ -196,17 +494,26 @@ def create_new_sheet(service, spreadsheet_id, sheet_name, num_rows, num_columns)
             }
         }]
     }
-    try:
-        response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-        return response['replies'][0]['addSheet']['properties']['sheetId']
-    except HttpError as error:
-        if 'already exists' in str(error):
-            # If sheet already exists, get its ID
-            sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-            for sheet in sheet_metadata.get('sheets', ''):
-                if sheet['properties']['title'] == sheet_name:
-                    return sheet['properties']['sheetId']
-        else:
+    for attempt in range(MAX_RETRIES):
+        try:
+            wait_for_quota()
+            response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+            return response['replies'][0]['addSheet']['properties']['sheetId']
+        except HttpError as error:
+            if error.resp.status == 429 and attempt < MAX_RETRIES - 1:
+                note_rate_limited(error)
+                continue
+            if error.resp.status >= 500 and attempt < MAX_RETRIES - 1:
+                time.sleep(2 ** attempt)
+                continue
+            if 'already exists' in str(error):
+                # If sheet already exists, get its ID
+                wait_for_quota()
+                sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+                for sheet in sheet_metadata.get('sheets', ''):
+                    if sheet['properties']['title'] == sheet_name:
+                        return sheet['properties']['sheetId']
+                return None
             raise
 
 def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
@@ -224,6 +531,7 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
         }
         for attempt in range(MAX_RETRIES):
             try:
+                wait_for_quota()
                 service.spreadsheets().values().update(
                     spreadsheetId=spreadsheet_id, range=range_name,
                     valueInputOption='USER_ENTERED', body=body).execute()
@@ -231,12 +539,14 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
             except HttpError as error:
                 if attempt == MAX_RETRIES - 1:
                     raise
-                time.sleep(2 ** attempt)  # Exponential backoff
+                if error.resp.status == 429:
+                    note_rate_limited(error)  # The shared limiter waits out Retry-After
+                else:
+                    time.sleep(2 ** attempt)  # Exponential backoff
             except TimeoutError:
                 if attempt == MAX_RETRIES - 1:
                     raise
                 time.sleep(5)  # Wait 5 seconds before retrying on timeout
-        time.sleep(1)  # Short delay between batches
 
 def format_sheet(service, spreadsheet_id, sheet_id, num_columns):
     requests = [
@@ -271,6 +581,7 @@ def format_sheet(service, spreadsheet_id, sheet_id, num_columns):
     }
     for attempt in range(MAX_RETRIES):
         try:
+            wait_for_quota()
             service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
             # Rerunning the resize doesn't seem to help it resize properly. It resizes columns to a fixed width.
             auto_resize_requests = [{
@@ -286,12 +597,16 @@ def format_sheet(service, spreadsheet_id, sheet_id, num_columns):
             auto_resize_body = {
                 'requests': auto_resize_requests
             }
+            wait_for_quota()
             service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=auto_resize_body).execute()
             break
         except HttpError as error:
             if attempt == MAX_RETRIES - 1:
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+            if error.resp.status == 429:
+                note_rate_limited(error)  # The shared limiter waits out Retry-After
+            else:
+                time.sleep(2 ** attempt)  # Exponential backoff
         except TimeoutError:
             if attempt == MAX_RETRIES - 1:
                 raise
@@ -400,35 +715,201 @@ def format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descript
     }
     for attempt in range(MAX_RETRIES):
         try:
+            wait_for_quota()
             service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
             break
         except HttpError as error:
             if attempt == MAX_RETRIES - 1:
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+            if error.resp.status == 429:
+                note_rate_limited(error)  # The shared limiter waits out Retry-After
+            else:
+                time.sleep(2 ** attempt)  # Exponential backoff
         except TimeoutError:
             if attempt == MAX_RETRIES - 1:
                 raise
             time.sleep(5)  # Wait 5 seconds before retrying on timeout
 
+def encode_safety_block(text, dot_number_index, value_indices):
+    """Dictionary-encode one block of an SMS file into (dot_numbers, codes per column, values per column)."""
+    dot_numbers = array('q')
+    codes = [array('I') for _ in value_indices]
+    dictionaries = [{} for _ in value_indices]
+    for row in csv.reader(io.StringIO(text, newline=None)):
+        try:
+            dot_numbers.append(int(row[dot_number_index]))
+        except (ValueError, IndexError):
+            continue
+        for column_codes, dictionary, i in zip(codes, dictionaries, value_indices):
+            value = row[i] if i < len(row) else ''
+            column_codes.append(dictionary.setdefault(value, len(dictionary)))
+    return dot_numbers, codes, [list(dictionary) for dictionary in dictionaries]
+
 def read_safety_data(filename):
-    safety_data = {}
+    """Read an SMS safety file into a compact column store.
+
+    Carriers are kept as a sorted array of integer DOT numbers and every other column is
+    dictionary-encoded (the distinct values plus one small integer code per carrier), so
+    memory grows with distinct values rather than with one Python dict per carrier. Blocks
+    of the file are encoded in parallel and their dictionaries merged in file order.
+    """
     encoding = detect_encoding(filename)
-    with open(filename, 'r', encoding=encoding, errors='replace') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            dot_number = row['DOT_NUMBER']
-            del row['DOT_NUMBER']  # Remove DOT_NUMBER from the data we're storing
-            safety_data[dot_number] = row
-    return safety_data
+    headers = read_csv_header(filename, encoding)
+    dot_number_index = headers.index('DOT_NUMBER')
+    value_indices = [i for i in range(len(headers)) if i != dot_number_index]
+    dot_numbers = array('q')
+    codes = [array('I') for _ in value_indices]
+    dictionaries = [{} for _ in value_indices]
+    for _, (block_dot_numbers, block_codes, block_values) in parse_blocks(filename, encoding, encode_safety_block,
+                                                                          dot_number_index, value_indices):
+        dot_numbers.extend(block_dot_numbers)
+        for column_codes, dictionary, local_codes, local_values in zip(codes, dictionaries, block_codes, block_values):
+            remap = [dictionary.setdefault(value, len(dictionary)) for value in local_values]
+            column_codes.extend(array('I', map(remap.__getitem__, local_codes)))
+
+    order = sorted(range(len(dot_numbers)), key=dot_numbers.__getitem__)
+    return {
+        'headers': [headers[i] for i in value_indices],
+        'dot_numbers': array('q', (dot_numbers[i] for i in order)),
+        'codes': [array('I', (column_codes[i] for i in order)) for column_codes in codes],
+        'values': [list(dictionary) for dictionary in dictionaries]
+    }
 
 def merge_safety_data(safety_data_ab, safety_data_c):
-    merged_data = {}
-    for dot_number in set(safety_data_ab.keys()) | set(safety_data_c.keys()):
-        merged_data[dot_number] = {**safety_data_ab.get(dot_number, {}), **safety_data_c.get(dot_number, {})}
-    return merged_data
+    # The AB and C stores stay separate; lookups combine them per carrier. As with a dict
+    # merge, a column present in both files takes the C value when the carrier is in C.
+    headers = list(safety_data_ab['headers'])
+    headers.extend(header for header in safety_data_c['headers'] if header not in headers)
+    positions = {header: i for i, header in enumerate(headers)}
+    return {
+        'headers': headers,
+        'parts': [(store, [positions[header] for header in store['headers']])
+                  for store in (safety_data_ab, safety_data_c)]
+    }
 
-def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet_id):
+def lookup_safety_row(safety_data, dot_number):
+    row = [''] * len(safety_data['headers'])
+    try:
+        key = int(dot_number)
+    except ValueError:
+        return row
+    for store, positions in safety_data['parts']:
+        dot_numbers = store['dot_numbers']
+        # The sort keeps file order, so this is the carrier's last row: the one a dict of rows kept.
+        i = bisect.bisect_right(dot_numbers, key) - 1
+        if i >= 0 and dot_numbers[i] == key:
+            for position, column_codes, values in zip(positions, store['codes'], store['values']):
+                row[position] = values[column_codes[i]]
+    return row
+
+def wait_for_quota():
+    """Block until one more Sheets API call fits the quotas; see sheets_quota.wait_for_quota."""
+    sheets_quota.wait_for_quota(_rate_limiter, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST,
+                                RATE_LIMIT_RECOVERY_SECONDS)
+
+def note_rate_limited(error):
+    sheets_quota.note_rate_limited(_rate_limiter, error, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT),
+                                   RATE_LIMIT_FLOOR, RATE_LIMIT_DEFAULT_PAUSE)
+
+def get_worker_service(service_factory):
+    # googleapiclient service objects are not thread-safe, so each upload worker builds its own.
+    if getattr(_worker_state, 'service', None) is None:
+        _worker_state.service = service_factory()
+    return _worker_state.service
+
+def upload_tab(service_factory, spreadsheet_id, sheet_name, sheet_id, values, *format_args):
+    service = get_worker_service(service_factory)
+    write_to_sheet_batch(service, spreadsheet_id, sheet_name, values)
+    format_sheet(service, spreadsheet_id, sheet_id, *format_args)
+    print(f"Created and populated sheet: {sheet_name}")
+
+def submit_upload(uploader, pending_uploads, *upload_args):
+    # Bound the number of filled tabs held in memory while the workers catch up.
+    while len(pending_uploads) >= UPLOAD_WORKERS * 2:
+        pending_uploads.pop(0).result()
+    pending_uploads.append(uploader.submit(upload_tab, *upload_args))
+
+def finish_uploads(pending_uploads):
+    for upload in pending_uploads:
+        upload.result()
+
+def plan_candidates(census_file, encoding, headers, include_indices, filtered_headers, cities,
+                    excluded_dot_numbers, safety_data):
+    """Phase one: find every census row that passes the cheap filters, without scraping anything.
+
+    The city and email filters and the SEGMENT_FILTER clauses on census columns run vectorized
+    over pandas chunks of the census; only rows that survive them are projected, joined to the
+    safety data and checked against the clauses that need safety columns.
+    Returns (candidates, counts), where candidates are (dot_number, line_num, filtered_row,
+    in_previous_campaign) tuples in census order and counts has total_rows, skipped and errors.
+    """
+    candidates = []
+    counts = {'total_rows': 0, 'skipped': 0, 'errors': 0}
+    dot_number_index = headers.index('DOT_NUMBER')
+    nbr_power_unit_index = filtered_headers.index('NBR_POWER_UNIT')
+    veh_maint_insp_w_viol_index = filtered_headers.index('VEH_MAINT_INSP_W_VIOL')
+    veh_oos_insp_total_index = filtered_headers.index('VEHICLE_OOS_INSP_TOTAL')
+    census_filter, joined_filter = split_filter(SEGMENT_FILTER, headers)
+    row_filter = compile_row_filter(joined_filter, filtered_headers)
+
+    chunks = pd.read_csv(census_file, dtype=str, keep_default_na=False, encoding=encoding, encoding_errors='replace',
+                         on_bad_lines='warn', chunksize=CENSUS_CHUNK_ROWS)
+    for chunk in chunks:
+        city = chunk['PHY_CITY'].str.strip().str.lower()
+        state = chunk['PHY_STATE'].str.strip().str.lower()
+        # Must be in chosen cities and must have an email
+        keep = city.map(cities).eq(state) & chunk['EMAIL_ADDRESS'].str.strip().ne('')
+        keep &= filter_mask(census_filter, chunk)
+        counts['total_rows'] += len(chunk)
+        counts['skipped'] += int((~keep).sum())
+
+        survivors = chunk[keep]
+        for line_num, row in zip(survivors.index + 2, survivors.itertuples(index=False, name=None)):
+            try:
+                dot_number = row[dot_number_index]
+
+                # Mark if the DOT number is in the excluded list
+                in_previous_campaign = 'Y' if dot_number in excluded_dot_numbers else 'N'
+
+                filtered_row = [row[i] for i in include_indices]
+
+                # Add safety data
+                filtered_row.extend(lookup_safety_row(safety_data, dot_number))
+
+                filtered_row[nbr_power_unit_index] = str(filtered_row[nbr_power_unit_index]).strip()
+                filtered_row[veh_maint_insp_w_viol_index] = str(filtered_row[veh_maint_insp_w_viol_index]).strip()
+                filtered_row[veh_oos_insp_total_index] = str(filtered_row[veh_oos_insp_total_index]).strip()
+
+                if not row_filter(filtered_row):
+                    counts['skipped'] += 1
+                    continue
+
+            except Exception as e:
+                counts['errors'] += 1
+                print(f"Error processing line {line_num}: {str(e)}")
+                continue
+
+            candidates.append((dot_number, line_num, filtered_row, in_previous_campaign))
+        print(f"Planned {counts['total_rows']} rows, {len(candidates)} candidates so far")
+    return candidates, counts
+
+def estimate_scrape_plan(candidates):
+    """Count the candidates whose registration page is already cached and estimate the time to fetch the rest."""
+    cached = cached_urls([VEHICLE_COUNT_URL.format(candidate[0]) for candidate in candidates])
+    to_fetch = len(candidates) - len(cached)
+    # Plain HTTP fetches share one politeness budget; browser fallbacks run on every worker at once.
+    http_seconds = to_fetch * 60.0 / SCRAPE_REQUESTS_PER_MINUTE
+    browser_seconds = to_fetch * BROWSER_PAGE_SECONDS / SCRAPE_WORKERS
+    return {
+        'candidates': len(candidates),
+        'cached': len(cached),
+        'to_fetch': to_fetch,
+        'seconds': http_seconds if USE_HTTP_FETCH else browser_seconds,
+        'browser_seconds': max(http_seconds, browser_seconds)
+    }
+
+def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet_id,
+                service_factory=get_google_sheets_service):
     exclude_columns = read_exclude_columns(EXCLUDE_FILE)
     cities = read_cities(CITIES_FILE)
     column_descriptions_census = read_column_descriptions(README_FILE)
@@ -455,6 +936,7 @@ def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet
     skipped_count = 0
     processed_count = 0
     included_count = 0
+    total_rows = 0
 
     encoding = detect_encoding(census_file)
     print(f"Detected encoding for census file: {encoding}")
@@ -462,80 +944,49 @@ def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet
     # Read excluded DOT numbers from previous reach-out efforts
     excluded_dot_numbers = read_excluded_dot_numbers(EXCLUDED_DOT_NUMBERS_FILE)
     print(f"Loaded {len(excluded_dot_numbers)} excluded DOT numbers.")
+    import_legacy_scrape_cache()
 
     with open(census_file, 'r', encoding=encoding, errors='replace') as csvfile:
-        reader = csv.reader(csvfile)
-        headers = next(reader)
-
-        include_indices = [i for i, header in enumerate(headers) if header not in exclude_columns]
-        filtered_headers = [headers[i] for i in include_indices]
-
-        # Add safety data headers
-        if safety_data:
-            safety_headers = list(next(iter(safety_data.values())).keys())
-            filtered_headers.extend(safety_headers)
-
-        # Add vehicle count headers
-        filtered_headers.extend(['Straight Trucks', 'Truck Tractors', 'Trailers','Hazmat Cargo Tank Trailers', 'Hazmat Cargo Tank Trucks','In 8/5/2024 campaign'])
-        
-        num_columns = len(filtered_headers)
-        current_sheet_data.append(filtered_headers)
-        num_columns = len(filtered_headers)
-
-        dot_number_index = headers.index('DOT_NUMBER')
-        phy_city_index = headers.index('PHY_CITY')
-        phy_state_index = headers.index('PHY_STATE')
-        email_index = headers.index('EMAIL_ADDRESS')
-        nbr_power_unit_index = filtered_headers.index('NBR_POWER_UNIT')
-        veh_maint_insp_w_viol_index = filtered_headers.index('VEH_MAINT_INSP_W_VIOL')
-        veh_oos_insp_total_index = filtered_headers.index('VEHICLE_OOS_INSP_TOTAL')
-
-        total_rows = sum(1 for _ in reader)
-        csvfile.seek(0)
-        next(reader)  # Skip header again
-
-        for line_num, row in enumerate(reader, start=2):
+        headers = next(csv.reader(csvfile))
+
+    include_indices = [i for i, header in enumerate(headers) if header not in exclude_columns]
+    filtered_headers = [headers[i] for i in include_indices]
+
+    # Add safety data headers
+    safety_headers = safety_data['headers']
+    filtered_headers.extend(safety_headers)
+
+    # Add vehicle count headers
+    filtered_headers.extend(['Straight Trucks', 'Truck Tractors', 'Trailers','Hazmat Cargo Tank Trailers', 'Hazmat Cargo Tank Trucks','In 8/5/2024 campaign'])
+
+    current_sheet_data.append(filtered_headers)
+    num_columns = len(filtered_headers)
+
+    # Phase 1: every cheap filter, so the expensive scrape work is known before any of it starts.
+    print("Planning candidates...")
+    candidates, counts = plan_candidates(census_file, encoding, headers, include_indices, filtered_headers, cities,
+                                         excluded_dot_numbers, safety_data)
+    total_rows = counts['total_rows']
+    skipped_count = counts['skipped']
+    error_count = counts['errors']
+    plan = estimate_scrape_plan(candidates)
+    print(f"Scrape plan: {plan['candidates']} candidates out of {total_rows} rows, {plan['cached']} cached, "
+          f"{plan['to_fetch']} to fetch, about {plan['seconds'] / 60:.1f} minutes "
+          f"(up to {plan['browser_seconds'] / 60:.1f} if every page needs Chrome)")
+    if PLAN_ONLY:
+        return
+    if MAX_SCRAPES is not None and plan['to_fetch'] > MAX_SCRAPES:
+        print(f"Not scraping: {plan['to_fetch']} pages to fetch is more than MAX_SCRAPES ({MAX_SCRAPES}).")
+        return
+
+    uploader = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+    pending_uploads = []
+    try:
+        # Phase 2 and 3: scrapes run ahead on the worker pool over the candidates only; results come back
+        # in census order and are assembled into tabs.
+        for (dot_number, line_num, filtered_row, in_previous_campaign), scrape in scrape_in_order(candidates):
             try:
-                if line_num % 1000 == 0:
-                    print(f"Processed {line_num} out of {total_rows} rows ({(line_num/total_rows)*100:.2f}%)")
-
-                dot_number = row[dot_number_index]
-
-                # Mark if the DOT number is in the excluded list
-                in_previous_campaign = 'N'
-                if dot_number in excluded_dot_numbers:
-                    in_previous_campaign = 'Y'
-
-                city = row[phy_city_index].strip().lower()
-                state = row[phy_state_index].strip().lower()
-
-                # Must be in chosen cities
-                if city not in cities or cities[city] != state:
-                    skipped_count += 1
-                    continue
-
-                # Must have an email
-                if not row[email_index].strip():
-                    skipped_count += 1
-                    continue
-                
-                filtered_row = [row[i] for i in include_indices]
-
-                # Add safety data
-                if dot_number in safety_data:
-                    filtered_row.extend(safety_data[dot_number].values())
-                else:
-                    filtered_row.extend([''] * len(safety_headers))
-
-                filtered_row[nbr_power_unit_index] = str(filtered_row[nbr_power_unit_index]).strip()
-                filtered_row[veh_maint_insp_w_viol_index] = str(filtered_row[veh_maint_insp_w_viol_index]).strip()
-                filtered_row[veh_oos_insp_total_index] = str(filtered_row[veh_oos_insp_total_index]).strip()
-
-                if not check_veh_maint(filtered_row, filtered_headers):
-                    skipped_count += 1
-                    continue
-
-                vehicle_counts = collect_vehicle_counts(dot_number, driver)
+                vehicle_counts = scrape.result()
                 if not should_include_company(vehicle_counts):
                     # print(f"Company {dot_number} does not have the right fleet composition:\n{pretty_print_dict(vehicle_counts)}")
                     skipped_count += 1
@@ -562,13 +1013,12 @@ def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet
                     sheet_name = f'Merged_Data_{sheet_counter}'
                     print(f"Creating non-final sheet: {sheet_name}")
                     sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, ROWS_PER_SHEET + 1, num_columns)
-                    write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data)
-                    format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, filtered_headers)
-                    print(f"Created and populated non-final sheet: {sheet_name}")
+                    submit_upload(uploader, pending_uploads, service_factory, spreadsheet_id, sheet_name, sheet_id,
+                                  current_sheet_data, num_columns, column_descriptions, filtered_headers)
+                    print(f"Queued non-final sheet for upload: {sheet_name}")
                     sheet_counter += 1
                     row_counter = 0
                     current_sheet_data = [filtered_headers]
-                    time.sleep(2)  # Add a delay between sheets
 
             except Exception as e:
                 error_count += 1
@@ -577,14 +1027,17 @@ def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet
                     print(f"Encountered {error_count} errors. Last error: {str(e)}")
                 continue
 
-    # Write any remaining data
-    if row_counter > 0:
-        sheet_name = f'Merged_Data_{sheet_counter}'
-        print(f"Creating final sheet: {sheet_name}")
-        sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, row_counter + 1, num_columns)
-        write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data)
-        format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, filtered_headers)
-        print(f"Created and populated final sheet: {sheet_name}")
+        # Write any remaining data
+        if row_counter > 0:
+            sheet_name = f'Merged_Data_{sheet_counter}'
+            print(f"Creating final sheet: {sheet_name}")
+            sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, row_counter + 1, num_columns)
+            submit_upload(uploader, pending_uploads, service_factory, spreadsheet_id, sheet_name, sheet_id,
+                          current_sheet_data, num_columns, column_descriptions, filtered_headers)
+        finish_uploads(pending_uploads)
+    finally:
+        # Also reached on an error: uploads that haven't started are dropped and the workers wind down.
+        uploader.shutdown(cancel_futures=True)
 
     print(f"Processing complete. {sheet_counter} sheet(s) created in the Google Spreadsheet.")
     print(f"Total rows in input file: {total_rows}")
@@ -592,6 +1045,8 @@ def process_csv(census_file, safety_file_ab, safety_file_c, service, spreadsheet
     print(f"Total rows included: {included_count}")
     print(f"Total rows skipped: {skipped_count}")
     print(f"Total errors encountered: {error_count}")
+    print(scrape_cache_summary())
+    print(vehicle_count_fetch_summary())
 
 if __name__ == "__main__":
     service = get_google_sheets_service()
@@ -600,4 +1055,4 @@ if __name__ == "__main__":
     except Exception as e:
         print(f"Error running process_csv: {e}")
     finally:
-        driver.quit()
+        quit_drivers()
@@ -0,0 +1,2 @@
+# Code shared by the *_to_sheet.py scripts. Each script puts the repository root on sys.path
+# before importing from here, so they still run as `python3 script.py` from their own directory.
@@ -0,0 +1,339 @@
+import csv
+import io
+import os
+import hashlib
+import mmap
+import re
+import struct
+import bisect
+from array import array
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.csv as pa_csv
+
+from fmcsa_common.csv_blocks import detect_encoding, read_csv_header, parse_blocks
+
+CENSUS_INDEX_MAGIC = b'DOTIDX2\n'  # Bumped whenever the index layout or its rules change; older indexes are rebuilt
+
+# Every file here is kept in a cache directory next to the census file and named after the
+# release and its fingerprint, so scripts sharing a census file also share its caches.
+
+def census_fingerprint(census_file, sample_bytes=1 << 20):
+    # File size plus a hash of the head and tail tells monthly releases apart
+    # without reading the whole multi-GB file.
+    size = os.path.getsize(census_file)
+    digest = hashlib.sha1(str(size).encode())
+    with open(census_file, 'rb') as file:
+        digest.update(file.read(sample_bytes))
+        if size > sample_bytes:
+            file.seek(max(size - sample_bytes, sample_bytes))
+            digest.update(file.read(sample_bytes))
+    return digest.hexdigest()[:16]
+
+def census_cache_path(census_file, cache_dir, suffix='.parquet'):
+    release = os.path.splitext(os.path.basename(census_file))[0]
+    return os.path.join(os.path.dirname(census_file), cache_dir, f"{release}_{census_fingerprint(census_file)}{suffix}")
+
+def prune_census_cache(census_file, cache_dir):
+    """Delete cache files of this release with another fingerprint, left by an earlier download of the same month."""
+    cache_dir = os.path.join(os.path.dirname(census_file), cache_dir)
+    release = os.path.splitext(os.path.basename(census_file))[0]
+    stale = re.compile(rf"{re.escape(release)}_(?!{census_fingerprint(census_file)})[0-9a-f]{{16}}"
+                       r"(?:\.parquet|\.dotidx|_by_dot\.parquet)(?:\.tmp)?$")
+    for name in os.listdir(cache_dir):
+        if stale.match(name):
+            os.remove(os.path.join(cache_dir, name))
+            print(f"Removed stale census cache file {name}")
+
+def skip_malformed_row(row):
+    print(f"Skipping malformed census row ({row.actual_columns} of {row.expected_columns} fields): {row.text[:100]}")
+    return 'skip'
+
+def census_block_table(text, headers, columns=None):
+    """Parse one block of census text into an arrow table of string columns (only columns, if given)."""
+    return pa_csv.read_csv(
+        io.BytesIO(text.encode('utf-8')),
+        read_options=pa_csv.ReadOptions(column_names=headers),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True, invalid_row_handler=skip_malformed_row),
+        convert_options=pa_csv.ConvertOptions(column_types={header: pa.string() for header in headers},
+                                              include_columns=columns, strings_can_be_null=False,
+                                              quoted_strings_can_be_null=False))
+
+def build_census_cache(census_file, cache_path, cache_dir, chunk_rows, workers, block_bytes):
+    encoding = detect_encoding(census_file)
+    print(f"Building columnar census cache {cache_path} (encoding: {encoding}). This only happens once per census release.")
+    headers = read_csv_header(census_file, encoding)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    writer = None
+    try:
+        for _, table in parse_blocks(census_file, encoding, census_block_table, headers, workers=workers, block_bytes=block_bytes):
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema, compression='zstd')
+            writer.write_table(table, row_group_size=chunk_rows)
+        if writer is not None:
+            writer.close()
+    except BaseException:
+        # A half-written cache is no use to the next run, and can run to gigabytes.
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, cache_path)
+    print(f"Census cache built: {cache_path}")
+    prune_census_cache(census_file, cache_dir)
+
+def ensure_census_cache(census_file, cache_dir, chunk_rows, workers, block_bytes):
+    """Return the path of the census file's columnar (Parquet) cache, building it on first use.
+
+    chunk_rows is the Parquet row group size; workers and block_bytes go to parse_blocks.
+    """
+    cache_path = census_cache_path(census_file, cache_dir)
+    if not os.path.exists(cache_path):
+        build_census_cache(census_file, cache_path, cache_dir, chunk_rows, workers, block_bytes)
+    return cache_path
+
+def load_census_columns(census_file, columns, cache_dir, chunk_rows, workers, block_bytes):
+    """Load only the requested census columns (all of them for None) from the columnar cache."""
+    return pq.read_table(ensure_census_cache(census_file, cache_dir, chunk_rows, workers, block_bytes), columns=columns)
+
+def census_index_path(census_file, cache_dir):
+    return census_cache_path(census_file, cache_dir, '.dotidx')
+
+def build_census_index(census_file, index_path, cache_dir):
+    encoding = detect_encoding(census_file)
+    print(f"Building DOT_NUMBER index {index_path}. This only happens once per census release.")
+    dot_numbers = array('q')
+    offsets = array('q')
+    with open(census_file, 'rb') as file:
+        header_line = file.readline()
+        headers = next(csv.reader([header_line.decode(encoding, errors='replace')]))
+        dot_number_index = headers.index('DOT_NUMBER')
+        # csv.reader decides where each record ends, as quoted fields can span lines; lines()
+        # keeps count of the bytes it has handed over, which is where the next record starts.
+        read = {'offset': len(header_line)}
+
+        def lines():
+            for line in file:
+                read['offset'] += len(line)
+                yield line.decode(encoding, errors='replace')
+
+        reader = csv.reader(lines())
+        offset = read['offset']
+        while True:
+            try:
+                fields = next(reader)
+            except StopIteration:
+                break
+            except csv.Error:
+                offset = read['offset']
+                continue
+            try:
+                dot_numbers.append(int(fields[dot_number_index]))
+                offsets.append(offset)
+            except (ValueError, IndexError):
+                pass
+            offset = read['offset']
+
+    order = sorted(range(len(dot_numbers)), key=dot_numbers.__getitem__)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as index_file:
+        index_file.write(CENSUS_INDEX_MAGIC)
+        index_file.write(struct.pack('<q', len(order)))
+        array('q', (dot_numbers[i] for i in order)).tofile(index_file)
+        array('q', (offsets[i] for i in order)).tofile(index_file)
+    os.replace(tmp_path, index_path)
+    print(f"Indexed {len(order)} census rows: {index_path}")
+    prune_census_cache(census_file, cache_dir)
+
+def ensure_census_index(census_file, cache_dir):
+    """Return the path of the census file's DOT_NUMBER index, building it on first use."""
+    index_path = census_index_path(census_file, cache_dir)
+    if os.path.exists(index_path):
+        with open(index_path, 'rb') as index_file:
+            if index_file.read(len(CENSUS_INDEX_MAGIC)) == CENSUS_INDEX_MAGIC:
+                return index_path
+        print(f"{index_path} was built by an older version. Rebuilding it.")
+    build_census_index(census_file, index_path, cache_dir)
+    return index_path
+
+def iter_mmap_lines(mapped_file, encoding):
+    while True:
+        line = mapped_file.readline()
+        if not line:
+            return
+        yield line.decode(encoding, errors='replace')
+
+def lookup_census_rows(census_file, dot_numbers, columns, cache_dir):
+    """Return {dot_number: {column: value}} for just the requested carriers.
+
+    Uses the sidecar DOT_NUMBER index to seek straight to each row in the memory-mapped
+    census file, so a few thousand lookups cost milliseconds instead of a full scan.
+    dot_numbers must be spelled as in the census: "0123" doesn't find carrier 123.
+    """
+    index_path = ensure_census_index(census_file, cache_dir)
+    encoding = detect_encoding(census_file)
+    results = {}
+    with open(index_path, 'rb') as index_file, open(census_file, 'rb') as census:
+        index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        census_map = mmap.mmap(census.fileno(), 0, access=mmap.ACCESS_READ)
+        count = struct.unpack_from('<q', index_map, len(CENSUS_INDEX_MAGIC))[0]
+        start = len(CENSUS_INDEX_MAGIC) + 8
+        entries = memoryview(index_map)[start:start + 16 * count].cast('q')
+        indexed_dots = entries[:count]
+        indexed_offsets = entries[count:]
+        try:
+            headers = next(csv.reader([census_map.readline().decode(encoding, errors='replace')]))
+            column_indices = [headers.index(column) for column in columns]
+            dot_number_index = headers.index('DOT_NUMBER')
+            for dot_number in dot_numbers:
+                try:
+                    key = int(dot_number)
+                except ValueError:
+                    continue
+                # Rows sharing a DOT number are indexed in file order. Like the read_census_data
+                # dict, match the DOT_NUMBER string exactly ("0123" is not 123) and let the last
+                # matching row win.
+                position = bisect.bisect_right(indexed_dots, key)
+                while position and indexed_dots[position - 1] == key:
+                    position -= 1
+                    census_map.seek(indexed_offsets[position])
+                    row = next(csv.reader(iter_mmap_lines(census_map, encoding)))
+                    if row[dot_number_index] == dot_number:
+                        results[dot_number] = {column: row[i] for column, i in zip(columns, column_indices)}
+                        break
+        finally:
+            # The views must be released before the maps can be closed.
+            indexed_dots.release()
+            indexed_offsets.release()
+            entries.release()
+            index_map.close()
+            census_map.close()
+    return results
+
+def read_census_data(census_file, dot_numbers, max_lookups, cache_dir, chunk_rows, workers, block_bytes):
+    """Return {dot_number: {LEGAL_NAME, TELEPHONE, EMAIL_ADDRESS}}, the last census row winning for a repeated DOT number.
+
+    Up to max_lookups dot_numbers are looked up through the index; more than that, or None for
+    every carrier, are read from the columnar cache.
+    """
+    if dot_numbers is not None and len(dot_numbers) <= max_lookups:
+        census_data = lookup_census_rows(census_file, dot_numbers, ['LEGAL_NAME', 'TELEPHONE', 'EMAIL_ADDRESS'], cache_dir)
+        print(f"Looked up {len(census_data)} of {len(dot_numbers)} carriers via the census DOT_NUMBER index")
+        return census_data
+
+    columns = ['DOT_NUMBER', 'LEGAL_NAME', 'TELEPHONE', 'EMAIL_ADDRESS']
+    census = load_census_columns(census_file, columns, cache_dir, chunk_rows, workers, block_bytes)
+    print(f"Loaded {census.num_rows} census rows from columnar cache")
+
+    census_data = {}
+    for dot_number, legal_name, telephone, email_address in zip(*(census.column(c).to_pylist() for c in columns)):
+        census_data[dot_number] = {
+            'LEGAL_NAME': legal_name,
+            'TELEPHONE': telephone,
+            'EMAIL_ADDRESS': email_address
+        }
+    return census_data
+
+def census_sorted_path(census_file, cache_dir):
+    return census_cache_path(census_file, cache_dir, '_by_dot.parquet')
+
+def ensure_sorted_census(census_file, columns, cache_dir, chunk_rows, workers, block_bytes):
+    """Build, once per release, the given census columns sorted by DOT_NUMBER as a string; return the file's path."""
+    sorted_path = census_sorted_path(census_file, cache_dir)
+    if not os.path.exists(sorted_path):
+        print(f"Building DOT_NUMBER-sorted census {sorted_path}. This only happens once per census release.")
+        # sort_by is stable, so duplicate DOT numbers keep their census order.
+        census = load_census_columns(census_file, columns, cache_dir, chunk_rows, workers, block_bytes).sort_by('DOT_NUMBER')
+        tmp_path = sorted_path + '.tmp'
+        try:
+            pq.write_table(census, tmp_path, row_group_size=chunk_rows, compression='zstd')
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, sorted_path)
+        prune_census_cache(census_file, cache_dir)
+    return sorted_path
+
+def iter_sorted_census(sorted_path, columns):
+    """Yield (dot_number, {column: value}) in DOT_NUMBER order, holding one record batch at a time.
+
+    columns starts with DOT_NUMBER, which is left out of the dicts.
+    """
+    census = pq.ParquetFile(sorted_path)
+    for batch in census.iter_batches(columns=columns):
+        for values in zip(*(column.to_pylist() for column in batch.columns)):
+            yield values[0], dict(zip(columns[1:], values[1:]))
+
+def census_merge_join(sorted_rows, key, census):
+    """Yield (row, company_info) for rows sorted by key(row), a DOT_NUMBER string, walking census alongside.
+
+    census is an iter_sorted_census iterator. Matches what a read_census_data lookup would give,
+    including the last census row winning for a duplicated DOT number, without holding the
+    census in memory.
+    """
+    current = next(census, None)
+    matched_key = None
+    matched = None
+    for row in sorted_rows:
+        dot_number = key(row)
+        if dot_number != matched_key:
+            if matched_key is not None and dot_number < matched_key:
+                raise ValueError(f"Merge join needs rows sorted by DOT_NUMBER; {dot_number!r} came after {matched_key!r}")
+            matched = None
+            while current is not None and current[0] <= dot_number:
+                if current[0] == dot_number:
+                    matched = current[1]
+                current = next(census, None)
+            matched_key = dot_number
+        yield row, matched or {'LEGAL_NAME': '', 'TELEPHONE': '', 'EMAIL_ADDRESS': ''}
+
+def is_plain_dot_number(dot_number):
+    """True for digits without leading zeros that fit in an int64, as almost every DOT_NUMBER is."""
+    return (dot_number.isascii() and dot_number.isdigit() and len(dot_number) <= 18
+            and (dot_number[0] != '0' or dot_number == '0'))
+
+class DotNumberSet:
+    """A set of DOT_NUMBER strings at about 8 bytes each, as a sorted array of their values.
+
+    Holding a million carriers as Python strings in a set takes around 100 MB; this is small
+    enough to hand to every parse worker. The rare DOT_NUMBER is_plain_dot_number turns down
+    ("0123", " 123") is kept as a string, so membership stays exact.
+    """
+
+    def __init__(self, dot_numbers):
+        values = array('q')
+        self.others = set()
+        for dot_number in dot_numbers:
+            if is_plain_dot_number(dot_number):
+                values.append(int(dot_number))
+            else:
+                self.others.add(dot_number)
+        self.values = array('q', sorted(set(values)))
+
+    def __contains__(self, dot_number):
+        if not is_plain_dot_number(dot_number):
+            return dot_number in self.others
+        value = int(dot_number)
+        position = bisect.bisect_left(self.values, value)
+        return position < len(self.values) and self.values[position] == value
+
+    def __len__(self):
+        return len(self.values) + len(self.others)
+
+def emailed_dot_numbers(census):
+    """Return a DotNumberSet of the carriers with an EMAIL_ADDRESS in an iter_sorted_census iterator.
+
+    As in census_merge_join, the last census row of a duplicated DOT number decides.
+    """
+    def last_rows():
+        previous = None
+        for dot_number, company_info in census:
+            if previous is not None and dot_number != previous[0]:
+                yield previous
+            previous = dot_number, company_info['EMAIL_ADDRESS']
+        if previous is not None:
+            yield previous
+    return DotNumberSet(dot_number for dot_number, email_address in last_rows() if email_address)
@@ -0,0 +1,162 @@
+import csv
+import os
+import mmap
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import chardet
+
+QUOTE_SCAN_BYTES = 64 * 2**10  # Bytes per regex match when following quotes exactly; longer matches slow the regex engine down
+
+# Outside quotes: unquoted text and whole quoted fields ("" escapes included), each opened at a field start.
+UNQUOTED_TEXT = re.compile(rb'[^"]*(?:(?<![^,\n])"[^"]*"(?:"[^"]*")*(?=[^"])[^"]*)*')
+QUOTED_FIELD = re.compile(rb'"[^"]*"(?:"[^"]*")*(?=[^"])')
+
+def detect_encoding(file_path):
+    with open(file_path, 'rb') as file:
+        raw_data = file.read(10000)  # Read first 10000 bytes
+    return chardet.detect(raw_data)['encoding']
+
+def read_csv_header(path, encoding):
+    with open(path, 'rb') as file:
+        return next(csv.reader([file.readline().decode(encoding, errors='replace')]))
+
+def record_blocks(path, block_bytes, start_offset=None):
+    """Split a CSV file after its header into (start, end) byte ranges that each end on a record boundary.
+
+    A newline only ends a record outside quotes, so quote parity is tracked from the header on;
+    an escaped "" counts twice and leaves it unchanged. start_offset, if given, must itself be a
+    record boundary, such as the end of an earlier block.
+    """
+    size = os.path.getsize(path)
+    blocks = []
+    with open(path, 'rb') as file:
+        start = len(file.readline())
+        if start_offset is not None:
+            start = start_offset
+            file.seek(start)
+        offset = start
+        target = start + block_bytes
+        in_quotes = False
+        while target < size:
+            chunk = file.read(1 << 20)
+            if not chunk:
+                break
+            position = 0
+            while target < size:
+                newline = chunk.find(b'\n', max(position, target - offset))
+                if newline == -1:
+                    break
+                in_quotes ^= chunk.count(b'"', position, newline) % 2 == 1
+                position = newline + 1
+                if not in_quotes:
+                    blocks.append((start, offset + position))
+                    start = offset + position
+                    target = start + block_bytes
+            in_quotes ^= chunk.count(b'"', position) % 2 == 1
+            offset += len(chunk)
+    if start < size:
+        blocks.append((start, size))
+    return blocks
+
+def skip_quoted_text(data, position, end):
+    """Scan data from position, outside quotes, and return where the scan stopped: end or later.
+
+    This follows csv.reader and pyarrow quoting rules. A quote opens a field only at the start of
+    one (after a delimiter or a newline); anywhere else it is a literal character. A field that
+    opens before end and never closes stops the scan at its opening quote, before end. A quoted
+    field that spans end stops the scan at its close, past end.
+    """
+    while position < end:
+        position = UNQUOTED_TEXT.match(data, position, min(end, position + QUOTE_SCAN_BYTES)).end()
+        if position == end or data[position:position + 1] != b'"':
+            continue
+        if position > 0 and data[position - 1:position] not in (b',', b'\n'):
+            position += 1
+            continue
+        quoted_field = QUOTED_FIELD.match(data, position)
+        if quoted_field is None:
+            return position
+        position = quoted_field.end()
+    return position
+
+def exact_record_blocks(path, block_bytes, start):
+    """Like record_blocks, from the record boundary start on, but tracking quotes with skip_quoted_text.
+
+    This is much slower than counting quotes, so parse_blocks only uses it for the rest of a file
+    once counting has led it astray.
+    """
+    blocks = []
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        while start + block_bytes < size:
+            end = size
+            position = skip_quoted_text(data, start, start + block_bytes)
+            while position >= start + block_bytes:
+                newline = data.find(b'\n', position)
+                if newline == -1:
+                    break
+                reached = skip_quoted_text(data, position, newline + 1)
+                if reached == newline + 1:
+                    end = reached
+                    break
+                if reached < newline:
+                    break  # A field opens here and never closes
+                position = reached  # The newline was inside a quoted field
+            blocks.append((start, end))
+            start = end
+    if start < size:
+        blocks.append((start, size))
+    return blocks
+
+def parse_block(path, start, end, encoding, block_task, task_args, verify):
+    """Return (True, block_task(text, *task_args)), or (False, None) if verify finds end inside a quoted field."""
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    if verify and skip_quoted_text(data, 0, len(data)) != len(data):
+        return False, None
+    return True, block_task(data.decode(encoding, errors='replace'), *task_args)
+
+def parse_blocks(path, encoding, block_task, *task_args, workers, block_bytes, start_offset=None, initializer=None, initargs=()):
+    """Yield (end_offset, block_task(text, *task_args)) for each block of a CSV file, in file order.
+
+    Blocks of about block_bytes are decoded and handed to block_task in a pool of workers
+    processes, so block_task must be a module-level function. start_offset resumes from a
+    record boundary returned as an earlier end_offset. initializer(*initargs) runs once in each
+    worker (or here, without workers), for state too large to send along with every block.
+
+    Each block is checked against csv quoting rules in its worker before it is parsed. A stray
+    quote in an unquoted value throws off record_blocks' quote counting, so from the first block
+    that fails the check, the rest of the file is split again with exact_record_blocks.
+    """
+    size = os.path.getsize(path)
+    blocks = deque((start, end, end < size) for start, end in record_blocks(path, block_bytes, start_offset))
+    if workers <= 1 or len(blocks) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        while blocks:
+            start, end, verify = blocks.popleft()
+            complete, result = parse_block(path, start, end, encoding, block_task, task_args, verify)
+            if not complete:
+                blocks = deque((*block, False) for block in exact_record_blocks(path, block_bytes, start))
+                continue
+            yield end, result
+        return
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        while blocks or pending:
+            # A couple of blocks in flight per worker, without holding the whole file's results.
+            while blocks and len(pending) < workers * 2:
+                start, end, verify = blocks.popleft()
+                pending.append((start, end, pool.submit(parse_block, path, start, end, encoding, block_task, task_args, verify)))
+            start, end, future = pending.popleft()
+            complete, result = future.result()
+            if not complete:
+                # Every later block was cut from the same miscount.
+                for _, _, stale in pending:
+                    stale.cancel()
+                pending.clear()
+                blocks = deque((*block, False) for block in exact_record_blocks(path, block_bytes, start))
+                continue
+            yield end, result
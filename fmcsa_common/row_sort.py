@@ -0,0 +1,64 @@
+import heapq
+import marshal
+import sys
+import tempfile
+
+# CPython 3.11 (64-bit) sizes, as sys.getsizeof reports them, behind row_footprint:
+BUFFER_SLOT_BYTES = 8  # The pointer to a row in the sort buffer
+STR_BYTES = 49  # An empty compact ASCII str; each character adds one byte
+
+def row_footprint(row):
+    """Rough bytes a row (list of strings) takes in memory, for keeping the sort buffer within budget.
+
+    The row list is measured as is, spare capacity included: csv.reader grows its rows by appending,
+    so they are often larger than their length calls for. Exact for ASCII fields; other text takes
+    more per character, so the budget is a guide rather than a hard cap.
+    """
+    return BUFFER_SLOT_BYTES + sys.getsizeof(row) + STR_BYTES * len(row) + sum(map(len, row))
+
+def spill_run(rows, batch_rows, spill_dir=None):
+    """Write an in-memory sorted run to an anonymous temporary file in marshalled batches."""
+    run = tempfile.TemporaryFile(dir=spill_dir)
+    for start in range(0, len(rows), batch_rows):
+        marshal.dump(rows[start:start + batch_rows], run)
+    run.seek(0)
+    return run
+
+def read_run(run):
+    try:
+        while True:
+            try:
+                batch = marshal.load(run)
+            except EOFError:
+                return
+            yield from batch
+    finally:
+        run.close()
+
+def external_sort(rows, key, memory_bytes, batch_rows, spill_dir=None):
+    """Sort rows (lists of strings) by key within memory_bytes; return (row_count, sorted iterator).
+
+    rows is consumed before this returns. Whenever the buffered rows reach the memory budget they
+    are sorted and spilled to a temporary file in spill_dir (None for the system temp dir), and
+    the runs are k-way merged as the iterator is read, holding one batch of batch_rows per run.
+    Equal keys keep their input order, as with list.sort: runs hold consecutive stretches of the
+    input and heapq.merge prefers earlier runs on ties.
+    """
+    runs = []
+    buffer = []
+    buffered_bytes = 0
+    row_count = 0
+    for row in rows:
+        buffer.append(row)
+        row_count += 1
+        buffered_bytes += row_footprint(row)
+        if buffered_bytes >= memory_bytes:
+            buffer.sort(key=key)
+            runs.append(spill_run(buffer, batch_rows, spill_dir))
+            buffer = []
+            buffered_bytes = 0
+    buffer.sort(key=key)
+    if not runs:
+        return row_count, iter(buffer)
+    print(f"Sorted {row_count} rows in {len(runs) + 1} runs, {len(runs)} spilled to disk")
+    return row_count, heapq.merge(*(read_run(run) for run in runs), buffer, key=key)
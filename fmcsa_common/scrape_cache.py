@@ -0,0 +1,134 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+# Scraped pages are kept in a packed SQLite file: pages point at zlib-compressed bodies keyed by
+# content hash, so identical pages (e.g. every "record not found" page) are stored once. Each
+# script keeps its own cache state and passes its own TTL table and size limit.
+
+def new_scrape_cache():
+    """Return the state the functions below share between threads; the db opens on first use."""
+    return {
+        'lock': threading.Lock(),
+        'db': None,
+        'size': 0,
+        'stats': {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0, 'rejected': 0, 'evicted': 0}
+    }
+
+def url_key(url):
+    return hashlib.md5(url.encode()).hexdigest()
+
+def scrape_cache_ttl(url, ttls, default_ttl):
+    """Return the TTL of the first (pattern, seconds) in ttls whose pattern is found in url."""
+    for pattern, ttl in ttls:
+        if re.search(pattern, url):
+            return ttl
+    return default_ttl
+
+def open_scrape_cache(cache, cache_file):
+    """Open (creating if needed) the page cache in cache_file. Call with cache['lock'] held."""
+    if cache['db'] is None:
+        db = sqlite3.connect(cache_file, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS pages (url_key TEXT PRIMARY KEY, url TEXT, fetched_at REAL, accessed_at REAL, content_hash TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS bodies (content_hash TEXT PRIMARY KEY, size INTEGER, body BLOB)")
+        db.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed_at)")
+        cache['db'] = db
+        cache['size'] = db.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+    return cache['db']
+
+def get_cached_page(cache, cache_file, url, ttls, default_ttl):
+    """Return the cached page for url if present and within its TTL, otherwise None."""
+    key = url_key(url)
+    with cache['lock']:
+        db = open_scrape_cache(cache, cache_file)
+        row = db.execute("SELECT p.fetched_at, b.body FROM pages p JOIN bodies b USING (content_hash) WHERE p.url_key = ?",
+                         (key,)).fetchone()
+        if row is None:
+            cache['stats']['misses'] += 1
+            return None
+        fetched_at, body = row
+        ttl = scrape_cache_ttl(url, ttls, default_ttl)
+        now = time.time()
+        if ttl is not None and now - fetched_at > ttl:
+            cache['stats']['expired'] += 1
+            return None
+        db.execute("UPDATE pages SET accessed_at = ? WHERE url_key = ?", (now, key))
+        cache['stats']['hits'] += 1
+    return zlib.decompress(body).decode('utf-8')
+
+def cached_urls(cache, cache_file, urls, ttls, default_ttl):
+    """Return the subset of urls with a page in the cache that is still within its TTL.
+
+    Unlike get_cached_page this reads no bodies and leaves hit counts and access times alone.
+    """
+    url_keys = {url_key(url): url for url in urls}
+    fresh = set()
+    now = time.time()
+    keys = list(url_keys)
+    with cache['lock']:
+        db = open_scrape_cache(cache, cache_file)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            for key, fetched_at in db.execute(f"SELECT url_key, fetched_at FROM pages WHERE url_key IN ({placeholders})", batch):
+                url = url_keys[key]
+                ttl = scrape_cache_ttl(url, ttls, default_ttl)
+                if ttl is None or now - fetched_at <= ttl:
+                    fresh.add(url)
+    return fresh
+
+def store_body(cache, db, content):
+    """Add a page body to the bodies table if it isn't there yet, and return its content hash."""
+    data = content.encode('utf-8')
+    content_hash = hashlib.sha1(data).hexdigest()
+    body = zlib.compress(data, 6)
+    if db.execute("INSERT OR IGNORE INTO bodies VALUES (?, ?, ?)", (content_hash, len(body), body)).rowcount:
+        cache['size'] += len(body)
+    return content_hash
+
+def cache_page(cache, cache_file, url, content, max_bytes, is_expected=None, fetched_at=None):
+    """Store a page, evicting least recently used pages beyond max_bytes, and return whether it was stored.
+
+    A fetch can succeed and still bring back the wrong page, such as an error, challenge or
+    script-only page, which would then be served from the cache until its TTL runs out. Pages
+    that is_expected(content) turns down are not stored.
+    """
+    if is_expected is not None and not is_expected(content):
+        with cache['lock']:
+            cache['stats']['rejected'] += 1
+        return False
+    now = time.time()
+    with cache['lock']:
+        db = open_scrape_cache(cache, cache_file)
+        db.execute("BEGIN")
+        content_hash = store_body(cache, db, content)
+        db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)", (url_key(url), url, fetched_at or now, now, content_hash))
+        if cache['size'] > max_bytes:
+            evict_scrape_cache(cache, db, max_bytes * 0.9)
+        db.execute("COMMIT")
+        cache['stats']['stores'] += 1
+    return True
+
+def evict_scrape_cache(cache, db, target_bytes):
+    # Drop least recently used pages in batches, then any bodies no page points at.
+    while cache['size'] > target_bytes:
+        keys = db.execute("SELECT url_key FROM pages ORDER BY accessed_at LIMIT 100").fetchall()
+        if not keys:
+            break
+        db.executemany("DELETE FROM pages WHERE url_key = ?", keys)
+        db.execute("DELETE FROM bodies WHERE content_hash NOT IN (SELECT content_hash FROM pages)")
+        cache['size'] = db.execute("SELECT COALESCE(SUM(size), 0) FROM bodies").fetchone()[0]
+        cache['stats']['evicted'] += len(keys)
+
+def scrape_cache_summary(cache):
+    stats = cache['stats']
+    lookups = stats['hits'] + stats['misses'] + stats['expired']
+    hit_rate = stats['hits'] / lookups * 100 if lookups else 0.0
+    return (f"Scrape cache: {stats['hits']} hits, {stats['misses']} misses, {stats['expired']} expired "
+            f"({hit_rate:.1f}% hit rate), {stats['stores']} stored, {stats['rejected']} not stored (unexpected content), "
+            f"{stats['evicted']} evicted, {cache['size'] / 2**20:.1f} MB on disk")
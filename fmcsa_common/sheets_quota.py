@@ -0,0 +1,82 @@
+import time
+import threading
+from collections import deque
+
+# Client-side pacing for Google Sheets API calls. Sheets counts requests per minute per user
+# and per project, whichever thread makes them, so one limiter is shared by every thread of a
+# script: with the default 60 requests/minute per user, all upload workers together make about
+# one call a second. More workers only overlap the latency of those calls; raise
+# SHEETS_QUOTA_PER_USER in a script if the Cloud project has been granted a higher quota.
+
+def new_rate_limiter(quota, burst):
+    """Return the state wait_for_quota and note_rate_limited share, for quota calls a minute."""
+    return {
+        'lock': threading.Lock(),
+        'rate': quota / 60.0,
+        'tokens': float(burst),
+        'updated': time.monotonic(),
+        'paused_until': 0.0,
+        'recent': deque()
+    }
+
+def reset_rate_limiter(limiter, quota, burst):
+    """Start limiter over at the full rate of a new quota, as new_rate_limiter would."""
+    with limiter['lock']:
+        limiter['rate'] = quota / 60.0
+        limiter['tokens'] = float(burst)
+        limiter['updated'] = time.monotonic()
+        limiter['paused_until'] = 0.0
+        limiter['recent'].clear()
+
+def wait_for_quota(limiter, quota, burst, recovery_seconds):
+    """Block until one more Sheets API call fits the per-minute quota and the adaptive rate.
+
+    A token bucket shared by every thread refills at the full quota rate and also caps the
+    calls made in any 60 second window. After a 429 the rate is halved and every thread
+    waits out Retry-After; the rate then climbs back over recovery_seconds.
+    """
+    max_rate = quota / 60.0
+    while True:
+        with limiter['lock']:
+            now = time.monotonic()
+            recent = limiter['recent']
+            while recent and now - recent[0] >= 60:
+                recent.popleft()
+            if now < limiter['paused_until']:
+                wait = limiter['paused_until'] - now
+            else:
+                elapsed = now - limiter['updated']
+                limiter['updated'] = now
+                limiter['rate'] = min(max_rate, limiter['rate'] + elapsed * max_rate / recovery_seconds)
+                limiter['tokens'] = min(burst, limiter['tokens'] + elapsed * limiter['rate'])
+                if len(recent) >= quota:
+                    wait = 60 - (now - recent[0])
+                elif limiter['tokens'] < 1:
+                    wait = (1 - limiter['tokens']) / limiter['rate']
+                else:
+                    limiter['tokens'] -= 1
+                    recent.append(now)
+                    return
+        time.sleep(wait)
+
+def note_rate_limited(limiter, error, quota, floor, default_pause):
+    """Slow the shared limiter after a 429 and hold every thread until Retry-After has passed.
+
+    The rate never drops below floor times the quota; default_pause seconds stand in for a
+    missing or unreadable Retry-After.
+    """
+    try:
+        retry_after = float(error.resp.get('retry-after'))
+    except (TypeError, ValueError):
+        retry_after = default_pause
+    max_rate = quota / 60.0
+    with limiter['lock']:
+        now = time.monotonic()
+        # Several threads often hit the same 429 together; only slow down once per pause.
+        if now >= limiter['paused_until']:
+            limiter['rate'] = max(max_rate * floor, limiter['rate'] / 2)
+        limiter['paused_until'] = max(limiter['paused_until'], now + retry_after)
+        limiter['updated'] = limiter['paused_until']
+        limiter['tokens'] = 0.0
+        rate = limiter['rate']
+    print(f"Sheets API quota exceeded. Pausing {retry_after:.0f}s, then resuming at {rate * 60:.0f} requests/minute.")
@@ -1,13 +1,19 @@
 import csv
 import os
 import time
-import chardet
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import sys
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fmcsa_common import csv_blocks, census_cache, row_sort, sheets_quota
+from fmcsa_common.csv_blocks import detect_encoding
+
 # Google Sheets API setup
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 CLIENT_SECRET_FILE = './client_secret.json'
@@ -19,14 +25,38 @@ CRASHES_FILE = 'raw_data/2024Jun_Crash.txt'
 README_FILE = 'raw_data/Crash_Readme.txt'
 CENSUS_FILE = '../census_and_safety/raw_data/FMCSA_CENSUS1_2024Jun.txt'
 ROWS_PER_SHEET = 25000
+CENSUS_CACHE_DIR = 'census_cache'
+CENSUS_CACHE_CHUNK_ROWS = 250000
+CENSUS_INDEX_MAX_LOOKUPS = 50000  # Beyond this a columnar scan beats random reads
+CENSUS_JOIN = 'lookup'  # 'lookup' probes a read_census_data dict; 'merge' streams the DOT-sorted census alongside sorted rows
+CENSUS_JOIN_COLUMNS = ['DOT_NUMBER', 'LEGAL_NAME', 'TELEPHONE', 'EMAIL_ADDRESS']
 MAX_COLUMN_WIDTH = 250
 BATCH_SIZE = 1000
 MAX_RETRIES = 5
+UPLOAD_WORKERS = 4  # Tabs written concurrently, each with its own Sheets service; all of them share the one Sheets quota
+SHEETS_QUOTA_PER_USER = 60  # Requests per minute per user (Sheets API default quota)
+SHEETS_QUOTA_PER_PROJECT = 300  # Requests per minute per project
+SHEETS_BURST = 10  # Calls allowed back to back before pacing starts
+RATE_LIMIT_FLOOR = 0.1  # Repeated 429s never slow us below this share of the quota
+RATE_LIMIT_RECOVERY_SECONDS = 120  # Time to climb back from the floor to the full quota
+RATE_LIMIT_DEFAULT_PAUSE = 15  # Seconds to pause when a 429 has no usable Retry-After
+PARSE_WORKERS = os.cpu_count() or 1  # Processes parsing blocks of the large text files
+PARSE_BLOCK_BYTES = 64 * 2**20  # Bytes per parse block; each one ends on a record boundary
+SORT_MEMORY_BYTES = 512 * 2**20  # Rows held in memory before a sorted run is spilled to disk
+SORT_SPILL_BATCH_ROWS = 1000  # Rows per marshalled batch; the merge holds one batch per run
+SORT_SPILL_DIR = None  # Where sorted runs are spilled; None means the system temp dir
+
+_rate_limiter = sheets_quota.new_rate_limiter(min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST)
+_worker_state = threading.local()
+
+def parse_blocks(path, encoding, block_task, *task_args, **options):
+    """csv_blocks.parse_blocks, with this script's PARSE_WORKERS and PARSE_BLOCK_BYTES."""
+    return csv_blocks.parse_blocks(path, encoding, block_task, *task_args, workers=PARSE_WORKERS,
+                                   block_bytes=PARSE_BLOCK_BYTES, **options)
 
-def detect_encoding(file_path):
-    with open(file_path, 'rb') as file:
-        raw_data = file.read(10000)  # Read first 10000 bytes
-    return chardet.detect(raw_data)['encoding']
+def external_sort(rows, key):
+    """row_sort.external_sort, within this script's SORT_MEMORY_BYTES."""
+    return row_sort.external_sort(rows, key, SORT_MEMORY_BYTES, SORT_SPILL_BATCH_ROWS, SORT_SPILL_DIR)
 
 def get_google_sheets_service():
     creds = None
@@ -56,16 +86,26 @@ def create_new_sheet(service, spreadsheet_id, sheet_name, num_rows, num_columns)
             }
         }]
     }
-    try:
-        response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-        return response['replies'][0]['addSheet']['properties']['sheetId']
-    except HttpError as error:
-        if 'already exists' in str(error):
-            sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-            for sheet in sheet_metadata.get('sheets', ''):
-                if sheet['properties']['title'] == sheet_name:
-                    return sheet['properties']['sheetId']
-        else:
+    for attempt in range(MAX_RETRIES):
+        try:
+            wait_for_quota()
+            response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+            return response['replies'][0]['addSheet']['properties']['sheetId']
+        except HttpError as error:
+            if error.resp.status == 429 and attempt < MAX_RETRIES - 1:
+                note_rate_limited(error)
+                continue
+            if error.resp.status >= 500 and attempt < MAX_RETRIES - 1:
+                time.sleep(2 ** attempt)
+                continue
+            if 'already exists' in str(error):
+                # If sheet already exists, get its ID
+                wait_for_quota()
+                sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+                for sheet in sheet_metadata.get('sheets', ''):
+                    if sheet['properties']['title'] == sheet_name:
+                        return sheet['properties']['sheetId']
+                return None
             raise
 
 def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
@@ -77,6 +117,7 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
         }
         for attempt in range(MAX_RETRIES):
             try:
+                wait_for_quota()
                 service.spreadsheets().values().update(
                     spreadsheetId=spreadsheet_id, range=range_name,
                     valueInputOption='RAW', body=body).execute()
@@ -84,12 +125,14 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values):
             except HttpError as error:
                 if attempt == MAX_RETRIES - 1:
                     raise
-                time.sleep(2 ** attempt)  # Exponential backoff
+                if error.resp.status == 429:
+                    note_rate_limited(error)  # The shared limiter waits out Retry-After
+                else:
+                    time.sleep(2 ** attempt)  # Exponential backoff
             except TimeoutError:
                 if attempt == MAX_RETRIES - 1:
                     raise
                 time.sleep(5)  # Wait 5 seconds before retrying on timeout
-        time.sleep(1)  # Short delay between batches
 
 def read_column_descriptions(filename, encoding):
     descriptions = {}
@@ -104,21 +147,35 @@ def read_column_descriptions(filename, encoding):
                     descriptions[column_name] = description
     return descriptions
 
-def read_census_data(census_file):
-    encoding = detect_encoding(census_file)
-    print(f"Detected encoding for census file: {encoding}")
-    
-    census_data = {}
-    with open(census_file, 'r', newline='', encoding=encoding, errors='replace') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            dot_number = row['DOT_NUMBER']
-            census_data[dot_number] = {
-                'LEGAL_NAME': row['LEGAL_NAME'],
-                'TELEPHONE': row['TELEPHONE'],
-                'EMAIL_ADDRESS': row['EMAIL_ADDRESS']
-            }
-    return census_data
+def census_cache_path(census_file, suffix='.parquet'):
+    return census_cache.census_cache_path(census_file, CENSUS_CACHE_DIR, suffix)
+
+def prune_census_cache(census_file):
+    census_cache.prune_census_cache(census_file, CENSUS_CACHE_DIR)
+
+def ensure_census_cache(census_file):
+    return census_cache.ensure_census_cache(census_file, CENSUS_CACHE_DIR, CENSUS_CACHE_CHUNK_ROWS,
+                                            PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def load_census_columns(census_file, columns=None):
+    """Load only the requested census columns from the columnar cache, building it on first use."""
+    return census_cache.load_census_columns(census_file, columns, CENSUS_CACHE_DIR, CENSUS_CACHE_CHUNK_ROWS,
+                                            PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def read_census_data(census_file, dot_numbers=None):
+    return census_cache.read_census_data(census_file, dot_numbers, CENSUS_INDEX_MAX_LOOKUPS, CENSUS_CACHE_DIR,
+                                         CENSUS_CACHE_CHUNK_ROWS, PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def ensure_sorted_census(census_file):
+    return census_cache.ensure_sorted_census(census_file, CENSUS_JOIN_COLUMNS, CENSUS_CACHE_DIR, CENSUS_CACHE_CHUNK_ROWS,
+                                             PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def iter_sorted_census(census_file):
+    return census_cache.iter_sorted_census(ensure_sorted_census(census_file), CENSUS_JOIN_COLUMNS)
+
+def census_merge_join(sorted_rows, key, census_file):
+    """census_cache.census_merge_join against this script's DOT_NUMBER-sorted census."""
+    return census_cache.census_merge_join(sorted_rows, key, iter_sorted_census(census_file))
 
 
 def format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, headers):
@@ -200,93 +257,143 @@ def format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descript
     }
     for attempt in range(MAX_RETRIES):
         try:
+            wait_for_quota()
             service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
             break
         except HttpError as error:
             if attempt == MAX_RETRIES - 1:
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+            if error.resp.status == 429:
+                note_rate_limited(error)  # The shared limiter waits out Retry-After
+            else:
+                time.sleep(2 ** attempt)  # Exponential backoff
         except TimeoutError:
             if attempt == MAX_RETRIES - 1:
                 raise
             time.sleep(5)  # Wait 5 seconds before retrying on timeout
 
 
-def process_csv(crashes_file, census_file, service, spreadsheet_id):
+def wait_for_quota():
+    """Block until one more Sheets API call fits the quotas; see sheets_quota.wait_for_quota."""
+    sheets_quota.wait_for_quota(_rate_limiter, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST,
+                                RATE_LIMIT_RECOVERY_SECONDS)
+
+def note_rate_limited(error):
+    sheets_quota.note_rate_limited(_rate_limiter, error, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT),
+                                   RATE_LIMIT_FLOOR, RATE_LIMIT_DEFAULT_PAUSE)
+
+def get_worker_service(service_factory):
+    # googleapiclient service objects are not thread-safe, so each upload worker builds its own.
+    if getattr(_worker_state, 'service', None) is None:
+        _worker_state.service = service_factory()
+    return _worker_state.service
+
+def upload_tab(service_factory, spreadsheet_id, sheet_name, sheet_id, values, *format_args):
+    service = get_worker_service(service_factory)
+    write_to_sheet_batch(service, spreadsheet_id, sheet_name, values)
+    format_sheet(service, spreadsheet_id, sheet_id, *format_args)
+    print(f"Created and populated sheet: {sheet_name}")
+
+def submit_upload(uploader, pending_uploads, *upload_args):
+    # Bound the number of filled tabs held in memory while the workers catch up.
+    while len(pending_uploads) >= UPLOAD_WORKERS * 2:
+        pending_uploads.pop(0).result()
+    pending_uploads.append(uploader.submit(upload_tab, *upload_args))
+
+def finish_uploads(pending_uploads):
+    for upload in pending_uploads:
+        upload.result()
+
+def process_csv(crashes_file, census_file, service, spreadsheet_id, service_factory=get_google_sheets_service):
     sheet_counter = 1
     row_counter = 0
     error_count = 0
     processed_count = 0
+    uploader = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+    pending_uploads = []
+    try:
+        encoding = detect_encoding(crashes_file)
+        print(f"Detected encoding for crashes file: {encoding}")
 
-    encoding = detect_encoding(crashes_file)
-    print(f"Detected encoding for crashes file: {encoding}")
-
-    column_descriptions = read_column_descriptions(README_FILE, encoding)
-    census_data = read_census_data(census_file)
+        column_descriptions = read_column_descriptions(README_FILE, encoding)
 
-    with open(crashes_file, 'r', newline='', encoding=encoding, errors='replace') as csvfile:
-        reader = csv.reader(csvfile)
-        headers = next(reader)
-        dot_number_index = headers.index('DOT_NUMBER')
+        with open(crashes_file, 'r', newline='', encoding=encoding, errors='replace') as csvfile:
+            reader = csv.reader(csvfile)
+            headers = next(reader)
+            dot_number_index = headers.index('DOT_NUMBER')
         
-        # Insert new columns after DOT_NUMBER
-        headers.insert(dot_number_index + 1, 'LEGAL_NAME')
-        headers.insert(dot_number_index + 2, 'TELEPHONE')
-        headers.insert(dot_number_index + 3, 'EMAIL_ADDRESS')
+            # Insert new columns after DOT_NUMBER
+            headers.insert(dot_number_index + 1, 'LEGAL_NAME')
+            headers.insert(dot_number_index + 2, 'TELEPHONE')
+            headers.insert(dot_number_index + 3, 'EMAIL_ADDRESS')
         
-        num_columns = len(headers)
-
-        print("Reading and sorting data...")
-        all_data = []
-        for row in reader:
-            if row[dot_number_index].strip():
-                dot_number = row[dot_number_index]
-                company_info = census_data.get(dot_number, {'LEGAL_NAME': '', 'TELEPHONE': '', 'EMAIL_ADDRESS': ''})
-                row.insert(dot_number_index + 1, company_info['LEGAL_NAME'])
-                row.insert(dot_number_index + 2, company_info['TELEPHONE'])
-                row.insert(dot_number_index + 3, company_info['EMAIL_ADDRESS'])
-                all_data.append(row)
-        
-        all_data.sort(key=lambda x: x[dot_number_index])
-        total_rows = len(all_data)
-        print(f"Total rows after filtering and enrichment: {total_rows}")
+            num_columns = len(headers)
 
-        current_sheet_data = [headers]
+            print("Reading and sorting data...")
+            dot_numbers = set()
 
-        for line_num, row in enumerate(all_data, start=1):
-            try:
-                if line_num % 1000 == 0:
-                    print(f"Processed {line_num} out of {total_rows} rows ({(line_num/total_rows)*100:.2f}%)")
-
-                current_sheet_data.append(row)
-                row_counter += 1
-                processed_count += 1
-
-                if row_counter == ROWS_PER_SHEET:
-                    sheet_name = f'Enriched_Crashes_Data_{sheet_counter}'
-                    sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, ROWS_PER_SHEET + 1, num_columns)
-                    write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data)
-                    format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, headers)
-                    print(f"Created and populated sheet: {sheet_name}")
-                    sheet_counter += 1
-                    row_counter = 0
-                    current_sheet_data = [headers]
-                    time.sleep(2)  # Add a delay between sheets
-
-            except Exception as e:
-                error_count += 1
-                print(f"Error processing line {line_num}: {str(e)}")
-                if error_count % 100 == 0:
-                    print(f"Encountered {error_count} errors. Last error: {str(e)}")
-                continue
+            def crash_rows():
+                for row in reader:
+                    if row[dot_number_index].strip():
+                        if CENSUS_JOIN != 'merge':
+                            dot_numbers.add(row[dot_number_index])
+                        yield row
+
+            # Sorting before enrichment gives the same order, since the DOT_NUMBER column doesn't move.
+            total_rows, sorted_rows = external_sort(crash_rows(), key=lambda x: x[dot_number_index])
+            print(f"Total rows after filtering: {total_rows}")
+
+            if CENSUS_JOIN == 'merge':
+                # The rows come out of the sort in DOT_NUMBER order, so the census can be streamed alongside.
+                enriched_rows = census_merge_join(sorted_rows, lambda x: x[dot_number_index], census_file)
+            else:
+                # Only look up the carriers that actually appear in the crash file.
+                census_data = read_census_data(census_file, dot_numbers)
+                enriched_rows = ((row, census_data.get(row[dot_number_index], {'LEGAL_NAME': '', 'TELEPHONE': '', 'EMAIL_ADDRESS': ''}))
+                                 for row in sorted_rows)
+
+            current_sheet_data = [headers]
+
+            for line_num, (row, company_info) in enumerate(enriched_rows, start=1):
+                try:
+                    row.insert(dot_number_index + 1, company_info['LEGAL_NAME'])
+                    row.insert(dot_number_index + 2, company_info['TELEPHONE'])
+                    row.insert(dot_number_index + 3, company_info['EMAIL_ADDRESS'])
+
+                    if line_num % 1000 == 0:
+                        print(f"Processed {line_num} out of {total_rows} rows ({(line_num/total_rows)*100:.2f}%)")
+
+                    current_sheet_data.append(row)
+                    row_counter += 1
+                    processed_count += 1
+
+                    if row_counter == ROWS_PER_SHEET:
+                        sheet_name = f'Enriched_Crashes_Data_{sheet_counter}'
+                        sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, ROWS_PER_SHEET + 1, num_columns)
+                        submit_upload(uploader, pending_uploads, service_factory, spreadsheet_id, sheet_name, sheet_id,
+                                      current_sheet_data, num_columns, column_descriptions, headers)
+                        print(f"Queued sheet for upload: {sheet_name}")
+                        sheet_counter += 1
+                        row_counter = 0
+                        current_sheet_data = [headers]
+
+                except Exception as e:
+                    error_count += 1
+                    print(f"Error processing line {line_num}: {str(e)}")
+                    if error_count % 100 == 0:
+                        print(f"Encountered {error_count} errors. Last error: {str(e)}")
+                    continue
 
-    # Write any remaining data
-    if len(current_sheet_data) > 1:
-        sheet_name = f'Enriched_Crashes_Data_{sheet_counter}'
-        sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, len(current_sheet_data), num_columns)
-        write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data)
-        format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, headers)
-        print(f"Created and populated sheet: {sheet_name}")
+        # Write any remaining data
+        if len(current_sheet_data) > 1:
+            sheet_name = f'Enriched_Crashes_Data_{sheet_counter}'
+            sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, len(current_sheet_data), num_columns)
+            submit_upload(uploader, pending_uploads, service_factory, spreadsheet_id, sheet_name, sheet_id,
+                          current_sheet_data, num_columns, column_descriptions, headers)
+        finish_uploads(pending_uploads)
+    finally:
+        # Also reached on an error: uploads that haven't started are dropped and the workers wind down.
+        uploader.shutdown(cancel_futures=True)
 
     print(f"Processing complete. {sheet_counter} sheet(s) created in the Google Spreadsheet.")
     print(f"Total rows processed: {processed_count}")
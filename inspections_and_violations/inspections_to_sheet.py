@@ -1,16 +1,22 @@
 import csv
+import io
 import os
 import time
 import json
-import chardet
+import marshal
+import sqlite3
+import sys
 from datetime import datetime
-from collections import defaultdict
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fmcsa_common import csv_blocks, census_cache, sheets_quota
+from fmcsa_common.csv_blocks import detect_encoding, read_csv_header
+
 # Google Sheets API setup
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 CLIENT_SECRET_FILE = './client_secret.json'
@@ -22,12 +28,27 @@ INSPECTIONS_FILE = 'raw_data/2024Jun_Inspection.txt'
 README_FILE = 'raw_data/Inspection_Readme.txt'
 CENSUS_FILE = '../census_and_safety/raw_data/FMCSA_CENSUS1_2024Jun.txt'
 ROWS_PER_SHEET = 10000
+CENSUS_CACHE_DIR = 'census_cache'
+CENSUS_CACHE_CHUNK_ROWS = 250000
+CENSUS_INDEX_MAX_LOOKUPS = 50000  # Beyond this a columnar scan beats random reads
+CENSUS_JOIN = 'lookup'  # 'lookup' probes a read_census_data dict; 'merge' streams the DOT-sorted census alongside sorted rows
+CENSUS_JOIN_COLUMNS = ['DOT_NUMBER', 'LEGAL_NAME', 'TELEPHONE', 'EMAIL_ADDRESS']
 MAX_COLUMN_WIDTH = 250
 BATCH_SIZE = 1000
 MAX_RETRIES = 15
+SHEETS_QUOTA_PER_USER = 60  # Requests per minute per user (Sheets API default quota)
+SHEETS_QUOTA_PER_PROJECT = 300  # Requests per minute per project
+SHEETS_BURST = 10  # Calls allowed back to back before pacing starts
+RATE_LIMIT_FLOOR = 0.1  # Repeated 429s never slow us below this share of the quota
+RATE_LIMIT_RECOVERY_SECONDS = 120  # Time to climb back from the floor to the full quota
+RATE_LIMIT_DEFAULT_PAUSE = 15  # Seconds to pause when a 429 has no usable Retry-After
+PARSE_WORKERS = os.cpu_count() or 1  # Processes parsing blocks of the large text files
+PARSE_BLOCK_BYTES = 64 * 2**20  # Bytes per parse block; each one ends on a record boundary
 REPORTING_STATE = 'TX'
 TAB_PREFIX='Enriched_Inspections_Data'
 MAX_CELL_CHARS = 49000  # Setting a bit below 50000 to be safe
+DATE_FORMATS = ['%d-%b-%y', '%m/%d/%Y']  # Layouts tried in order when a date string is first seen
+DATE_CACHE_SIZE = 100000  # Distinct date strings remembered before the cache starts over
 
 COLUMNS_TO_COMBINE = [
     "TIME_WEIGHT", "DRIVER_OOS_TOTAL", "VEHICLE_OOS_TOTAL", "TOTAL_HAZMAT_SENT",
@@ -39,7 +60,16 @@ COLUMNS_TO_COMBINE = [
     "FATIGUED_VIOL", "DR_FITNESS_VIOL", "SUBT_ALCOHOL_VIOL", "VH_MAINT_VIOL", "HM_VIOL"
 ]
 
-PROGRESS_FILE = 'inspections_progress.json'
+CHECKPOINT_FILE = 'inspections_checkpoint.sqlite'  # Per-carrier partial aggregates, the input offset they cover and the tabs written from them
+CHECKPOINT_VERSION = 2  # Bumped whenever the shape of the checkpointed accumulators changes
+VIOLATION_COLUMNS = ['BASIC_VIOL', 'UNSAFE_VIOL', 'FATIGUED_VIOL', 'DR_FITNESS_VIOL', 'SUBT_ALCOHOL_VIOL',
+                     'VH_MAINT_VIOL', 'HM_VIOL']
+
+_rate_limiter = sheets_quota.new_rate_limiter(min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST)
+
+_date_cache = {}  # Date string -> datetime, or None when no format matched
+_emailed_dot_numbers = None  # Set in each parse worker by set_emailed_dot_numbers
+_date_labels = {}  # Date string -> the '%d-%b-%y' label written to the sheet
 
 def split_string(s, max_length):
     if len(s) <= max_length:
@@ -53,47 +83,176 @@ def safe_int(value):
         return 0
 
 def parse_date(date_string):
+    # A file holds a few thousand distinct dates over millions of rows, so each string is parsed once.
     try:
-        return datetime.strptime(date_string, '%d-%b-%y')
-    except ValueError:
+        return _date_cache[date_string]
+    except KeyError:
+        pass
+    parsed = None
+    for date_format in DATE_FORMATS:
         try:
-            return datetime.strptime(date_string, '%m/%d/%Y')
+            parsed = datetime.strptime(date_string, date_format)
+            break
         except ValueError:
-            print(f"Unable to parse date: {date_string}")
-            return None
-
-def detect_encoding(file_path):
-    with open(file_path, 'rb') as file:
-        raw_data = file.read(10000)  # Read first 10000 bytes
-    return chardet.detect(raw_data)['encoding']
-
-def save_progress(processed_count, sheet_counter, row_counter):
-    with open(PROGRESS_FILE, 'w') as f:
-        json.dump({
-            'processed_count': processed_count,
-            'sheet_counter': sheet_counter,
-            'row_counter': row_counter
-        }, f)
-    print(f"Progress saved: processed_count={processed_count}, sheet_counter={sheet_counter}, row_counter={row_counter}")
-
-def load_progress():
-    if os.path.exists(PROGRESS_FILE):
-        try:
-            with open(PROGRESS_FILE, 'r') as f:
-                data = f.read().strip()
-                if data:
-                    progress = json.loads(data)
-                    print(f"Loaded progress: {progress}")
-                    return progress
+            continue
+    else:
+        print(f"Unable to parse date: {date_string}")
+    if len(_date_cache) >= DATE_CACHE_SIZE:
+        _date_cache.clear()
+    _date_cache[date_string] = parsed
+    return parsed
+
+def format_date(date_string):
+    # The day label inspections are grouped under, memoized like parse_date; None when unparseable.
+    try:
+        return _date_labels[date_string]
+    except KeyError:
+        pass
+    parsed = parse_date(date_string)
+    label = parsed.strftime('%d-%b-%y') if parsed else None
+    if len(_date_labels) >= DATE_CACHE_SIZE:
+        _date_labels.clear()
+    _date_labels[date_string] = label
+    return label
+
+def parse_blocks(path, encoding, block_task, *task_args, **options):
+    """csv_blocks.parse_blocks, with this script's PARSE_WORKERS and PARSE_BLOCK_BYTES."""
+    return csv_blocks.parse_blocks(path, encoding, block_task, *task_args, workers=PARSE_WORKERS,
+                                   block_bytes=PARSE_BLOCK_BYTES, **options)
+
+def set_emailed_dot_numbers(dot_numbers):
+    global _emailed_dot_numbers
+    _emailed_dot_numbers = dot_numbers
+
+def aggregate_inspection_block(text, headers):
+    """Accumulate one block's inspections per carrier, in order of first appearance.
+
+    Returns (rows_in_block, {dot_number: accumulator}) for carriers in the set given to
+    set_emailed_dot_numbers, or for every carrier if it is None. An accumulator holds the first REPORT_STATE, the running
+    TOTAL_VIOLATIONS, the distinct inspection dates and, for each of COLUMNS_TO_COMBINE that had
+    a non-empty value, its distinct values - so it grows with distinct values, not inspections.
+    Distinct values are kept as a plain string until a second one turns up, as most carriers
+    only have one, and repeated strings are shared between carriers.
+    """
+    rows = 0
+    partials = {}
+    shared = {}
+    distinct_fields = ['dates'] + [field for field in COLUMNS_TO_COMBINE if field in headers]
+    # The violation columns are also in COLUMNS_TO_COMBINE, and the total has always counted both.
+    violation_fields = [field for field in COLUMNS_TO_COMBINE + VIOLATION_COLUMNS
+                        if field in headers and field in VIOLATION_COLUMNS]
+    emailed_dot_numbers = _emailed_dot_numbers
+    for row in csv.DictReader(io.StringIO(text, newline=''), fieldnames=headers):
+        rows += 1
+        insp_date = format_date(row['INSP_DATE'])
+
+        # Limiting by date and reporting state:
+#        if not insp_date or insp_date.year < 2023 or row['REPORT_STATE'] != REPORTING_STATE:
+#            continue
+
+        # Limiting only to ones with inspections on at least one date and in the reporting state:
+        if not insp_date or row['REPORT_STATE'] != REPORTING_STATE:
+            continue
+
+        # Limiting only to those with inspection dates:
+        # if not insp_date:
+        #    continue
+        if emailed_dot_numbers is not None and row['DOT_NUMBER'] not in emailed_dot_numbers:
+            continue
+
+        accumulator = partials.get(row['DOT_NUMBER'])
+        if accumulator is None:
+            accumulator = partials[row['DOT_NUMBER']] = {'REPORT_STATE': row['REPORT_STATE'], 'TOTAL_VIOLATIONS': 0}
+        accumulator['TOTAL_VIOLATIONS'] += sum(safe_int(row[field]) for field in violation_fields)
+        row['dates'] = insp_date  # So the date goes through the same distinct-value path
+        for field in distinct_fields:
+            value = row[field]
+            if value:  # Empty values never make it into ADDITIONAL_INFO
+                values = accumulator.get(field)
+                if values is None:
+                    accumulator[field] = shared.setdefault(value, value)
+                elif isinstance(values, str):
+                    if value != values:
+                        accumulator[field] = {values, value}
                 else:
-                    print("Progress file is empty. Starting from the beginning.")
-        except json.JSONDecodeError:
-            print("Error reading progress file. Starting from the beginning.")
-        except Exception as e:
-            print(f"Unexpected error reading progress file: {str(e)}. Starting from the beginning.")
+                    values.add(value)
+    return rows, partials
+
+def distinct_values(values):
+    return (values,) if isinstance(values, str) else values
+
+def merge_distinct(values, more):
+    """Combine two accumulator entries (a lone string or a set of distinct values)."""
+    if isinstance(values, str):
+        if isinstance(more, str):
+            return values if more == values else {values, more}
+        values = {values}
+    if isinstance(more, str):
+        values.add(more)
     else:
-        print("No progress file found. Starting from the beginning.")
-    return None
+        values |= more
+    return values
+
+def input_fingerprint(path):
+    # Segments are marshalled, whose format can change between Python versions.
+    stat = os.stat(path)
+    # Merge joins filter by email after aggregating, so their partials aren't interchangeable with lookup ones.
+    return (f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}:py{sys.version_info[0]}.{sys.version_info[1]}"
+            f":{CENSUS_JOIN}:v{CHECKPOINT_VERSION}")
+
+def open_checkpoint(inspections_file):
+    """Open the aggregation checkpoint, discarding it if it was taken from a different input file."""
+    db = sqlite3.connect(CHECKPOINT_FILE)
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS segments (segment INTEGER PRIMARY KEY, partials BLOB)")
+    fingerprint = input_fingerprint(inspections_file)
+    stored = db.execute("SELECT value FROM meta WHERE key = 'input'").fetchone()
+    if stored is None or stored[0] != fingerprint:
+        if stored is not None:
+            print("Checkpoint was taken from a different inspections file. Starting from the beginning.")
+        with db:
+            db.execute("DELETE FROM meta")
+            db.execute("DELETE FROM segments")
+            db.execute("INSERT INTO meta VALUES ('input', ?)", (fingerprint,))
+    return db
+
+def load_checkpoint(db, company_inspections):
+    """Replay the checkpointed partials into company_inspections; return (offset, processed_count, segments, tabs)."""
+    meta = dict(db.execute("SELECT key, value FROM meta"))
+    if 'offset' not in meta:
+        return None, 0, 0, 0
+    for (partials,) in db.execute("SELECT partials FROM segments ORDER BY segment"):
+        merge_partials(company_inspections, marshal.loads(partials))
+    print(f"Resuming aggregation at byte {meta['offset']} with {len(company_inspections)} companies from {meta['segments']} checkpoint(s)")
+    return int(meta['offset']), int(meta['processed_count']), int(meta['segments']), int(meta.get('tabs', 0))
+
+def merge_partials(company_inspections, partials):
+    for dot_number, accumulator in partials.items():
+        inspections = company_inspections.get(dot_number)
+        if inspections is None:
+            # First block this carrier shows up in: take its accumulator over rather than copying it.
+            company_inspections[dot_number] = accumulator
+            continue
+        inspections['TOTAL_VIOLATIONS'] += accumulator['TOTAL_VIOLATIONS']
+        for field, values in accumulator.items():
+            if field in ('REPORT_STATE', 'TOTAL_VIOLATIONS'):
+                continue
+            if field in inspections:
+                inspections[field] = merge_distinct(inspections[field], values)
+            else:
+                inspections[field] = values
+
+def save_checkpoint(db, segment, partials, offset, processed_count):
+    """Append one block's partials as a segment and move the resume offset past it, in a single transaction."""
+    with db:
+        db.execute("INSERT INTO segments VALUES (?, ?)", (segment, marshal.dumps(partials)))
+        db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                       (('offset', str(offset)), ('processed_count', str(processed_count)), ('segments', str(segment))))
+
+def save_tabs_written(db, tabs):
+    """Record how many full tabs have been written from the checkpointed aggregates."""
+    with db:
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('tabs', ?)", (str(tabs),))
 
 def get_google_sheets_service():
     creds = None
@@ -123,16 +282,26 @@ def create_new_sheet(service, spreadsheet_id, sheet_name, num_rows, num_columns)
             }
         }]
     }
-    try:
-        response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-        return response['replies'][0]['addSheet']['properties']['sheetId']
-    except HttpError as error:
-        if 'already exists' in str(error):
-            sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-            for sheet in sheet_metadata.get('sheets', ''):
-                if sheet['properties']['title'] == sheet_name:
-                    return sheet['properties']['sheetId']
-        else:
+    for attempt in range(MAX_RETRIES):
+        try:
+            wait_for_quota()
+            response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+            return response['replies'][0]['addSheet']['properties']['sheetId']
+        except HttpError as error:
+            if error.resp.status == 429 and attempt < MAX_RETRIES - 1:
+                note_rate_limited(error)
+                continue
+            if error.resp.status >= 500 and attempt < MAX_RETRIES - 1:
+                time.sleep(2 ** attempt)
+                continue
+            if 'already exists' in str(error):
+                # If sheet already exists, get its ID
+                wait_for_quota()
+                sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+                for sheet in sheet_metadata.get('sheets', ''):
+                    if sheet['properties']['title'] == sheet_name:
+                        return sheet['properties']['sheetId']
+                return None
             raise
 
 def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values, 
@@ -159,6 +328,7 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values,
 
         for attempt in range(MAX_RETRIES):
             try:
+                wait_for_quota()
                 response = service.spreadsheets().values().update(
                     spreadsheetId=spreadsheet_id, range=range_name,
                     valueInputOption='RAW', body=body).execute()
@@ -183,14 +353,16 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values,
                 if attempt == MAX_RETRIES - 1:
                     print("Max retries reached. Exiting.")
                     sys.exit(1)
-                time.sleep(2 ** attempt)  # Exponential backoff
+                if error.resp.status == 429:
+                    note_rate_limited(error)  # The shared limiter waits out Retry-After
+                else:
+                    time.sleep(2 ** attempt)  # Exponential backoff
             except Exception as e:
                 print(f"Unexpected error during batch write: {str(e)}")
                 if attempt == MAX_RETRIES - 1:
                     print("Max retries reached. Exiting.")
                     sys.exit(1)
                 time.sleep(5)
-        time.sleep(1)  # Short delay between batches
 
 def read_column_descriptions(filename, encoding):
     descriptions = {}
@@ -205,21 +377,35 @@ def read_column_descriptions(filename, encoding):
                     descriptions[column_name] = description
     return descriptions
 
-def read_census_data(census_file):
-    encoding = detect_encoding(census_file)
-    print(f"Detected encoding for census file: {encoding}")
-    
-    census_data = {}
-    with open(census_file, 'r', newline='', encoding=encoding, errors='replace') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            dot_number = row['DOT_NUMBER']
-            census_data[dot_number] = {
-                'LEGAL_NAME': row['LEGAL_NAME'],
-                'TELEPHONE': row['TELEPHONE'],
-                'EMAIL_ADDRESS': row['EMAIL_ADDRESS']
-            }
-    return census_data
+def census_cache_path(census_file, suffix='.parquet'):
+    return census_cache.census_cache_path(census_file, CENSUS_CACHE_DIR, suffix)
+
+def prune_census_cache(census_file):
+    census_cache.prune_census_cache(census_file, CENSUS_CACHE_DIR)
+
+def ensure_census_cache(census_file):
+    return census_cache.ensure_census_cache(census_file, CENSUS_CACHE_DIR, CENSUS_CACHE_CHUNK_ROWS,
+                                            PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def load_census_columns(census_file, columns=None):
+    """Load only the requested census columns from the columnar cache, building it on first use."""
+    return census_cache.load_census_columns(census_file, columns, CENSUS_CACHE_DIR, CENSUS_CACHE_CHUNK_ROWS,
+                                            PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def read_census_data(census_file, dot_numbers=None):
+    return census_cache.read_census_data(census_file, dot_numbers, CENSUS_INDEX_MAX_LOOKUPS, CENSUS_CACHE_DIR,
+                                         CENSUS_CACHE_CHUNK_ROWS, PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def ensure_sorted_census(census_file):
+    return census_cache.ensure_sorted_census(census_file, CENSUS_JOIN_COLUMNS, CENSUS_CACHE_DIR, CENSUS_CACHE_CHUNK_ROWS,
+                                             PARSE_WORKERS, PARSE_BLOCK_BYTES)
+
+def iter_sorted_census(census_file):
+    return census_cache.iter_sorted_census(ensure_sorted_census(census_file), CENSUS_JOIN_COLUMNS)
+
+def census_merge_join(sorted_rows, key, census_file):
+    """census_cache.census_merge_join against this script's DOT_NUMBER-sorted census."""
+    return census_cache.census_merge_join(sorted_rows, key, iter_sorted_census(census_file))
 
 
 def format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, headers):
@@ -321,160 +507,152 @@ def format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descript
     }
     for attempt in range(MAX_RETRIES):
         try:
+            wait_for_quota()
             service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
             break
         except HttpError as error:
             if attempt == MAX_RETRIES - 1:
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+            if error.resp.status == 429:
+                note_rate_limited(error)  # The shared limiter waits out Retry-After
+            else:
+                time.sleep(2 ** attempt)  # Exponential backoff
         except TimeoutError:
             if attempt == MAX_RETRIES - 1:
                 raise
             print(f"Timed out during formatting. Retrying attempt {attempt}")
             time.sleep(5)  # Wait 5 seconds before retrying on timeout
 
+def wait_for_quota():
+    """Block until one more Sheets API call fits the quotas; see sheets_quota.wait_for_quota."""
+    sheets_quota.wait_for_quota(_rate_limiter, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST,
+                                RATE_LIMIT_RECOVERY_SECONDS)
+
+def note_rate_limited(error):
+    sheets_quota.note_rate_limited(_rate_limiter, error, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT),
+                                   RATE_LIMIT_FLOOR, RATE_LIMIT_DEFAULT_PAUSE)
+
 def process_csv(inspections_file, census_file, service, spreadsheet_id):
-    progress = load_progress()
-    sheet_counter = progress['sheet_counter'] if progress else 1
-    row_counter = progress['row_counter'] if progress else 0
-    start_from = progress['processed_count'] if progress else 0
+    row_counter = 0
     error_count = 0
-    processed_count = start_from
-
-    print(f"Starting process: sheet_counter={sheet_counter}, row_counter={row_counter}, start_from={start_from}")
 
     encoding = detect_encoding(inspections_file)
     print(f"Detected encoding for inspections file: {encoding}")
 
     column_descriptions = read_column_descriptions(README_FILE, encoding)
-    census_data = read_census_data(census_file)
+    # A merge join streams the census at consolidation time instead of holding it in memory.
+    census_data = read_census_data(census_file) if CENSUS_JOIN != 'merge' else None
     sheet_ids = []
 
-    with open(inspections_file, 'r', newline='', encoding=encoding, errors='replace') as csvfile:
-        reader = csv.DictReader(csvfile)
-        headers = reader.fieldnames
-        
-        # Prepare new headers
-        new_headers = [
-            'DOT_NUMBER', 'LEGAL_NAME', 'TELEPHONE', 'EMAIL_ADDRESS',
-            'REPORT_STATE', 'TOTAL_VIOLATIONS', 'ADDITIONAL_INFO', 'ADDITIONAL_INFO_CONTINUED'
-        ]
-        
-        num_columns = len(new_headers)
-
-        print("Reading and processing data...")
-        company_inspections = defaultdict(lambda: defaultdict(list))
-
-        for row in reader:
-            processed_count += 1
-            
-            if processed_count <= start_from:
-                continue
-
-            insp_date = parse_date(row['INSP_DATE'])
-
-            # Limiting by date and reporting state:
-#            if not insp_date or insp_date.year < 2023 or row['REPORT_STATE'] != REPORTING_STATE:
-#                continue
+    # Partial aggregates are checkpointed with the byte offset they cover after every parse
+    # block, so a resumed run replays them and continues from that offset. The count of full
+    # tabs written lives in the same checkpoint, so it is thrown away along with the aggregates
+    # whenever the input file or CENSUS_JOIN changes.
+    checkpoint = open_checkpoint(inspections_file)
+    company_inspections = {}
+    start_offset, processed_count, segment, tabs_written = load_checkpoint(checkpoint, company_inspections)
+    sheet_counter = tabs_written + 1
+
+    print(f"Starting process: sheet_counter={sheet_counter}, start_offset={start_offset}, processed_count={processed_count}")
+
+    headers = read_csv_header(inspections_file, encoding)
+    # Prepare new headers
+    new_headers = [
+        'DOT_NUMBER', 'LEGAL_NAME', 'TELEPHONE', 'EMAIL_ADDRESS',
+        'REPORT_STATE', 'TOTAL_VIOLATIONS', 'ADDITIONAL_INFO', 'ADDITIONAL_INFO_CONTINUED'
+    ]
+    
+    num_columns = len(new_headers)
 
-            # Limiting only to ones with inspections on at least one date and in the reporting state:
-            if not insp_date or row['REPORT_STATE'] != REPORTING_STATE:
-                continue
+    print("Reading and processing data...")
+    if census_data is not None:
+        emailed_dot_numbers = {dot_number for dot_number, company_info in census_data.items() if company_info['EMAIL_ADDRESS']}
+    else:
+        # Streamed from the sorted census into a compact set, so carriers without an email are
+        # dropped before aggregating, as in lookup mode, without holding the census.
+        emailed_dot_numbers = census_cache.emailed_dot_numbers(iter_sorted_census(census_file))
+        print(f"{len(emailed_dot_numbers)} census carriers have an email address")
+    # Handed to each parse worker once, rather than pickled along with every block.
+    for end_offset, (rows, partials) in parse_blocks(inspections_file, encoding, aggregate_inspection_block, headers,
+                                                     start_offset=start_offset, initializer=set_emailed_dot_numbers,
+                                                     initargs=(emailed_dot_numbers,)):
+        processed_count += rows
+        segment += 1
+        save_checkpoint(checkpoint, segment, partials, end_offset, processed_count)
+        merge_partials(company_inspections, partials)
+        print(f"Processed {processed_count} rows")
+
+    print(f"Finished reading data. Total companies: {len(company_inspections)}")
+    print("Consolidating company data...")
+    current_sheet_data = [new_headers]
+    # Tabs written before an interruption hold the first companies in aggregation order.
+    already_written = (sheet_counter - 1) * ROWS_PER_SHEET
+
+    if CENSUS_JOIN == 'merge':
+        # Carriers come out in DOT_NUMBER order rather than first appearance. Aggregation already
+        # skipped carriers without an email; checking again here also covers aggregates replayed
+        # from a checkpoint written before that filter ran in merge mode.
+        carriers = census_merge_join(sorted(company_inspections), lambda dot_number: dot_number, census_file)
+        enriched = ((dot_number, company_inspections[dot_number], company_info)
+                    for dot_number, company_info in carriers if company_info['EMAIL_ADDRESS'])
+    else:
+        enriched = ((dot_number, inspections, census_data.get(dot_number, {'LEGAL_NAME': '', 'TELEPHONE': '', 'EMAIL_ADDRESS': ''}))
+                    for dot_number, inspections in company_inspections.items())
+
+    for position, (dot_number, inspections, company_info) in enumerate(enriched):
+        if position < already_written:
+            continue
+
+        additional_info = [f"INSPECTION DATES: {','.join(sorted(distinct_values(inspections['dates'])))}"]
+        for field in COLUMNS_TO_COMBINE:
+            if field in inspections:  # Only fields that had a non-empty value
+                additional_info.append(f"{field}: {','.join(distinct_values(inspections[field]))}")
+
+        additional_info_str = '\n'.join(additional_info)
+        additional_info_main, additional_info_continued = split_string(additional_info_str, MAX_CELL_CHARS)
+
+        new_row = [
+            dot_number,
+            company_info['LEGAL_NAME'],
+            company_info['TELEPHONE'],
+            company_info['EMAIL_ADDRESS'],
+            inspections['REPORT_STATE'],
+            str(inspections['TOTAL_VIOLATIONS']),
+            additional_info_main,
+            additional_info_continued
+        ]
 
-            # Limiting only to those with inspection dates:
-            # if not insp_date:
-            #    continue
+        # Final check for cell character limit
+        for i, cell in enumerate(new_row):
+            if isinstance(cell, str) and len(cell) > MAX_CELL_CHARS:
+                print(f"WARNING: Cell content exceeds {MAX_CELL_CHARS} characters for DOT_NUMBER {dot_number}, column {i}")
+                print(f"Cell content (truncated): {cell[:100]}...")
+                print(f"Cell length: {len(cell)}")
+                new_row[i] = cell[:MAX_CELL_CHARS]
 
+        current_sheet_data.append(new_row)
+        row_counter += 1
 
-            dot_number = row['DOT_NUMBER']
-            company_info = census_data.get(dot_number, {'LEGAL_NAME': '', 'TELEPHONE': '', 'EMAIL_ADDRESS': ''})
-            if not company_info['EMAIL_ADDRESS']:
-                # print(f"Skipping company {company_info['LEGAL_NAME']}, tel: {company_info['TELEPHONE']}, since no email address -->{company_info['EMAIL_ADDRESS']}<--")
+        if row_counter >= ROWS_PER_SHEET:
+            print(f"Preparing to write sheet {sheet_counter} with {row_counter} rows")
+            try:
+                sheet_name = f'{TAB_PREFIX}_{sheet_counter}'
+                sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, ROWS_PER_SHEET + 1, num_columns)
+                print("Writing batch of data to google sheet.")
+                write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data, 
+                                     sheet_id, num_columns,column_descriptions, new_headers)
+                print(f"Created and populated sheet: {sheet_name}")
+                sheet_ids.append(sheet_id)
+                save_tabs_written(checkpoint, sheet_counter)
+                sheet_counter += 1
+                row_counter = 0
+                current_sheet_data = [new_headers]
+            except Exception as e:
+                error_count += 1
+                print(f"Error creating/writing sheet: {str(e)}")
+                time.sleep(60)  # Wait for 1 minute before retrying
                 continue
 
-            company_inspections[dot_number]['dates'].append(insp_date.strftime('%d-%b-%y'))
-            company_inspections[dot_number]['REPORT_STATE'].append(row['REPORT_STATE'])
-            
-            for field in COLUMNS_TO_COMBINE + ['BASIC_VIOL', 'UNSAFE_VIOL', 'FATIGUED_VIOL', 
-                                               'DR_FITNESS_VIOL', 'SUBT_ALCOHOL_VIOL', 'VH_MAINT_VIOL', 'HM_VIOL']:
-                if field in row:
-                    company_inspections[dot_number][field].append(row[field])
-
-            if processed_count % 10000 == 0:
-                print(f"Processed {processed_count} rows")
-                save_progress(processed_count, sheet_counter, row_counter)
-
-        print(f"Finished reading data. Total companies: {len(company_inspections)}")
-        print("Consolidating company data...")
-        current_sheet_data = [new_headers]
-
-        for dot_number, inspections in company_inspections.items():
-            company_info = census_data.get(dot_number, {'LEGAL_NAME': '', 'TELEPHONE': '', 'EMAIL_ADDRESS': ''})
-            
-            violations_total = sum(safe_int(v) for v in (
-                inspections.get('BASIC_VIOL', []) +
-                inspections.get('UNSAFE_VIOL', []) +
-                inspections.get('FATIGUED_VIOL', []) +
-                inspections.get('DR_FITNESS_VIOL', []) +
-                inspections.get('SUBT_ALCOHOL_VIOL', []) +
-                inspections.get('VH_MAINT_VIOL', []) +
-                inspections.get('HM_VIOL', [])
-            ))
-
-            additional_info = [f"INSPECTION DATES: {','.join(sorted(set(inspections['dates'])))}"]
-            for field in COLUMNS_TO_COMBINE:
-                if field in inspections:
-                    values = ','.join(set(filter(None, inspections[field])))  # Filter out empty strings
-                    if values:  # Only add non-empty fields
-                        additional_info.append(f"{field}: {values}")
-
-            additional_info_str = '\n'.join(additional_info)
-            additional_info_main, additional_info_continued = split_string(additional_info_str, MAX_CELL_CHARS)
-
-            new_row = [
-                dot_number,
-                company_info['LEGAL_NAME'],
-                company_info['TELEPHONE'],
-                company_info['EMAIL_ADDRESS'],
-                inspections['REPORT_STATE'][0] if inspections.get('REPORT_STATE') else '',
-                str(violations_total),
-                additional_info_main,
-                additional_info_continued
-            ]
-
-            # Final check for cell character limit
-            for i, cell in enumerate(new_row):
-                if isinstance(cell, str) and len(cell) > MAX_CELL_CHARS:
-                    print(f"WARNING: Cell content exceeds {MAX_CELL_CHARS} characters for DOT_NUMBER {dot_number}, column {i}")
-                    print(f"Cell content (truncated): {cell[:100]}...")
-                    print(f"Cell length: {len(cell)}")
-                    new_row[i] = cell[:MAX_CELL_CHARS]
-
-            current_sheet_data.append(new_row)
-            row_counter += 1
-
-            if row_counter >= ROWS_PER_SHEET:
-                print(f"Preparing to write sheet {sheet_counter} with {row_counter} rows")
-                try:
-                    sheet_name = f'{TAB_PREFIX}_{sheet_counter}'
-                    sheet_id = create_new_sheet(service, spreadsheet_id, sheet_name, ROWS_PER_SHEET + 1, num_columns)
-                    print("Writing batch of data to google sheet.")
-                    write_to_sheet_batch(service, spreadsheet_id, sheet_name, current_sheet_data, 
-                                         sheet_id, num_columns,column_descriptions, new_headers)
-                    print(f"Created and populated sheet: {sheet_name}")
-                    sheet_ids.append(sheet_id)
-                    sheet_counter += 1
-                    row_counter = 0
-                    current_sheet_data = [new_headers]
-                    save_progress(processed_count, sheet_counter, row_counter)
-                    time.sleep(2)  # Add a delay between sheets
-                except Exception as e:
-                    error_count += 1
-                    print(f"Error creating/writing sheet: {str(e)}")
-                    save_progress(processed_count, sheet_counter, row_counter)
-                    time.sleep(60)  # Wait for 1 minute before retrying
-                    continue
-
     # Write any remaining data
     if len(current_sheet_data) > 1:
         print(f"Writing final sheet with {len(current_sheet_data)} rows")
@@ -497,10 +675,9 @@ def process_csv(inspections_file, census_file, service, spreadsheet_id):
     print(f"Total rows written: {row_counter + (sheet_counter - 1) * ROWS_PER_SHEET}")
     print(f"Total errors encountered: {error_count}")
     
-    # Clear progress file after successful completion
-    if os.path.exists(PROGRESS_FILE):
-        os.remove(PROGRESS_FILE)
-        print("Progress file removed after successful completion.")
+    checkpoint.close()
+    os.remove(CHECKPOINT_FILE)
+    print("Aggregation checkpoint removed after successful completion.")
 
 if __name__ == "__main__":
     service = get_google_sheets_service()
@@ -15,20 +15,29 @@ import random
 import html2text
 import re
 from bs4 import BeautifulSoup
+try:
+    from lxml import etree, html as lxml_html
+except ImportError:
+    lxml_html = None  # Falls back to BeautifulSoup's html.parser
 import sys
 import csv
 import os
 import time
+import threading
 import json
-import chardet
 from datetime import datetime
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fmcsa_common import census_cache, scrape_cache, sheets_quota
+from fmcsa_common.csv_blocks import detect_encoding
+
 # Google Sheets API setup
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
 CLIENT_SECRET_FILE = './client_secret.json'
@@ -38,16 +47,55 @@ SPREADSHEET_ID = '1yLk7AjKdy_b2uOZZiDY2T2Ke6567HdNhbwecKCKAEtI'
 # File setup
 REVOCATIONS_FILE = 'raw_data/revocation_2024_08_06.txt'
 README_FILE = 'raw_data/Revocations_Readme.txt'
-CENSUS_FILE = '../census_and_safety/raw_data/FMCSA_CENSUS1_2024Jun.txt'
+CENSUS_FILE = '../census_and_safety/raw_data/FMCSA_CENSUS1_2024Jun.txt'  # Only read with USE_CENSUS_INDEX; keep it on the latest release
 ROWS_PER_SHEET = 500
 MAX_COLUMN_WIDTH = 250
 BATCH_SIZE = 1000
 MAX_RETRIES = 15
+SHEETS_QUOTA_PER_USER = 60  # Requests per minute per user (Sheets API default quota)
+SHEETS_QUOTA_PER_PROJECT = 300  # Requests per minute per project
+SHEETS_BURST = 10  # Calls allowed back to back before pacing starts
+RATE_LIMIT_FLOOR = 0.1  # Repeated 429s never slow us below this share of the quota
+RATE_LIMIT_RECOVERY_SECONDS = 120  # Time to climb back from the floor to the full quota
+RATE_LIMIT_DEFAULT_PAUSE = 15  # Seconds to pause when a 429 has no usable Retry-After
 TAB_PREFIX='Enriched_Revocations_Data'
 MAX_CELL_CHARS = 49000  # Setting a bit below 50000 to be safe
 
 CITIES_FILE = 'cities.txt'
+USE_CENSUS_INDEX = False  # Take company details from CENSUS_FILE when the carrier is in it, and only scrape SAFER for the rest
+CENSUS_CACHE_DIR = 'census_cache'
 PROGRESS_FILE = 'revocations_progress.json'
+SCRAPE_WORKERS = 4  # SAFER snapshots fetched concurrently
+SCRAPE_REQUESTS_PER_MINUTE = 30  # Politeness budget shared by all workers
+SCRAPE_TIMEOUT = 30  # Seconds before a SAFER request is abandoned and retried
+SCRAPE_RETRY_BASE = 5  # Seconds; retries back off exponentially from this, with full jitter
+HTML_ENGINE = 'lxml'  # 'lxml' (C parser, precompiled XPath) or 'bs4' (BeautifulSoup html.parser)
+SNAPSHOT_FIELDS = [
+    ('Legal Name', 'Legal Name:'),
+    ('DBA Name', 'DBA Name:'),
+    ('Phone', 'Phone:'),
+    ('Physical Address', 'Physical Address:')
+]
+SNAPSHOT_NOT_FOUND_MARKER = 'Record Not Found'  # SAFER's reply for a USDOT number it has no carrier for
+SCRAPE_CACHE_FILE = 'scraping_cache.sqlite'
+SCRAPE_CACHE_MAX_BYTES = 512 * 2**20  # Least recently used pages are evicted beyond this
+SCRAPE_CACHE_DEFAULT_TTL = 30 * 86400  # Seconds; None keeps pages forever
+SCRAPE_CACHE_TTLS = [
+    (r'safer\.fmcsa\.dot\.gov/query\.asp', 7 * 86400)  # Snapshots pick up address and name changes
+]
+
+_scrape_state = {
+    'lock': threading.Lock(),
+    'next_slot': 0.0,
+    'sessions': threading.local()
+}
+
+if lxml_html is not None:
+    TABLE_HEADERS = etree.XPath('//th')
+
+_scrape_cache = scrape_cache.new_scrape_cache()
+
+_rate_limiter = sheets_quota.new_rate_limiter(min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST)
 
 def read_cities(filename):
     cities = {}
@@ -102,11 +150,6 @@ def parse_date(date_string):
             print(f"Unable to parse date: {date_string}")
             return None
 
-def detect_encoding(file_path):
-    with open(file_path, 'rb') as file:
-        raw_data = file.read(10000)  # Read first 10000 bytes
-    return chardet.detect(raw_data)['encoding']
-
 def save_progress(processed_count, sheet_counter, row_counter):
     with open(PROGRESS_FILE, 'w') as f:
         json.dump({
@@ -176,16 +219,26 @@ def create_new_sheet(service, spreadsheet_id, sheet_name, num_rows, num_columns)
             }
         }]
     }
-    try:
-        response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-        return response['replies'][0]['addSheet']['properties']['sheetId']
-    except HttpError as error:
-        if 'already exists' in str(error):
-            sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-            for sheet in sheet_metadata.get('sheets', ''):
-                if sheet['properties']['title'] == sheet_name:
-                    return sheet['properties']['sheetId']
-        else:
+    for attempt in range(MAX_RETRIES):
+        try:
+            wait_for_quota()
+            response = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
+            return response['replies'][0]['addSheet']['properties']['sheetId']
+        except HttpError as error:
+            if error.resp.status == 429 and attempt < MAX_RETRIES - 1:
+                note_rate_limited(error)
+                continue
+            if error.resp.status >= 500 and attempt < MAX_RETRIES - 1:
+                time.sleep(2 ** attempt)
+                continue
+            if 'already exists' in str(error):
+                # If sheet already exists, get its ID
+                wait_for_quota()
+                sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+                for sheet in sheet_metadata.get('sheets', ''):
+                    if sheet['properties']['title'] == sheet_name:
+                        return sheet['properties']['sheetId']
+                return None
             raise
 
 def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values, 
@@ -212,6 +265,7 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values,
 
         for attempt in range(MAX_RETRIES):
             try:
+                wait_for_quota()
                 response = service.spreadsheets().values().update(
                     spreadsheetId=spreadsheet_id, range=range_name,
                     valueInputOption='USER_ENTERED', body=body).execute()
@@ -236,14 +290,16 @@ def write_to_sheet_batch(service, spreadsheet_id, sheet_name, values,
                 if attempt == MAX_RETRIES - 1:
                     print("Max retries reached. Exiting.")
                     sys.exit(1)
-                time.sleep(2 ** attempt)  # Exponential backoff
+                if error.resp.status == 429:
+                    note_rate_limited(error)  # The shared limiter waits out Retry-After
+                else:
+                    time.sleep(2 ** attempt)  # Exponential backoff
             except Exception as e:
                 print(f"Unexpected error during batch write: {str(e)}")
                 if attempt == MAX_RETRIES - 1:
                     print("Max retries reached. Exiting.")
                     sys.exit(1)
                 time.sleep(5)
-        time.sleep(1)  # Short delay between batches
 
 def read_column_descriptions(filename, encoding):
     print(f"Reading column descriptions for file {filename}.")
@@ -259,53 +315,130 @@ def read_column_descriptions(filename, encoding):
                     descriptions[column_name] = description
     return descriptions
 
+def read_census_companies(census_file, dot_numbers):
+    """Look up carriers in the census and shape them like extract_company_data results."""
+    columns = ['LEGAL_NAME', 'DBA_NAME', 'TELEPHONE', 'PHY_STREET', 'PHY_CITY', 'PHY_STATE', 'PHY_ZIP']
+    # Revocations pad DOT numbers to 8 digits; the census doesn't.
+    padded_dot_numbers = defaultdict(list)
+    for dot_number in dot_numbers:
+        try:
+            padded_dot_numbers[str(int(dot_number))].append(dot_number)
+        except ValueError:
+            continue
+    companies = {}
+    for census_dot_number, row in census_cache.lookup_census_rows(census_file, list(padded_dot_numbers), columns,
+                                                                  CENSUS_CACHE_DIR).items():
+        street = ' '.join(row['PHY_STREET'].split())
+        company = {
+            'Legal Name': row['LEGAL_NAME'] or 'N/A',
+            'DBA Name': row['DBA_NAME'],
+            'Phone': row['TELEPHONE'],
+            # Same two-line layout as the SAFER snapshot so extract_city_state can parse it.
+            'Physical Address': f"{street}\n{row['PHY_CITY']}, {row['PHY_STATE']} {row['PHY_ZIP']}"
+        }
+        for dot_number in padded_dot_numbers[census_dot_number]:
+            companies[dot_number] = company
+    return companies
+
+def is_snapshot_page(page):
+    """True for a SAFER snapshot or its "record not found" reply, the only pages worth caching."""
+    return SNAPSHOT_NOT_FOUND_MARKER in page or any(field_label in page for _, field_label in SNAPSHOT_FIELDS)
+
+def get_cached_page(url):
+    return scrape_cache.get_cached_page(_scrape_cache, SCRAPE_CACHE_FILE, url, SCRAPE_CACHE_TTLS, SCRAPE_CACHE_DEFAULT_TTL)
+
+def cache_page(url, content, fetched_at=None):
+    """Store a SAFER page in the cache, unless is_snapshot_page turns it down."""
+    return scrape_cache.cache_page(_scrape_cache, SCRAPE_CACHE_FILE, url, content, SCRAPE_CACHE_MAX_BYTES,
+                                   is_snapshot_page, fetched_at)
+
+def scrape_cache_summary():
+    return scrape_cache.scrape_cache_summary(_scrape_cache)
+
+def wait_for_scrape_slot():
+    """Space SAFER requests from all workers to SCRAPE_REQUESTS_PER_MINUTE, with a little jitter."""
+    interval = 60.0 / SCRAPE_REQUESTS_PER_MINUTE
+    with _scrape_state['lock']:
+        now = time.monotonic()
+        slot = max(now, _scrape_state['next_slot'])
+        _scrape_state['next_slot'] = slot + interval * random.uniform(0.75, 1.25)
+    if slot > now:
+        time.sleep(slot - now)
+
+def get_scrape_session():
+    # One keep-alive session per worker thread; requests.Session is not safe to share.
+    sessions = _scrape_state['sessions']
+    if not hasattr(sessions, 'session'):
+        sessions.session = requests.Session()
+        sessions.session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    return sessions.session
+
+def extract_snapshot_fields(page, engine=None):
+    """Pull SNAPSHOT_FIELDS out of a SAFER snapshot page; missing fields are "N/A"."""
+    extracted_data = {}
+    if (engine or HTML_ENGINE) == 'lxml' and lxml_html is not None and page.strip():
+        # One walk over the th cells, matching each against every label.
+        labels = {field_label: field_name for field_name, field_label in SNAPSHOT_FIELDS}
+        for th in TABLE_HEADERS(lxml_html.fromstring(page)):
+            field_name = labels.get(th.text_content().strip())
+            if field_name and field_name not in extracted_data:
+                td = next(th.itersiblings('td'), None)
+                if td is not None:
+                    extracted_data[field_name] = td.text_content().strip()
+    else:
+        soup = BeautifulSoup(page, 'html.parser')
+        for field_name, field_label in SNAPSHOT_FIELDS:
+            try:
+                extracted_data[field_name] = soup.find('th', string=field_label).find_next_sibling('td').text.strip()
+            except AttributeError:
+                pass
+    return {field_name: extracted_data.get(field_name, "N/A") for field_name, _ in SNAPSHOT_FIELDS}
+
 def extract_company_data(usdot, max_retries=3):
     url = f"https://safer.fmcsa.dot.gov/query.asp?searchtype=ANY&query_type=queryCarrierSnapshot&query_param=USDOT&query_string={usdot}"
     
     extracted_data = {}
-    fields_to_extract = [
-        ('Legal Name', 'Legal Name:'),
-        ('DBA Name', 'DBA Name:'),
-        ('Phone', 'Phone:'),
-        ('Physical Address', 'Physical Address:')
-    ]
-
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
 
     for retry in range(max_retries):
         try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()  # Raise an exception for bad status codes
+            page = get_cached_page(url)
+            if page is None:
+                wait_for_scrape_slot()
+                response = get_scrape_session().get(url, timeout=SCRAPE_TIMEOUT)
+                response.raise_for_status()  # Raise an exception for bad status codes
+                page = response.text
+                cache_page(url, page)
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            for field_name, field_label in fields_to_extract:
-                try:
-                    value = soup.find('th', string=field_label).find_next_sibling('td').text.strip()
-                    extracted_data[field_name] = value
-                    if field_name == 'Legal Name':
-                        print(f"        Legal Name: {value}   ( {usdot} )")
-                except AttributeError:
-                    # print(f"  Error extracting {field_name}: Field not found")
-                    extracted_data[field_name] = "N/A"
+            extracted_data = extract_snapshot_fields(page)
+            if extracted_data['Legal Name'] != "N/A":
+                print(f"        Legal Name: {extracted_data['Legal Name']}   ( {usdot} )")
             
             # If we've successfully extracted all data, break the retry loop
             break  # Remove the condition and always break after a successful extraction
         except requests.RequestException as e:
-            print(f"  Error during extraction attempt {retry + 1}: {e}")
+            print(f"  Error during extraction attempt {retry + 1} for USDOT {usdot}: {e}")
             if retry == max_retries - 1:
                 print(f"  Failed to extract data for USDOT {usdot} after {max_retries} attempts")
-                for field_name, _ in fields_to_extract:
+                for field_name, _ in SNAPSHOT_FIELDS:
                     if field_name not in extracted_data:
                         extracted_data[field_name] = "N/A"
             else:
-                print(f"  Retrying in 5 seconds...")
-                time.sleep(5)
+                delay = random.uniform(0, SCRAPE_RETRY_BASE * 2 ** retry)
+                print(f"  Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
 
     return extracted_data
 
+def fetch_companies(dot_numbers):
+    """Scrape SAFER snapshots for dot_numbers concurrently; returns {dot_number: company_data}."""
+    companies = {}
+    with ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as executor:
+        with tqdm(total=len(dot_numbers), desc="Scraping SAFER", unit="company") as pbar:
+            for dot_number, company_data in zip(dot_numbers, executor.map(extract_company_data, dot_numbers)):
+                companies[dot_number] = company_data
+                pbar.update(1)
+    return companies
+
 def format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descriptions, headers):
     requests = [
         {
@@ -405,18 +538,31 @@ def format_sheet(service, spreadsheet_id, sheet_id, num_columns, column_descript
     }
     for attempt in range(MAX_RETRIES):
         try:
+            wait_for_quota()
             service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
             break
         except HttpError as error:
             if attempt == MAX_RETRIES - 1:
                 raise
-            time.sleep(2 ** attempt)  # Exponential backoff
+            if error.resp.status == 429:
+                note_rate_limited(error)  # The shared limiter waits out Retry-After
+            else:
+                time.sleep(2 ** attempt)  # Exponential backoff
         except TimeoutError:
             if attempt == MAX_RETRIES - 1:
                 raise
             print(f"Timed out during formatting. Retrying attempt {attempt}")
             time.sleep(5)  # Wait 5 seconds before retrying on timeout
 
+def wait_for_quota():
+    """Block until one more Sheets API call fits the quotas; see sheets_quota.wait_for_quota."""
+    sheets_quota.wait_for_quota(_rate_limiter, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT), SHEETS_BURST,
+                                RATE_LIMIT_RECOVERY_SECONDS)
+
+def note_rate_limited(error):
+    sheets_quota.note_rate_limited(_rate_limiter, error, min(SHEETS_QUOTA_PER_USER, SHEETS_QUOTA_PER_PROJECT),
+                                   RATE_LIMIT_FLOOR, RATE_LIMIT_DEFAULT_PAUSE)
+
 def process_csv(revocations_file, service, spreadsheet_id):
     progress = load_progress()
     sheet_counter = progress['sheet_counter'] if progress else 1
@@ -433,13 +579,6 @@ def process_csv(revocations_file, service, spreadsheet_id):
     column_descriptions = read_column_descriptions(README_FILE, encoding)
     cities = read_cities(CITIES_FILE)
 
-    # Set up Chrome options
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-
-    # Set up WebDriver
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
-
     print("Reading and processing data...")
     company_revocations = defaultdict(list)
 
@@ -473,6 +612,20 @@ def process_csv(revocations_file, service, spreadsheet_id):
     processed_companies = 0
     total_companies = len(company_revocations)
 
+    census_companies = {}
+    if USE_CENSUS_INDEX and os.path.exists(CENSUS_FILE):
+        census_companies = read_census_companies(CENSUS_FILE, list(company_revocations.keys()))
+        print(f"Found {len(census_companies)} of {total_companies} companies in the census; scraping SAFER for the rest.")
+
+    missing_dot_numbers = [dot_number for dot_number in company_revocations if dot_number not in census_companies]
+    scraped_companies = len(missing_dot_numbers)
+    if missing_dot_numbers:
+        minutes = scraped_companies / SCRAPE_REQUESTS_PER_MINUTE
+        print(f"Scraping {scraped_companies} companies from SAFER (about {minutes:.0f} minutes at {SCRAPE_REQUESTS_PER_MINUTE} requests/minute)...")
+    companies = {**census_companies, **fetch_companies(missing_dot_numbers)}
+    if missing_dot_numbers:
+        print(scrape_cache_summary())
+
     filtered_companies = {}
 
     # Create a progress bar
@@ -483,13 +636,8 @@ def process_csv(revocations_file, service, spreadsheet_id):
             # Increment the counter for this DOT number
             extraction_counter[dot_number] = extraction_counter.get(dot_number, 0) + 1
             
-            company_data = extract_company_data(dot_number)
-
+            company_data = companies[dot_number]
             processed_companies += 1
-            time.sleep(random.uniform(1, 3))
-            if processed_companies % 100 == 0:
-                print("Waiting one minute to avoid bot detector")
-                time.sleep(100)
 
             if company_data.get('Legal Name') == 'N/A':
                 # print(f"      *** Skipping not-located usdot : {dot_number}")
@@ -576,7 +724,6 @@ def process_csv(revocations_file, service, spreadsheet_id):
                     row_counter = 0
                     current_sheet_data = [new_headers]
                     save_progress(processed_count, sheet_counter, row_counter)
-                    time.sleep(2)  # Add a delay between sheets
                 except Exception as e:
                     error_count += 1
                     print(f"Error creating/writing sheet: {str(e)}")
@@ -624,8 +771,6 @@ def process_csv(revocations_file, service, spreadsheet_id):
         os.remove(PROGRESS_FILE)
         print("Progress file removed after successful completion.")
 
-    driver.quit()
-
 
 if __name__ == "__main__":
     service = get_google_sheets_service()
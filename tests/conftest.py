@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+from run_offline import load_module
+
+@pytest.fixture
+def load_script(tmp_path, monkeypatch):
+    """Import a pipeline script (by its run_offline name) with tmp_path as the working directory."""
+    monkeypatch.chdir(tmp_path)
+
+    def load(name):
+        return load_module(name, str(tmp_path))
+    return load
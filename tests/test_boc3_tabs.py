@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+def filer_rows(sizes):
+    # One row per agent, as [COMPANY_NAME, row number within the filer]; names sort in list order.
+    return [[f'FILER {i:03d}', str(n)] for i, size in enumerate(sizes) for n in range(size)]
+
+def tab_filers(tabs):
+    return [sorted({row[0] for row in tab}) for tab in tabs]
+
+@pytest.fixture
+def boc3(load_script):
+    return load_script('boc3')
+
+def test_next_fit_keeps_filers_together(boc3):
+    tabs = list(boc3.pack_filer_tabs(iter(filer_rows([3, 5, 2, 4, 1])), 0, 7))
+
+    assert [len(tab) for tab in tabs] == [3, 7, 5]
+    assert tab_filers(tabs) == [['FILER 000'], ['FILER 001', 'FILER 002'], ['FILER 003', 'FILER 004']]
+
+def test_only_oversized_filers_are_split(boc3):
+    rows = filer_rows([2, 12, 3])
+    tabs = list(boc3.pack_filer_tabs(iter(rows), 0, 5))
+
+    # The tab in progress is closed first; the oversized filer's last rows start the next tab.
+    assert [len(tab) for tab in tabs] == [2, 5, 5, 5]
+    assert tab_filers(tabs) == [['FILER 000'], ['FILER 001'], ['FILER 001'], ['FILER 001', 'FILER 002']]
+    assert [row for tab in tabs for row in tab] == rows
+
+@pytest.mark.parametrize('seed', range(5))
+def test_every_row_once_in_order_within_the_limit(boc3, seed):
+    rng = random.Random(seed)
+    max_rows = rng.randint(1, 20)
+    rows = filer_rows([rng.randint(1, 30) for _ in range(200)])
+    tabs = list(boc3.pack_filer_tabs(iter(rows), 0, max_rows))
+
+    assert [row for tab in tabs for row in tab] == rows
+    assert all(0 < len(tab) <= max_rows for tab in tabs)
+    for tab, next_tab in zip(tabs, tabs[1:]):
+        # A filer only continues onto the next tab when it filled this one on its own.
+        if tab[-1][0] == next_tab[0][0]:
+            assert len(tab) == max_rows and tab_filers([tab]) == [[tab[-1][0]]]
+        else:
+            # Next fit: the tab was only closed because the next filer would not have fitted.
+            next_filer = sum(1 for row in rows if row[0] == next_tab[0][0])
+            assert len(tab) + next_filer > max_rows
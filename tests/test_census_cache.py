@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from fmcsa_common import census_cache
+
+CACHE_SCRIPTS = ['direct', 'crashes', 'inspections']
+
+CENSUS_CSV = (
+    'DOT_NUMBER,LEGAL_NAME,TELEPHONE,EMAIL_ADDRESS\n'
+    + ''.join(f'{1000 + i},CARRIER {i},(512) 555-{i:04d},c{i}@example.com\n' for i in range(200))
+)
+
+def cache_files(module, census_file):
+    return sorted(os.listdir(os.path.join(os.path.dirname(census_file), module.CENSUS_CACHE_DIR)))
+
+def build_caches(module, census_file):
+    """Build every cache file the script keeps for a census release, and return their names."""
+    paths = [module.ensure_census_cache(census_file)]
+    if hasattr(module, 'ensure_sorted_census'):
+        paths += [census_cache.ensure_census_index(census_file, module.CENSUS_CACHE_DIR), module.ensure_sorted_census(census_file)]
+    return sorted(os.path.basename(path) for path in paths)
+
+@pytest.mark.parametrize('name', CACHE_SCRIPTS)
+def test_rebuild_removes_other_fingerprints_of_the_release(load_script, tmp_path, name):
+    module = load_script(name)
+    census_file = str(tmp_path / 'FMCSA_CENSUS1_2024Jun.txt')
+    other_release = str(tmp_path / 'FMCSA_CENSUS1_2024May.txt')
+    for path in (census_file, other_release):
+        with open(path, 'w') as f:
+            f.write(CENSUS_CSV)
+    other_files = build_caches(module, other_release)
+    build_caches(module, census_file)
+
+    # The same release downloaded again, with a correction.
+    with open(census_file, 'w') as f:
+        f.write(CENSUS_CSV.replace('CARRIER 7,', 'CARRIER SEVEN,'))
+    current_files = build_caches(module, census_file)
+
+    assert cache_files(module, census_file) == sorted(current_files + other_files)
+
+@pytest.mark.parametrize('name', CACHE_SCRIPTS)
+def test_failed_build_leaves_no_partial_cache(load_script, monkeypatch, tmp_path, name):
+    module = load_script(name)
+    monkeypatch.setattr(module, 'PARSE_WORKERS', 1)
+    monkeypatch.setattr(module, 'PARSE_BLOCK_BYTES', 1000)
+    census_file = str(tmp_path / 'FMCSA_CENSUS1_2024Jun.txt')
+    with open(census_file, 'w') as f:
+        f.write(CENSUS_CSV)
+    census_block_table = census_cache.census_block_table
+    blocks = []
+
+    def failing(*args, **kwargs):
+        blocks.append(1)
+        if len(blocks) == 3:
+            raise OSError('No space left on device')
+        return census_block_table(*args, **kwargs)
+    monkeypatch.setattr(census_cache, 'census_block_table', failing)
+
+    with pytest.raises(OSError):
+        module.load_census_columns(census_file)
+    assert cache_files(module, census_file) == []
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from fmcsa_common import census_cache
+
+# A stray quote in an unquoted value, a quoted field spanning lines, a duplicated DOT number and
+# a zero-padded one. Census columns beyond these aren't needed by the lookups.
+CENSUS_CSV = (
+    'DOT_NUMBER,LEGAL_NAME,TELEPHONE,EMAIL_ADDRESS\n'
+    '1001,12" TRAILER LLC,(512) 555-0001,a@example.com\n'
+    '1002,"MULTI\n'
+    '1009,NOT A ROW",(512) 555-0002,\n'
+    '1003,FIRST LISTING,(512) 555-0003,b@example.com\n'
+    '0123,PADDED,(512) 555-0004,\n'
+    '1004,"QUOTED ""NAME""",(512) 555-0005,c@example.com\n'
+    '1003,SECOND LISTING,(512) 555-0006,d@example.com\n'
+)
+COLUMNS = ['LEGAL_NAME', 'TELEPHONE', 'EMAIL_ADDRESS']
+CACHE_DIR = 'census_cache'
+
+@pytest.fixture
+def census_file(tmp_path):
+    path = tmp_path / 'FMCSA_CENSUS1_2024Jun.txt'
+    path.write_bytes(CENSUS_CSV.encode('utf-8'))
+    return str(path)
+
+def test_lookup_matches_census_dict(census_file):
+    census_data = census_cache.read_census_data(census_file, None, max_lookups=0, cache_dir=CACHE_DIR, chunk_rows=1000,
+                                                workers=1, block_bytes=2**20)
+    dot_numbers = ['1001', '1002', '1003', '1004', '1009', '0123', '123', '01001', '9999']
+
+    found = census_cache.lookup_census_rows(census_file, dot_numbers, COLUMNS, CACHE_DIR)
+
+    assert found == {dot_number: census_data[dot_number] for dot_number in dot_numbers if dot_number in census_data}
+    assert found['1003']['LEGAL_NAME'] == 'SECOND LISTING'
+    assert found['1002']['LEGAL_NAME'] == 'MULTI\n1009,NOT A ROW'
+    assert '123' not in found and '1009' not in found
+
+@pytest.mark.parametrize('name', ['crashes', 'inspections'])
+def test_scripts_switch_to_the_index_for_few_carriers(load_script, monkeypatch, census_file, name):
+    module = load_script(name)
+    monkeypatch.setattr(module, 'CENSUS_INDEX_MAX_LOOKUPS', 2)
+    parquet_path = census_cache.census_cache_path(census_file, module.CENSUS_CACHE_DIR)
+
+    assert module.read_census_data(census_file, ['1003', '1004']) == census_cache.lookup_census_rows(
+        census_file, ['1003', '1004'], COLUMNS, module.CENSUS_CACHE_DIR)
+    assert not os.path.exists(parquet_path)
+    assert set(module.read_census_data(census_file, ['1003', '1004', '0123'])) == {'1001', '1002', '1003', '0123', '1004'}
+    assert os.path.exists(parquet_path)
+
+def test_revocation_lookup_strips_padding(load_script, tmp_path):
+    module = load_script('revocations')
+    census_file = tmp_path / 'FMCSA_CENSUS1_2024Jun.txt'
+    census_file.write_text(
+        'DOT_NUMBER,LEGAL_NAME,DBA_NAME,TELEPHONE,PHY_STREET,PHY_CITY,PHY_STATE,PHY_ZIP\n'
+        '1001,FIRST LISTING,,(512) 555-0001,1 MAIN ST,AUSTIN,TX,78701\n'
+        '1002,OTHER,,(512) 555-0002,2 MAIN ST,AUSTIN,TX,78701\n'
+        '0123,PADDED,,(512) 555-0003,3 MAIN ST,AUSTIN,TX,78701\n'
+        '1001,SECOND LISTING,DBA,(512) 555-0004,4  MAIN ST,DALLAS,TX,75201\n')
+
+    found = module.read_census_companies(str(census_file), ['00001001', '001001', '00000123', '00009999', 'N/A'])
+
+    assert found == {dot_number: {'Legal Name': 'SECOND LISTING', 'DBA Name': 'DBA', 'Phone': '(512) 555-0004',
+                                  'Physical Address': '4 MAIN ST\nDALLAS, TX 75201'}
+                     for dot_number in ['00001001', '001001']}
+
+def test_revocations_leave_snapshots_alone_by_default(load_script):
+    assert load_script('revocations').USE_CENSUS_INDEX is False
+
+def test_index_from_older_version_is_rebuilt(census_file):
+    index_path = census_cache.census_index_path(census_file, CACHE_DIR)
+    census_cache.ensure_census_index(census_file, CACHE_DIR)
+    with open(index_path, 'r+b') as index_file:
+        index_file.write(b'DOTIDX1\n')
+
+    assert census_cache.lookup_census_rows(census_file, ['1004'], ['LEGAL_NAME'], CACHE_DIR) == {'1004': {'LEGAL_NAME': 'QUOTED "NAME"'}}
+    with open(index_path, 'rb') as index_file:
+        assert index_file.read(len(census_cache.CENSUS_INDEX_MAGIC)) == census_cache.CENSUS_INDEX_MAGIC
@@ -0,0 +1,35 @@
+import random
+
+from fmcsa_common import census_cache
+
+def test_dot_number_set_matches_a_set_of_strings():
+    rng = random.Random(0)
+    dot_numbers = [str(rng.randint(1, 4 * 10**6)) for _ in range(2000)] + ['0', '0123', ' 77', 'ABC', '9' * 25]
+    members = set(dot_numbers[::2]) | {'0', '0123', '9' * 25}
+    dot_number_set = census_cache.DotNumberSet(members)
+
+    assert len(dot_number_set) == len(members)
+    for dot_number in dot_numbers + ['123', '77', '', '00', '1.5']:
+        assert (dot_number in dot_number_set) == (dot_number in members), dot_number
+
+def test_emailed_dot_numbers_follow_the_last_census_row():
+    census = [
+        ('100', {'EMAIL_ADDRESS': 'a@example.com'}),
+        ('100', {'EMAIL_ADDRESS': ''}),  # The last row of a repeated DOT number decides
+        ('200', {'EMAIL_ADDRESS': ''}),
+        ('200', {'EMAIL_ADDRESS': 'b@example.com'}),
+        ('300', {'EMAIL_ADDRESS': ''}),
+        ('0400', {'EMAIL_ADDRESS': 'c@example.com'}),
+        ('500', {'EMAIL_ADDRESS': 'd@example.com'}),
+    ]
+    emailed = census_cache.emailed_dot_numbers(iter(census))
+
+    assert [dot_number for dot_number in ['100', '200', '300', '0400', '400', '500'] if dot_number in emailed] == ['200', '0400', '500']
+
+def test_merge_join_matches_lookup():
+    census = [('100', {'LEGAL_NAME': 'A'}), ('100', {'LEGAL_NAME': 'A2'}), ('300', {'LEGAL_NAME': 'C'}), ('400', {'LEGAL_NAME': 'D'})]
+    rows = [['050'], ['100'], ['100'], ['200'], ['400'], ['500']]
+    joined = census_cache.census_merge_join(rows, lambda row: row[0], iter(census))
+
+    assert [(row[0], info.get('LEGAL_NAME', '')) for row, info in joined] == [
+        ('050', ''), ('100', 'A2'), ('100', 'A2'), ('200', ''), ('400', 'D'), ('500', '')]
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+@pytest.fixture
+def direct(load_script):
+    return load_script('direct')
+
+def save_release(module, census_file, release, dot_numbers):
+    module.save_row_hashes(module.row_hash_path(census_file, release), {dot_number: 0 for dot_number in dot_numbers})
+
+@pytest.mark.parametrize('current, expected', [
+    ('FMCSA_CENSUS1_2024Oct', 'FMCSA_CENSUS1_2024Sep'),
+    ('FMCSA_CENSUS1_2025Jan', 'FMCSA_CENSUS1_2024Nov'),
+    ('FMCSA_CENSUS1_2024Aug', None),
+])
+def test_previous_release_goes_by_month(direct, tmp_path, current, expected):
+    census_file = str(tmp_path / f'{current}.txt')
+    for number, release in enumerate(['FMCSA_CENSUS1_2024Nov', 'FMCSA_CENSUS1_2024Sep', 'FMCSA_CENSUS1_2024Oct']):
+        save_release(direct, census_file, release, [number])
+    # Written last, as when an older month is re-run; it must not count as the newest.
+    os.utime(direct.row_hash_path(census_file, 'FMCSA_CENSUS1_2024Sep'), (4e9, 4e9))
+
+    release, row_hashes = direct.previous_row_hashes(census_file)
+
+    assert release == expected
+    if expected is not None:
+        assert list(row_hashes[0]) == [{'FMCSA_CENSUS1_2024Nov': 0, 'FMCSA_CENSUS1_2024Sep': 1}[expected]]
+
+def test_undated_releases_need_previous_release(direct, monkeypatch, tmp_path):
+    census_file = str(tmp_path / 'census_latest.txt')
+    save_release(direct, census_file, 'census_first', [1])
+    assert direct.previous_row_hashes(census_file)[0] == 'census_first'  # The only candidate
+
+    save_release(direct, census_file, 'census_second', [2])
+    with pytest.raises(ValueError, match='DELTA_PREVIOUS_RELEASE'):
+        direct.previous_row_hashes(census_file)
+
+    monkeypatch.setattr(direct, 'DELTA_PREVIOUS_RELEASE', 'census_first')
+    release, row_hashes = direct.previous_row_hashes(census_file)
+    assert release == 'census_first' and list(row_hashes[0]) == [1]
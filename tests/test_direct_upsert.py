@@ -0,0 +1,220 @@
+import csv
+import os
+import random
+import shutil
+import sqlite3
+
+import pytest
+
+from fake_sheets import FakeSheetsService
+import synthetic_data
+from fmcsa_common import sheets_quota
+
+SPREADSHEET_ID = 'upsert-test'
+CARRIERS = 1500
+
+class InterruptingSheetsService(FakeSheetsService):
+    """Raises KeyboardInterrupt in place of the values.batchUpdate after batches_left more go through."""
+
+    def __init__(self, **kwargs):
+        super().__init__(serialize=False, **kwargs)
+        self.batches_left = None
+
+    def values_batch_update(self, spreadsheetId, body):
+        if self.batches_left is not None:
+            if self.batches_left == 0:
+                raise KeyboardInterrupt('simulated interruption')
+            self.batches_left -= 1
+        return super().values_batch_update(spreadsheetId, body)
+
+def write_census(path, rows):
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
+        writer.writerow(synthetic_data.CENSUS_HEADERS)
+        writer.writerows(rows)
+
+def read_census(path):
+    with open(path, newline='') as csvfile:
+        return list(csv.reader(csvfile))[1:]
+
+@pytest.fixture
+def direct(load_script, monkeypatch, tmp_path):
+    """The census script, run from a small synthetic tree of two releases where most carriers pass the filters."""
+    module = load_script('direct')
+    work_dir = tmp_path / 'census_and_safety'
+    work_dir.mkdir()
+    monkeypatch.chdir(work_dir)
+    rng = random.Random(0)
+    texas = os.path.join(synthetic_data.REPO_DIR, 'census_and_safety', 'cities', 'texas_cities.txt')
+    with open(texas) as f:
+        city_pool = [(city.strip().upper(), 'TX') for city, _ in (line.rsplit(',', 1) for line in f if ',' in line)]
+    shutil.copyfile(texas, module.CITIES_FILE)
+    shutil.copyfile(os.path.join(synthetic_data.REPO_DIR, 'census_and_safety', 'exclude_columns.txt'), module.EXCLUDE_FILE)
+    for path in (module.CENSUS_FILE, module.README_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    dot_numbers = synthetic_data.census_dot_numbers(CARRIERS, rng)
+    synthetic_data.write_census_file('october.txt', dot_numbers, rng, city_pool)
+    october = read_census('october.txt')
+    dot_index = synthetic_data.CENSUS_HEADERS.index('DOT_NUMBER')
+    phone_index = synthetic_data.CENSUS_HEADERS.index('TELEPHONE')
+    # One DOT number listed twice, for two different carriers.
+    duplicate = next(row for row in october if row[synthetic_data.CENSUS_HEADERS.index('EMAIL_ADDRESS')])
+    october.append(duplicate[:phone_index] + ['(512) 555-0100'] + duplicate[phone_index + 1:])
+
+    november = []
+    for row in october:
+        if rng.random() < 0.03:
+            continue  # Left the census
+        if row[dot_index] == duplicate[dot_index] or rng.random() < 0.05:
+            row = row[:phone_index] + [f"(737) 555-{rng.randint(0, 9999):04d}"] + row[phone_index + 1:]
+        november.append(row)
+    new_dot_numbers = [dot_numbers[-1] + 10 * i for i in range(1, 121)]
+    synthetic_data.write_census_file('new_carriers.txt', new_dot_numbers, rng, city_pool)
+    november.extend(read_census('new_carriers.txt'))
+    write_census(october_file(module), october)
+    write_census(module.CENSUS_FILE, november)
+
+    synthetic_data.write_safety_file(module.SAFETY_FILE_AB, synthetic_data.AB_HEADERS, dot_numbers[::3], rng)
+    synthetic_data.write_safety_file(module.SAFETY_FILE_C, synthetic_data.C_HEADERS, dot_numbers[::7], rng)
+    synthetic_data.write_readme(module.README_FILE, synthetic_data.CENSUS_HEADERS)
+    synthetic_data.write_readme(module.SAFETY_README_FILE, synthetic_data.AB_HEADERS + synthetic_data.C_HEADERS)
+
+    for constant, value in {'UPSERT_MODE': True, 'USE_CENSUS_CACHE': False, 'PARSE_WORKERS': 1, 'BATCH_SIZE': 10,
+                            'SHEETS_QUOTA_PER_USER': 10**9, 'SHEETS_QUOTA_PER_PROJECT': 10**9, 'SHEETS_BURST': 10**9,
+                            'CENSUS_CACHE_DIR': str(tmp_path / 'census_cache')}.items():
+        monkeypatch.setattr(module, constant, value)
+    sheets_quota.reset_rate_limiter(module._rate_limiter, 10**9, 10**9)
+    return module
+
+def october_file(module):
+    return os.path.join(os.path.dirname(module.CENSUS_FILE), 'FMCSA_CENSUS1_2024Oct.txt')
+
+def run(module, service, census_file):
+    module.process_csv(census_file, module.SAFETY_FILE_AB, module.SAFETY_FILE_C, service, SPREADSHEET_ID,
+                       service_factory=lambda: service)
+
+def sheet_rows(service):
+    """Every non-blank row under the headers, across tabs, sorted."""
+    rows = []
+    for title in service.sheets[SPREADSHEET_ID]:
+        rows.extend(tuple(row) for row in service.sheet_values(SPREADSHEET_ID, title)[1:] if any(row))
+    return sorted(rows)
+
+def assert_map_matches_sheet(module, service):
+    """Every mapped row holds its carrier, and every blank row before a tab's end is free for reuse."""
+    db = sqlite3.connect(os.path.join(module.SHEET_ROW_MAP_DIR, f"{SPREADSHEET_ID}.sqlite"))
+    free_rows = set(db.execute("SELECT tab, row FROM free_rows"))
+    mapped = {(tab, row): dot_number for dot_number, tab, row in db.execute("SELECT dot_number, tab, row FROM rows")}
+    for title, next_row, grid_rows in db.execute("SELECT title, next_row, grid_rows FROM tabs"):
+        values = service.sheet_values(SPREADSHEET_ID, title)
+        assert len(values) < next_row <= grid_rows + 1
+        assert service.sheets[SPREADSHEET_ID][title]['properties']['gridProperties']['rowCount'] == grid_rows
+        for row in range(2, next_row):
+            cells = values[row - 1] if row <= len(values) else []
+            if any(cells):
+                assert mapped[(title, row)] == cells[0]
+            else:
+                assert (title, row) in free_rows
+    db.close()
+
+@pytest.mark.parametrize('rows_per_sheet', [150, 10000])
+def test_upsert_matches_full_write(direct, monkeypatch, rows_per_sheet):
+    # With 10000 rows per tab the one tab is created just big enough, so new carriers have to grow its grid.
+    monkeypatch.setattr(direct, 'ROWS_PER_SHEET', rows_per_sheet)
+    service = FakeSheetsService(serialize=False)
+    run(direct, service, october_file(direct))
+    grid = service.sheets[SPREADSHEET_ID]['Merged_Data_1']['properties']['gridProperties']
+    first_tab_rows = grid['rowCount']
+    run(direct, service, direct.CENSUS_FILE)
+    assert_map_matches_sheet(direct, service)
+    if rows_per_sheet > first_tab_rows:
+        assert grid['rowCount'] > first_tab_rows
+    calls = len(service.calls)
+    run(direct, service, direct.CENSUS_FILE)
+    assert len(service.calls) == calls  # Nothing changed, nothing written
+
+    expected = FakeSheetsService(serialize=False)
+    monkeypatch.setattr(direct, 'UPSERT_MODE', False)
+    run(direct, expected, direct.CENSUS_FILE)
+    assert sheet_rows(service) == sheet_rows(expected)
+
+def test_duplicate_dot_numbers_keep_their_own_rows(direct):
+    service = FakeSheetsService(serialize=False)
+    run(direct, service, october_file(direct))
+    run(direct, service, direct.CENSUS_FILE)
+
+    phone_column = service.sheet_values(SPREADSHEET_ID, 'Merged_Data_1')[0].index('TELEPHONE')
+    counts = {}
+    for row in sheet_rows(service):
+        counts[row[0]] = counts.get(row[0], 0) + 1
+    duplicated = [dot_number for dot_number, count in counts.items() if count > 1]
+    assert len(duplicated) == 1
+    phones = [row[phone_column] for row in sheet_rows(service) if row[0] == duplicated[0]]
+    assert len(phones) == 2 and all(phone.startswith('(737)') for phone in phones)
+
+@pytest.mark.parametrize('batches', [0, 3, 7])
+def test_interrupted_upsert_resumes(direct, monkeypatch, batches):
+    monkeypatch.setattr(direct, 'ROWS_PER_SHEET', 150)
+    service = InterruptingSheetsService()
+    run(direct, service, october_file(direct))
+    service.batches_left = batches
+    with pytest.raises(KeyboardInterrupt):
+        run(direct, service, direct.CENSUS_FILE)
+    assert_map_matches_sheet(direct, service)
+    service.batches_left = None
+    run(direct, service, direct.CENSUS_FILE)
+    assert_map_matches_sheet(direct, service)
+
+    expected = FakeSheetsService(serialize=False)
+    monkeypatch.setattr(direct, 'UPSERT_MODE', False)
+    run(direct, expected, direct.CENSUS_FILE)
+    assert sheet_rows(service) == sheet_rows(expected)
+
+def test_fake_rejects_writes_past_the_grid():
+    service = FakeSheetsService(serialize=False)
+    body = {'requests': [{'addSheet': {'properties': {'title': 'Tab_1', 'gridProperties': {'rowCount': 2, 'columnCount': 2}}}}]}
+    sheet_id = service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body).execute()['replies'][0]['addSheet']['properties']['sheetId']
+    values = service.spreadsheets().values()
+    values.update(spreadsheetId=SPREADSHEET_ID, range='Tab_1!A2', body={'values': [['a', 'b']]}).execute()
+    with pytest.raises(Exception, match='exceeds grid limits'):
+        values.update(spreadsheetId=SPREADSHEET_ID, range='Tab_1!A3', body={'values': [['a', 'b']]}).execute()
+
+    body = {'requests': [{'appendDimension': {'sheetId': sheet_id, 'dimension': 'ROWS', 'length': 1}}]}
+    service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body=body).execute()
+    values.update(spreadsheetId=SPREADSHEET_ID, range='Tab_1!A3', body={'values': [['a', 'b']]}).execute()
+    assert service.sheet_values(SPREADSHEET_ID, 'Tab_1')[1:] == [['a', 'b'], ['a', 'b']]
+
+@pytest.mark.parametrize('delta_mode, upsert_mode', [(False, False), (True, False), (False, True)])
+def test_row_hashes_are_saved_for_delta_and_upsert_runs(direct, monkeypatch, delta_mode, upsert_mode):
+    monkeypatch.setattr(direct, 'DELTA_MODE', delta_mode)
+    monkeypatch.setattr(direct, 'UPSERT_MODE', upsert_mode)
+    run(direct, FakeSheetsService(serialize=False), direct.CENSUS_FILE)
+    assert os.path.exists(direct.row_hash_path(direct.CENSUS_FILE)) == (delta_mode or upsert_mode)
+
+def test_non_numeric_dot_numbers_are_mapped(direct, monkeypatch):
+    monkeypatch.setattr(direct, 'ROWS_PER_SHEET', 150)
+    email_index = synthetic_data.CENSUS_HEADERS.index('EMAIL_ADDRESS')
+    dot_index = synthetic_data.CENSUS_HEADERS.index('DOT_NUMBER')
+    for census_file in (october_file(direct), direct.CENSUS_FILE):
+        rows = read_census(census_file)
+        template = next(row for row in rows if row[email_index])
+        rows.append(template[:dot_index] + ['MX-4471'] + template[dot_index + 1:])
+        if census_file == direct.CENSUS_FILE:
+            rows[-1][email_index] = 'changed@example.com'
+        write_census(census_file, rows)
+
+    service = FakeSheetsService(serialize=False)
+    run(direct, service, october_file(direct))
+    db = sqlite3.connect(os.path.join(direct.SHEET_ROW_MAP_DIR, f"{SPREADSHEET_ID}.sqlite"))
+    assert db.execute("SELECT COUNT(*) FROM rows WHERE dot_number = 'MX-4471'").fetchone()[0] == 1
+    db.close()
+    run(direct, service, direct.CENSUS_FILE)
+    assert_map_matches_sheet(direct, service)
+
+    rows = [row for row in sheet_rows(service) if row[0] == 'MX-4471']
+    assert len(rows) == 1 and 'changed@example.com' in rows[0]
+    expected = FakeSheetsService(serialize=False)
+    monkeypatch.setattr(direct, 'UPSERT_MODE', False)
+    run(direct, expected, direct.CENSUS_FILE)
+    assert sheet_rows(service) == sheet_rows(expected)
@@ -0,0 +1,60 @@
+import pytest
+
+HEADERS = ['DOT_NUMBER', 'INSP_DATE', 'REPORT_STATE', 'UNIT_MAKE', 'VIN', 'BASIC_VIOL', 'HM_VIOL']
+ROWS = [
+    ['100', '01-JAN-24', 'TX', 'FORD', 'VIN1', '1', '2'],
+    ['200', '01/02/2024', 'TX', 'FORD', '', '0', '0'],
+    ['100', '02-JAN-24', 'TX', 'FORD', 'VIN2', '0', '1'],
+    ['100', '01-JAN-24', 'OK', 'MACK', 'VIN3', '5', '5'],  # Other reporting state
+    ['300', 'not a date', 'TX', 'MACK', 'VIN4', '5', '5'],
+    ['200', '02-Jan-24', 'TX', 'FORD', '', '3', '0'],
+]
+
+@pytest.fixture
+def inspections(load_script, monkeypatch):
+    module = load_script('inspections')
+    monkeypatch.setattr(module, '_emailed_dot_numbers', None)
+    return module
+
+def block(rows):
+    return ''.join(','.join(row) + '\r\n' for row in rows)
+
+def test_block_accumulates_distinct_values_per_carrier(inspections):
+    rows, partials = inspections.aggregate_inspection_block(block(ROWS), HEADERS)
+
+    assert rows == len(ROWS)
+    assert list(partials) == ['100', '200']
+    first, second = partials['100'], partials['200']
+    # The violation columns are in COLUMNS_TO_COMBINE as well, and have always counted twice.
+    assert first['TOTAL_VIOLATIONS'] == 2 * (1 + 2 + 0 + 1)
+    assert first['dates'] == {'01-Jan-24', '02-Jan-24'}
+    assert first['VIN'] == {'VIN1', 'VIN2'}
+    # One distinct value stays a plain string, and equal strings are shared between carriers.
+    assert first['UNIT_MAKE'] == 'FORD' and first['UNIT_MAKE'] is second['UNIT_MAKE']
+    # Both layouts of the same day end up as one label.
+    assert second['dates'] == '02-Jan-24' and second['BASIC_VIOL'] == {'0', '3'}
+    assert 'VIN' not in second
+    assert first['REPORT_STATE'] == second['REPORT_STATE'] == 'TX'
+
+def test_emailed_carriers_only(inspections):
+    inspections.set_emailed_dot_numbers({'200'})
+    assert list(inspections.aggregate_inspection_block(block(ROWS), HEADERS)[1]) == ['200']
+
+@pytest.mark.parametrize('split', range(len(ROWS) + 1))
+def test_merged_blocks_match_one_block(inspections, split):
+    expected = inspections.aggregate_inspection_block(block(ROWS), HEADERS)[1]
+    merged = {}
+    for rows in (ROWS[:split], ROWS[split:]):
+        inspections.merge_partials(merged, inspections.aggregate_inspection_block(block(rows), HEADERS)[1])
+    assert merged == expected
+    assert list(merged) == list(expected)
+
+@pytest.mark.parametrize('values, more, expected', [
+    ('a', 'a', 'a'),
+    ('a', 'b', {'a', 'b'}),
+    ('a', {'b', 'c'}, {'a', 'b', 'c'}),
+    ({'a', 'b'}, 'c', {'a', 'b', 'c'}),
+    ({'a'}, {'a', 'b'}, {'a', 'b'}),
+])
+def test_merge_distinct(inspections, values, more, expected):
+    assert inspections.merge_distinct(values, more) == expected
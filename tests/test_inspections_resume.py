@@ -0,0 +1,110 @@
+import os
+import random
+
+import pytest
+
+from fake_sheets import FakeSheetsService
+from run_offline import FAKE_SPREADSHEET_ID
+import synthetic_data
+from fmcsa_common import sheets_quota
+
+CARRIERS = 3000
+
+@pytest.fixture
+def inspections(load_script, monkeypatch, tmp_path):
+    """The inspections script, run from a small synthetic tree with a fast quota and small tabs."""
+    module = load_script('inspections')
+    work_dir = tmp_path / 'inspections_and_violations'
+    work_dir.mkdir()
+    monkeypatch.chdir(work_dir)
+    rng = random.Random(0)
+    dot_numbers = synthetic_data.census_dot_numbers(CARRIERS, rng)
+    for path in (module.CENSUS_FILE, module.INSPECTIONS_FILE, module.README_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    synthetic_data.write_census_file(module.CENSUS_FILE, dot_numbers, rng, synthetic_data.read_city_pool())
+    synthetic_data.write_inspections_file(module.INSPECTIONS_FILE, dot_numbers, CARRIERS * 4, rng)
+    synthetic_data.write_readme(module.README_FILE, synthetic_data.INSPECTION_HEADERS)
+    for constant, value in {'ROWS_PER_SHEET': 100, 'PARSE_BLOCK_BYTES': 50000, 'PARSE_WORKERS': 1,
+                            'SHEETS_QUOTA_PER_USER': 10**9, 'SHEETS_QUOTA_PER_PROJECT': 10**9, 'SHEETS_BURST': 10**9,
+                            'CENSUS_CACHE_DIR': str(tmp_path / 'census_cache')}.items():
+        monkeypatch.setattr(module, constant, value)
+    sheets_quota.reset_rate_limiter(module._rate_limiter, 10**9, 10**9)
+    return module
+
+def run(module, service):
+    module.process_csv(module.INSPECTIONS_FILE, module.CENSUS_FILE, service, FAKE_SPREADSHEET_ID)
+
+def written_rows(service):
+    """Rows across all tabs in tab order, with ADDITIONAL_INFO values sorted (distinct values are kept in sets)."""
+    tabs = service.sheets[FAKE_SPREADSHEET_ID]
+    titles = sorted(tabs, key=lambda title: int(title.rsplit('_', 1)[1]))
+    rows = []
+    for title in titles:
+        for row in service.sheet_values(FAKE_SPREADSHEET_ID, title)[1:]:
+            info = [line.partition(': ') for line in (row[6] + row[7]).split('\n')]
+            rows.append(row[:6] + [[(field, sorted(values.split(','))) for field, _, values in info]])
+    return rows
+
+def interrupt_after_tabs(monkeypatch, module, tabs):
+    create_new_sheet = module.create_new_sheet
+    created = []
+
+    def interrupting(*args, **kwargs):
+        if len(created) == tabs:
+            raise KeyboardInterrupt('simulated interruption')
+        created.append(args[2])
+        return create_new_sheet(*args, **kwargs)
+    monkeypatch.setattr(module, 'create_new_sheet', interrupting)
+    return lambda: monkeypatch.setattr(module, 'create_new_sheet', create_new_sheet)
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_resume_after_tabs_written(inspections, monkeypatch, workers):
+    monkeypatch.setattr(inspections, 'PARSE_WORKERS', workers)
+    expected = FakeSheetsService(serialize=False)
+    run(inspections, expected)
+    assert len(written_rows(expected)) > 3 * inspections.ROWS_PER_SHEET
+
+    service = FakeSheetsService(serialize=False)
+    restore = interrupt_after_tabs(monkeypatch, inspections, 2)
+    with pytest.raises(KeyboardInterrupt):
+        run(inspections, service)
+    restore()
+    run(inspections, service)
+
+    assert written_rows(service) == written_rows(expected)
+    assert not os.path.exists(inspections.CHECKPOINT_FILE)
+
+def test_changed_join_rewrites_from_first_tab(inspections, monkeypatch):
+    # Merge joins write carriers in DOT_NUMBER order, so tabs written by a lookup run don't cover the same carriers.
+    service = FakeSheetsService(serialize=False)
+    restore = interrupt_after_tabs(monkeypatch, inspections, 2)
+    with pytest.raises(KeyboardInterrupt):
+        run(inspections, service)
+    restore()
+
+    monkeypatch.setattr(inspections, 'CENSUS_JOIN', 'merge')
+    run(inspections, service)
+    expected = FakeSheetsService(serialize=False)
+    run(inspections, expected)
+
+    assert written_rows(service) == written_rows(expected)
+
+def test_merge_join_aggregates_only_emailed_carriers(inspections, monkeypatch):
+    lookup = FakeSheetsService(serialize=False)
+    run(inspections, lookup)
+
+    monkeypatch.setattr(inspections, 'CENSUS_JOIN', 'merge')
+    merge_partials = inspections.merge_partials
+    aggregated = set()
+
+    def recording(company_inspections, partials):
+        aggregated.update(partials)
+        return merge_partials(company_inspections, partials)
+    monkeypatch.setattr(inspections, 'merge_partials', recording)
+    merged = FakeSheetsService(serialize=False)
+    run(inspections, merged)
+
+    census = inspections.read_census_data(inspections.CENSUS_FILE)
+    assert aggregated and all(census[dot_number]['EMAIL_ADDRESS'] for dot_number in aggregated)
+    # Same carriers and values; a merge join writes them in DOT_NUMBER order.
+    assert written_rows(merged) == sorted(written_rows(lookup), key=lambda row: row[0])
@@ -0,0 +1,75 @@
+import csv
+import io
+
+import pytest
+
+from fmcsa_common import csv_blocks
+
+BLOCK_SCRIPTS = ['direct', 'icp', 'crashes', 'inspections']
+
+# A stray quote in an unquoted value, then a quoted field spanning lines, then rows that look like
+# records from the inside of that field if quotes are miscounted.
+STRAY_QUOTE_CSV = (
+    'DOT_NUMBER,UNIT_TYPE_DESC,NOTES\n'
+    '1001,12" TRAILER,plain\n'
+    '1002,VAN,"first line\n'
+    'second line",y\n'
+    '1003,"quoted ""escape""",z\n'
+    '1004,FLATBED,"a,b"tail\n'
+    '1005,x"y"z,""\n'
+)
+
+def csv_rows(text):
+    return list(csv.reader(io.StringIO(text, newline='')))
+
+def count_rows(text):
+    return len(csv_rows(text))
+
+@pytest.fixture
+def stray_quote_file(tmp_path):
+    path = tmp_path / 'stray_quote.csv'
+    path.write_bytes(STRAY_QUOTE_CSV.encode('utf-8'))
+    return str(path)
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('block_bytes', [1, 10, 40])
+def test_blocks_follow_csv_quoting(stray_quote_file, workers, block_bytes):
+    rows = []
+    for _, block in csv_blocks.parse_blocks(stray_quote_file, 'utf-8', csv_rows, workers=workers, block_bytes=block_bytes):
+        rows.extend(block)
+
+    assert rows == csv_rows(STRAY_QUOTE_CSV)[1:]
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_resume_from_block_end(stray_quote_file, workers):
+    ends = [end for end, _ in csv_blocks.parse_blocks(stray_quote_file, 'utf-8', count_rows, workers=1, block_bytes=10)]
+    resumed = list(csv_blocks.parse_blocks(stray_quote_file, 'utf-8', count_rows, workers=workers, block_bytes=10,
+                                           start_offset=ends[1]))
+
+    assert [end for end, _ in resumed] == ends[2:]
+    assert sum(rows for _, rows in resumed) == len(csv_rows(STRAY_QUOTE_CSV)) - 1 - 2
+
+def test_block_ends_are_record_boundaries(stray_quote_file):
+    with open(stray_quote_file, 'rb') as f:
+        data = f.read()
+    header_end = data.index(b'\n') + 1
+
+    blocks = csv_blocks.exact_record_blocks(stray_quote_file, 10, header_end)
+    assert blocks[0][0] == header_end and blocks[-1][1] == len(data)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(blocks, blocks[1:]))
+    rows = []
+    for start, end in blocks:
+        assert csv_blocks.skip_quoted_text(data[start:end], 0, end - start) == end - start
+        rows.extend(csv_rows(data[start:end].decode('utf-8')))
+    assert rows == csv_rows(STRAY_QUOTE_CSV)[1:]
+
+@pytest.mark.parametrize('name', BLOCK_SCRIPTS)
+def test_scripts_parse_with_their_own_settings(load_script, monkeypatch, stray_quote_file, name):
+    module = load_script(name)
+    monkeypatch.setattr(module, 'PARSE_WORKERS', 1)
+    monkeypatch.setattr(module, 'PARSE_BLOCK_BYTES', 10)
+
+    blocks = list(module.parse_blocks(stray_quote_file, 'utf-8', csv_rows))
+
+    assert len(blocks) == len(csv_blocks.exact_record_blocks(stray_quote_file, 10, STRAY_QUOTE_CSV.index('\n') + 1))
+    assert [row for _, block in blocks for row in block] == csv_rows(STRAY_QUOTE_CSV)[1:]
@@ -0,0 +1,62 @@
+import pytest
+
+from fmcsa_common import scrape_cache
+
+VEHICLE_PAGE = '<table><tr><th class="vehType">Truck Tractors</th><td>12</td></tr></table>'
+NO_VEHICLES_PAGE = '<html><body><div id="regInfo"><p>No records found for this carrier.</p></div></body></html>'
+CHALLENGE_PAGE = '<html><head><script src="/challenge.js"></script></head><body>Checking your browser...</body></html>'
+SCRIPT_PAGE = '<html><body><div id="app"></div><script src="/registration.js"></script></body></html>'
+
+class BrowserUsed(Exception):
+    pass
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+class FakeSession:
+    def __init__(self, text):
+        self.text = text
+
+    def get(self, url, timeout=None):
+        return FakeResponse(self.text)
+
+class FakeDriver:
+    def get(self, url):
+        raise BrowserUsed(url)
+
+@pytest.fixture
+def icp(load_script, monkeypatch, tmp_path):
+    module = load_script('icp')
+    monkeypatch.setattr(module, 'USE_HTTP_FETCH', True)
+    monkeypatch.setattr(module, 'SCRAPE_REQUESTS_PER_MINUTE', 10**9)
+    monkeypatch.setattr(module, 'SCRAPE_CACHE_FILE', str(tmp_path / 'scraping_cache.sqlite'))
+    return module
+
+@pytest.mark.parametrize('page, kind', [(VEHICLE_PAGE, 'vehicles'), (NO_VEHICLES_PAGE, 'no_vehicles'),
+                                        (NO_VEHICLES_PAGE.upper(), 'no_vehicles'), (CHALLENGE_PAGE, None),
+                                        (SCRIPT_PAGE, None), ('', None)])
+def test_classify_registration_page(icp, page, kind):
+    assert icp.classify_registration_page(page) == kind
+
+@pytest.mark.parametrize('page', [VEHICLE_PAGE, NO_VEHICLES_PAGE])
+def test_readable_pages_skip_chrome(icp, monkeypatch, page):
+    monkeypatch.setattr(icp, 'get_scrape_session', lambda: FakeSession(page))
+    assert icp.fetch_registration_page('https://example.com/1', FakeDriver()) == page
+
+@pytest.mark.parametrize('page', [CHALLENGE_PAGE, SCRIPT_PAGE])
+def test_unreadable_pages_fall_back_to_chrome(icp, monkeypatch, page):
+    monkeypatch.setattr(icp, 'get_scrape_session', lambda: FakeSession(page))
+    with pytest.raises(BrowserUsed):
+        icp.fetch_registration_page('https://example.com/1', FakeDriver())
+
+def test_no_vehicles_page_counts_as_zero_and_is_cached(icp, monkeypatch):
+    monkeypatch.setattr(icp, '_scrape_cache', scrape_cache.new_scrape_cache())
+    monkeypatch.setattr(icp, 'get_scrape_session', lambda: FakeSession(NO_VEHICLES_PAGE))
+
+    assert icp.collect_vehicle_counts('123', FakeDriver()) == {vehicle_type: 0 for vehicle_type in icp.VEHICLE_TYPES}
+    assert icp.get_cached_page(icp.VEHICLE_COUNT_URL.format('123')) == NO_VEHICLES_PAGE
+    icp._scrape_cache['db'].close()
@@ -0,0 +1,51 @@
+import csv
+import io
+import random
+import sys
+
+import pytest
+
+from fmcsa_common import row_sort
+
+def sample_rows(count, seed=0):
+    rng = random.Random(seed)
+    # Few distinct keys, so most rows tie with others, and the last field records input order.
+    return [[rng.choice(['ACME', 'BLUE', 'DELTA', 'EAGLE', 'RIVER']), f'{rng.randint(0, 99)}', str(i)] for i in range(count)]
+
+@pytest.mark.parametrize('memory_bytes, batch_rows', [(10**9, 1000), (2000, 7), (200, 1)])
+def test_merged_order_is_stable(monkeypatch, tmp_path, memory_bytes, batch_rows):
+    rows = sample_rows(500)
+    spilled = []
+    spill_run = row_sort.spill_run
+
+    def counting(*args):
+        spilled.append(len(args[0]))
+        return spill_run(*args)
+    monkeypatch.setattr(row_sort, 'spill_run', counting)
+
+    row_count, merged = row_sort.external_sort((list(row) for row in rows), lambda row: row[0], memory_bytes, batch_rows,
+                                               str(tmp_path))
+
+    assert row_count == len(rows)
+    assert list(merged) == sorted(rows, key=lambda row: row[0])
+    assert (len(spilled) > 10) == (memory_bytes < 10**9)
+
+def test_footprint_matches_getsizeof_for_csv_rows():
+    text = 'MC123456,1234567,ACME PROCESS AGENTS,,100 MAIN ST\r\n"a ""quoted"" field",x,,y,z\r\n'
+    for row in csv.reader(io.StringIO(text)):
+        assert row_sort.row_footprint(row) == 8 + sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+
+@pytest.mark.parametrize('name', ['crashes', 'boc3'])
+def test_scripts_sort_within_their_budget(load_script, monkeypatch, tmp_path, name):
+    module = load_script(name)
+    monkeypatch.setattr(module, 'SORT_MEMORY_BYTES', 1000)
+    monkeypatch.setattr(module, 'SORT_SPILL_DIR', str(tmp_path))
+    rows = sample_rows(300, seed=1)
+    spilled = []
+    spill_run = row_sort.spill_run
+    monkeypatch.setattr(row_sort, 'spill_run', lambda *args: spilled.append(args[1:]) or spill_run(*args))
+
+    row_count, merged = module.external_sort(iter(rows), lambda row: row[1])
+
+    assert list(merged) == sorted(rows, key=lambda row: row[1])
+    assert spilled and set(spilled) == {(module.SORT_SPILL_BATCH_ROWS, str(tmp_path))}
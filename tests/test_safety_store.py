@@ -0,0 +1,57 @@
+import csv
+import random
+
+import pytest
+
+AB_HEADERS = ['DOT_NUMBER', 'INSP_TOTAL', 'UNSAFE_DRIV_MEASURE', 'UNSAFE_DRIV_AC']
+C_HEADERS = ['DOT_NUMBER', 'INSP_TOTAL', 'VEH_MAINT_MEASURE', 'VEH_MAINT_AC']
+
+def write_sms_file(path, headers, rows):
+    with open(path, 'w', newline='', encoding='ascii') as file:
+        writer = csv.writer(file)
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+def sms_rows(rng, dot_numbers):
+    return [[str(dot_number), str(rng.randint(0, 40)), rng.choice(['', '0.5', '1.25', '"quoted, value"']),
+             rng.choice(['Y', 'N', ''])] for dot_number in dot_numbers]
+
+def dict_rows(path):
+    # How the files were read before the column store: one dict per carrier, the last row winning.
+    with open(path, newline='', encoding='ascii') as file:
+        return {row.pop('DOT_NUMBER'): row for row in csv.DictReader(file)}
+
+@pytest.fixture(params=['direct', 'icp'])
+def script(request, load_script, monkeypatch):
+    module = load_script(request.param)
+    # Small blocks, so the per-block dictionaries have to be merged.
+    monkeypatch.setattr(module, 'PARSE_WORKERS', 1)
+    monkeypatch.setattr(module, 'PARSE_BLOCK_BYTES', 500)
+    return module
+
+def test_encode_safety_block(script):
+    text = '12,3,0.5,Y\r\nnot a number,1,2,N\r\n7,3,,Y\r\n12,4\r\n'
+    dot_numbers, codes, values = script.encode_safety_block(text, 0, [1, 2, 3])
+
+    assert list(dot_numbers) == [12, 7, 12]
+    assert values == [['3', '4'], ['0.5', ''], ['Y', '']]
+    assert [list(column_codes) for column_codes in codes] == [[0, 0, 1], [0, 1, 1], [0, 0, 1]]
+
+def test_lookups_match_merged_dicts(script, tmp_path):
+    rng = random.Random(0)
+    ab_dot_numbers = rng.sample(range(1, 5000), 400)
+    c_dot_numbers = rng.sample(ab_dot_numbers, 150) + rng.sample(range(5000, 9000), 100)
+    # A carrier listed twice keeps its last row.
+    ab_dot_numbers += ab_dot_numbers[:20]
+    ab_file, c_file = tmp_path / 'sms_ab.txt', tmp_path / 'sms_c.txt'
+    write_sms_file(ab_file, AB_HEADERS, sms_rows(rng, ab_dot_numbers))
+    write_sms_file(c_file, C_HEADERS, sms_rows(rng, c_dot_numbers))
+
+    safety_data = script.merge_safety_data(script.read_safety_data(str(ab_file)), script.read_safety_data(str(c_file)))
+
+    assert safety_data['headers'] == ['INSP_TOTAL', 'UNSAFE_DRIV_MEASURE', 'UNSAFE_DRIV_AC', 'VEH_MAINT_MEASURE', 'VEH_MAINT_AC']
+    ab_rows, c_rows = dict_rows(ab_file), dict_rows(c_file)
+    for dot_number in set(ab_rows) | set(c_rows) | {'0', '9999', 'ABC', ''}:
+        merged = {header: '' for header in safety_data['headers']}
+        merged.update({**ab_rows.get(dot_number, {}), **c_rows.get(dot_number, {})})
+        assert script.lookup_safety_row(safety_data, dot_number) == list(merged.values()), dot_number
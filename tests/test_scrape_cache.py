@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from fmcsa_common import scrape_cache
+
+TTLS = [(r'/short/', 60)]
+CHALLENGE_PAGE = '<html><head><script src="/challenge.js"></script></head><body>Checking your browser...</body></html>'
+
+@pytest.fixture
+def cache(tmp_path):
+    state = scrape_cache.new_scrape_cache()
+    yield state, str(tmp_path / 'cache.sqlite')
+    if state['db'] is not None:
+        state['db'].close()
+
+def test_pages_expire_by_their_url_pattern(cache):
+    state, cache_file = cache
+    old = time.time() - 3600
+    scrape_cache.cache_page(state, cache_file, 'https://example.com/short/1', 'short page', 10**6, fetched_at=old)
+    scrape_cache.cache_page(state, cache_file, 'https://example.com/long/1', 'long page', 10**6, fetched_at=old)
+
+    def get(url):
+        return scrape_cache.get_cached_page(state, cache_file, url, TTLS, 86400)
+    assert get('https://example.com/short/1') is None
+    assert get('https://example.com/long/1') == 'long page'
+    assert get('https://example.com/long/2') is None
+    assert scrape_cache.cached_urls(state, cache_file, ['https://example.com/short/1', 'https://example.com/long/1'],
+                                    TTLS, 86400) == {'https://example.com/long/1'}
+    assert {key: state['stats'][key] for key in ('hits', 'misses', 'expired')} == {'hits': 1, 'misses': 1, 'expired': 1}
+
+def test_identical_pages_share_a_body_and_eviction_drops_the_oldest(cache):
+    state, cache_file = cache
+    for i in range(3):
+        scrape_cache.cache_page(state, cache_file, f'https://example.com/missing/{i}', 'Record Not Found', 10**6)
+    db = state['db']
+    assert db.execute("SELECT COUNT(*) FROM bodies").fetchone()[0] == 1
+
+    pages = [f'page {i} ' + 'x' * 2000 + str(i) for i in range(50)]
+    for i, page in enumerate(pages):
+        scrape_cache.cache_page(state, cache_file, f'https://example.com/page/{i}', page, 1000)
+    assert state['size'] <= 1000
+    assert scrape_cache.get_cached_page(state, cache_file, 'https://example.com/page/49', [], None) == pages[-1]
+    assert scrape_cache.get_cached_page(state, cache_file, 'https://example.com/page/0', [], None) is None
+
+def test_unexpected_pages_are_not_stored(cache):
+    state, cache_file = cache
+    url = 'https://example.com/page'
+    assert not scrape_cache.cache_page(state, cache_file, url, CHALLENGE_PAGE, 10**6, lambda page: 'vehType' in page)
+    assert scrape_cache.get_cached_page(state, cache_file, url, [], None) is None
+    assert state['stats']['rejected'] == 1 and state['stats']['stores'] == 0
+
+@pytest.mark.parametrize('name, url, page', [
+    ('icp', 'https://ai.fmcsa.dot.gov/SMS/Carrier/123/CarrierRegistration.aspx',
+     '<table><tr><th class="vehType">Truck Tractors</th><td>12</td></tr></table>'),
+    ('revocations', 'https://safer.fmcsa.dot.gov/query.asp?query_string=123',
+     '<table><tr><th>Legal Name:</th><td>ACME TRUCKING LLC</td></tr></table>'),
+    ('revocations', 'https://safer.fmcsa.dot.gov/query.asp?query_string=999',
+     '<html><body><h1>Record Not Found</h1></body></html>'),
+])
+def test_scripts_only_cache_the_pages_they_scrape(load_script, monkeypatch, tmp_path, name, url, page):
+    module = load_script(name)
+    monkeypatch.setattr(module, 'SCRAPE_CACHE_FILE', str(tmp_path / 'scraping_cache.sqlite'))
+    monkeypatch.setattr(module, '_scrape_cache', scrape_cache.new_scrape_cache())
+
+    module.cache_page(url, CHALLENGE_PAGE)
+    assert module.get_cached_page(url) is None
+    module.cache_page(url, page)
+    assert module.get_cached_page(url) == page
+    module._scrape_cache['db'].close()
@@ -0,0 +1,52 @@
+import random
+
+import pandas as pd
+import pytest
+
+HEADERS = ['DOT_NUMBER', 'AUTHORIZED_FOR_HIRE', 'NBR_POWER_UNIT', 'VEHICLE_OOS_INSP_TOTAL', 'PHY_STATE']
+CLAUSES = [
+    ('AUTHORIZED_FOR_HIRE', '!=', 'N'),
+    ('NBR_POWER_UNIT', 'between', 10, 50),
+    ('any', [('VEHICLE_OOS_INSP_TOTAL', '>=', 5), ('PHY_STATE', 'between', 'OK', 'TX')]),
+]
+
+@pytest.fixture
+def icp(load_script):
+    return load_script('icp')
+
+def test_filter_columns(icp):
+    assert icp.filter_columns(CLAUSES) == (['AUTHORIZED_FOR_HIRE', 'NBR_POWER_UNIT', 'VEHICLE_OOS_INSP_TOTAL', 'PHY_STATE'],
+                                          ['NBR_POWER_UNIT', 'VEHICLE_OOS_INSP_TOTAL'])
+    assert icp.filter_columns(icp.SEGMENT_FILTER)[1] == ['NBR_POWER_UNIT', 'VEHICLE_OOS_INSP_TOTAL', 'VEH_MAINT_INSP_W_VIOL']
+    with pytest.raises(ValueError, match='Unknown filter operator'):
+        icp.filter_columns([('any', [('NBR_POWER_UNIT', '=>', 5)])])
+
+def test_split_filter(icp):
+    census_clauses, joined_clauses = icp.split_filter(CLAUSES, ['AUTHORIZED_FOR_HIRE', 'NBR_POWER_UNIT', 'PHY_STATE'])
+    assert census_clauses == CLAUSES[:2]
+    assert joined_clauses == CLAUSES[2:]
+
+@pytest.mark.parametrize('row, expected', [
+    (['1', 'A', '10', '5', 'CA'], True),
+    (['2', 'A', '50', '0', 'OK'], True),
+    (['3', 'A', ' 20 ', '+7', 'CA'], True),  # Padded and signed integers parse
+    (['4', 'N', '20', '9', 'TX'], False),
+    (['5', 'A', '51', '9', 'TX'], False),
+    (['6', 'A', '9', '9', 'TX'], False),
+    (['7', 'A', '20', '4', 'CA'], False),
+    (['8', 'A', '', '9', 'TX'], False),  # Rows with an unparseable numeric column are left out
+    (['9', 'A', '20', '4.0', 'TX'], False),  # Even when the clause that uses it wouldn't be needed
+])
+def test_compile_row_filter(icp, row, expected):
+    assert icp.compile_row_filter(CLAUSES, HEADERS)(row) is expected
+
+def test_row_filter_and_mask_agree(icp):
+    rng = random.Random(0)
+    numbers = ['0', '5', '10', '25', '50', '51', ' 7 ', '-3', '', 'N/A', '1.5']
+    rows = [[str(i), rng.choice('AN'), rng.choice(numbers), rng.choice(numbers), rng.choice(['CA', 'OK', 'TX', 'WA', ''])]
+            for i in range(2000)]
+    row_filter = icp.compile_row_filter(CLAUSES, HEADERS)
+    mask = icp.filter_mask(CLAUSES, pd.DataFrame(rows, columns=HEADERS))
+
+    assert mask.tolist() == [row_filter(row) for row in rows]
+    assert 0 < mask.sum() < len(rows)
@@ -0,0 +1,30 @@
+import time
+from types import SimpleNamespace
+
+from fmcsa_common import sheets_quota
+
+QUOTA = 600  # Ten calls a second
+BURST = 3
+
+def timed_calls(limiter, calls):
+    start = time.monotonic()
+    for _ in range(calls):
+        sheets_quota.wait_for_quota(limiter, QUOTA, BURST, recovery_seconds=60)
+    return time.monotonic() - start
+
+def test_burst_then_quota_rate():
+    limiter = sheets_quota.new_rate_limiter(QUOTA, BURST)
+
+    assert timed_calls(limiter, BURST) < 0.05
+    assert 0.45 < timed_calls(limiter, 5) < 0.7
+
+def test_rate_limited_pauses_every_caller_and_halves_the_rate():
+    limiter = sheets_quota.new_rate_limiter(QUOTA, BURST)
+    error = SimpleNamespace(resp={'retry-after': '0.3'})
+
+    sheets_quota.note_rate_limited(limiter, error, QUOTA, floor=0.1, default_pause=15)
+    sheets_quota.note_rate_limited(limiter, error, QUOTA, floor=0.1, default_pause=15)  # Same 429 seen by another thread
+
+    assert limiter['rate'] == QUOTA / 60.0 / 2
+    # Retry-After, then a token at the halved rate.
+    assert 0.45 < timed_calls(limiter, 1) < 0.7
@@ -0,0 +1,59 @@
+import os
+import random
+import threading
+
+import pytest
+
+from fake_sheets import FakeSheetsService
+from run_offline import FAKE_SPREADSHEET_ID
+import synthetic_data
+from fmcsa_common import sheets_quota
+
+CARRIERS = 500
+
+def setup_boc3(module, rng, dot_numbers):
+    synthetic_data.write_boc3_file(module.BOC3_FILE, dot_numbers, CARRIERS * 2, rng, synthetic_data.read_city_pool())
+    return lambda service: module.process_boc3_csv(module.BOC3_FILE, service, FAKE_SPREADSHEET_ID,
+                                                   service_factory=lambda: service)
+
+def setup_crashes(module, rng, dot_numbers):
+    for path in (module.CRASHES_FILE, module.CENSUS_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    synthetic_data.write_census_file(module.CENSUS_FILE, dot_numbers, rng, synthetic_data.read_city_pool())
+    synthetic_data.write_crashes_file(module.CRASHES_FILE, dot_numbers, CARRIERS * 2, rng)
+    synthetic_data.write_readme(module.README_FILE, synthetic_data.CRASH_HEADERS)
+    return lambda service: module.process_csv(module.CRASHES_FILE, module.CENSUS_FILE, service, FAKE_SPREADSHEET_ID,
+                                              service_factory=lambda: service)
+
+def upload_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('ThreadPoolExecutor')]
+
+@pytest.mark.parametrize('name, setup', [('boc3', setup_boc3), ('crashes', setup_crashes)])
+def test_failed_tab_shuts_the_upload_pool_down(load_script, monkeypatch, tmp_path, name, setup):
+    module = load_script(name)
+    work_dir = tmp_path / 'work'
+    work_dir.mkdir()
+    monkeypatch.chdir(work_dir)
+    rng = random.Random(0)
+    run = setup(module, rng, synthetic_data.census_dot_numbers(CARRIERS, rng))
+    for constant, value in {'ROWS_PER_SHEET': 50, 'UPLOAD_WORKERS': 2, 'SHEETS_QUOTA_PER_USER': 10**9,
+                            'SHEETS_QUOTA_PER_PROJECT': 10**9, 'SHEETS_BURST': 10**9}.items():
+        monkeypatch.setattr(module, constant, value)
+    sheets_quota.reset_rate_limiter(module._rate_limiter, 10**9, 10**9)
+    create_new_sheet = module.create_new_sheet
+    created = []
+
+    def failing(*args, **kwargs):
+        # Enough tabs first that uploads are still queued and running when this one fails. The
+        # row loops log and carry on after an Exception, so the failure has to get past them.
+        if len(created) == 6:
+            raise KeyboardInterrupt('simulated interruption')
+        created.append(args[2])
+        return create_new_sheet(*args, **kwargs)
+    monkeypatch.setattr(module, 'create_new_sheet', failing)
+    threads_before = upload_threads()
+
+    with pytest.raises(KeyboardInterrupt):
+        run(FakeSheetsService(latency=0.01))
+
+    assert upload_threads() == threads_before